@@ -1,6 +1,10 @@
+import copy
+import hashlib
+import json
 import logging
 import os
 import re
+import tempfile
 
 from app import utils
 
@@ -10,37 +14,93 @@ log = logging.getLogger(__name__)
 class App(object):
     _singleton = dict()
 
-    _jinja_dict = None
+    # rendered config dicts, keyed by App._cache_key of their inputs
+    _jinja_dicts = dict()
+
+    # the version of the render and of the cached dicts, part of every cache key, so a
+    # process never reads a dict cached by code that rendered or stored it differently
+    cache_version = 2
+
+    # rendered config dicts are also kept on disk here, so a new process skips the render
+    cache_dir = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'options-screener')
 
     def __init__(self):
         # Return a singleton
         self.__dict__ = App._singleton
 
     def get_config_dict(self, ctx, list_of_files=[], initial_dict={}):
+        env = {k: v for k, v in os.environ.items() if k.startswith('OPTIONS_')}
+        paths = [os.path.join(ctx.home, filename) for filename in list_of_files]
+
         # Manually cache, since memoization doesn't work with dict values
-        if App._jinja_dict is not None:
-            return App._jinja_dict
+        key = App._cache_key(paths, env, initial_dict)
+        if key in App._jinja_dicts:
+            return App._jinja_dicts[key]
+        r = App._read_cache(key)
+        if r is not None:
+            App._jinja_dicts[key] = r
+            return r
 
-        d = initial_dict
+        d = copy.deepcopy(initial_dict)
 
         # Make all environment variables starting with 'OPTIONS_'
         # accessible from the dict.
-        for k, v in os.environ.items():
-            if k.startswith('OPTIONS_'):
-                if 'env' not in d:
-                    d['env'] = {}
-                d['env'][k] = v
+        if env:
+            d.setdefault('env', {}).update(env)
 
         # Add the config files as part of the dict
-        for filename in list_of_files:
+        for filename, path in zip(list_of_files, paths):
             m = re.match(r"^(.*)\.yaml$", filename)
             assert m is not None, ("Unable to parse config base name from file {}".format(filename))
-            key = m.group(1)
-            d[key] = utils.YamlUtils.yaml_dict_from_file(os.path.join(ctx.home, filename))
+            key_name = m.group(1)
+            d[key_name] = utils.YamlUtils.yaml_dict_from_file(path)
 
         # Render values containing nested jinja variables
-        r = utils.JinjaUtils.dict_self_render(d)
+        graph = utils.TemplateGraph(d)
+        r = graph.render()
 
-        # Set the cache
-        App._jinja_dict = r
+        # Set the cache, unless the render would differ the next time
+        App._jinja_dicts[key] = r
+        if not graph.volatile:
+            App._write_cache(key, r)
         return r
+
+    @staticmethod
+    def _cache_key(paths, env, initial_dict):
+        # the files are identified by their path, modification time and size
+        files = []
+        for path in paths:
+            try:
+                st = os.stat(path)
+                files.append([os.path.abspath(path), st.st_mtime_ns, st.st_size])
+            except OSError:
+                files.append([os.path.abspath(path), None, None])
+        inputs = {'version': App.cache_version, 'files': files, 'env': env, 'initial': initial_dict}
+        inputs = json.dumps(inputs, sort_keys=True, default=str)
+        return hashlib.sha256(inputs.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _read_cache(key):
+        try:
+            with open(os.path.join(App.cache_dir, 'config-{}.json'.format(key))) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _write_cache(key, dict_):
+        # write to a temporary file only the user can read, then rename, so readers never see
+        # partial files.  The dict holds the OPTIONS_* environment.
+        try:
+            os.makedirs(App.cache_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=App.cache_dir, suffix='.tmp')
+        except OSError as e:
+            log.debug("Unable to cache the config dict error=[{}]".format(e))
+            return
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(dict_, f)
+            os.replace(tmp_path, os.path.join(App.cache_dir, 'config-{}.json'.format(key)))
+        except (OSError, TypeError, ValueError) as e:
+            log.debug("Unable to cache the config dict error=[{}]".format(e))
+            utils.FileUtils.ensure_removed(tmp_path)
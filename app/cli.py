@@ -1,8 +1,11 @@
+import ast
 import os
 import sys
 import click
 import logging
 
+from app import trace
+
 FORMAT = '%(asctime)s %(levelname)s:%(filename)s:%(lineno)d %(message)s'
 logging.basicConfig(format=FORMAT, level=logging.INFO)
 log = logging.getLogger(__name__)
@@ -52,15 +55,51 @@ class AppCLI(click.MultiCommand):
             return
         return mod.cli
 
+    def format_commands(self, ctx, formatter):
+        """List the commands with the help of their cli group, read without importing them"""
+        commands = [(name, command_help(name)) for name in self.list_commands(ctx)]
+        if not commands:
+            return
+        limit = formatter.width - 6 - max(len(name) for name, _ in commands)
+        with formatter.section('Commands'):
+            formatter.write_dl([(name, click.utils.make_default_short_help(text, limit)) for name, text in commands])
+
+
+def command_help(name):
+    """Return the docstring of the cli group in cmd_<name>.py, parsed but not executed"""
+    with open(os.path.join(cmd_folder, 'cmd_' + name + '.py')) as f:
+        module = ast.parse(f.read())
+    for node in module.body:
+        if isinstance(node, ast.FunctionDef) and node.name == 'cli':
+            return ast.get_docstring(node) or ''
+    return ''
+
 
 @click.command(cls=AppCLI, context_settings=CONTEXT_SETTINGS)
 @click.option('--home',
               type=click.Path(exists=True, file_okay=False, resolve_path=True),
               help='Changes the folder to operate on.')
 @click.option('-v', '--verbose', is_flag=True, help='Enables verbose mode.')
+@click.option('--trace',
+              'trace_json',
+              type=click.Path(dir_okay=False, writable=True),
+              help='Time every stage and ticker, write a Chrome trace to this file and print a summary.')
 @pass_context
-def app(ctx, verbose, home):
+def app(ctx, verbose, home, trace_json):
     """The app command line interface."""
     ctx.verbose = verbose
     if home is not None:
         ctx.home = home
+    if trace_json is not None:
+        trace.start()
+        click.get_current_context().call_on_close(lambda: write_trace(ctx, trace_json))
+
+
+def write_trace(ctx, filename):
+    """Stop tracing, write the trace to filename and log the summary"""
+    tracer = trace.stop()
+    if tracer is None:
+        return
+    tracer.write(filename)
+    ctx.log(tracer.summary())
+    ctx.log('Trace written to {}'.format(filename))
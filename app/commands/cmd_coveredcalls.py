@@ -1,9 +1,24 @@
 import datetime
 import click
+import collections
+import functools
 import logging
+import numpy as np
+import pandas as pd
 
 from app import app
 from app import cli as app_cli
+from app import csvstream
+from app import envelopes
+from app import filters
+from app import greeks
+from app import kernels
+from app import normalize
+from app import pipeline
+from app import snapshots
+from app import trace
+from app import watch
+from app import tdameritrade
 
 from app.tdameritrade import TDAmeritrade
 
@@ -15,12 +30,44 @@ today = datetime.datetime.today()
 #####################################################################
 # Settings
 
-# cache settings
-seconds_to_cache = 60 * 30  # 30 minutes
-
 # use s_askPrice instead of s_lastPrice to be more conservative in all subsequent calculations
 stock_price = 's_askPrice'
 
+# CSV columns to sort by
+sort_cols = ['xo_staticRetAnn%', 'xo_staticRet%', 'xo_assignedRetAnn%']
+
+# the column keying each contract to the quote of its underlying
+stock_key = 's_symbol'
+
+# underlyings per bulk quote request, the quotes endpoint takes a comma separated list of symbols
+QUOTE_CHUNK = 200
+
+# screened contracts and the quotes of their underlyings, one row per symbol.  The
+# contracts carry only the stock_key of their underlying, which is joined back in
+# for the rows that make it to the output.
+Chains = collections.namedtuple('Chains', ['options', 'underlyings'])
+
+# screen predicates, overridden by filters: covered_calls: in config.yaml
+default_filter = filters.ScreenFilter(
+    raw=[
+        "o_putCall == 'CALL'",  # calls
+        'o_daysToExpiration >= 7',  # at least a week from expiration
+        'o_strikePrice > s_askPrice',  # out of the money
+        'o_totalVolume > 1',  # volume greater than 1
+        'o_openInterest > 20',  # open interest greater than 20
+        'o_bid > 0.25',  # bid greater than 0.25
+    ],
+    ticker_column='s_symbol')
+
+# the columns the fetch envelope of a filter is read from: the chain requested holds only the
+# contracts that can pass it, such as calls at least a week out by default.  The server decides
+# the money by the underlying price of the chain, not the ask, so only strikes compared with
+# o_underlyingPrice request a range.
+envelope_columns = envelopes.Columns(contract_type='o_putCall',
+                                     strike='o_strikePrice',
+                                     underlying='o_underlyingPrice',
+                                     days='o_daysToExpiration')
+
 #####################################################################
 # Click Code
 
@@ -35,8 +82,24 @@ def cli():
 @cli.command()
 @click.argument('config_yaml')
 @click.argument('output_csv')
+@click.option('--workers',
+              default=pipeline.DEFAULT_WORKERS,
+              show_default=True,
+              help='Number of tickers to fetch concurrently.')
+@click.option('--stream',
+              is_flag=True,
+              help='Append each ticker to the output as it is ready, then sort the file once all are done.')
+@click.option('--snapshots',
+              'snapshot_dir',
+              type=click.Path(file_okay=False),
+              help='Read quotes and chains through a Parquet snapshot store in this folder.')
+@click.option('--max-age',
+              default=snapshots.DEFAULT_MAX_AGE,
+              show_default=True,
+              help='Seconds a snapshot stays fresh enough to skip the network.')
+@click.option('--float32', is_flag=True, help='Hold fetched float columns as float32 to halve their memory.')
 @app_cli.pass_context
-def run(ctx, config_yaml, output_csv):
+def run(ctx, config_yaml, output_csv, workers, stream, snapshot_dir, max_age, float32):
     """This command loads config.yaml and the current ENV-ironment,
     creates a single merged dict, and prints to stdout.
     """
@@ -45,40 +108,108 @@ def run(ctx, config_yaml, output_csv):
     c = app.get_config_dict(ctx, [config_yaml])
 
     # get the client
-    tda = TDAmeritrade()
-    tdc = tda.getClient()
-
-    # all data will also be combined into one CSV
-    all_df = None
-
-    for ticker in c['config']['options']['covered_calls']:
-
-        # fetch all data
-        stock = tdc.quoteDF(ticker)
-        option = tdc.optionsDF(ticker)
-
-        # process the data
-        df = covered_calls_process_dataframe(stock, option)
+    store = None
+    if snapshot_dir is not None:
+        store = snapshots.SnapshotStore(snapshot_dir, max_age=max_age)
+    tda = TDAmeritrade(snapshots=store)
+    tdc = tda.get_client()
+
+    tickers = c['config']['options']['covered_calls']
+    try:
+        screen_filter = filters.ScreenFilter.from_config(c['config'], 'covered_calls', default_filter)
+        market = greeks.Market.from_config(c['config'])
+    except (filters.FilterError, ValueError) as e:
+        raise click.ClickException(str(e))
+
+    # stream each ticker to the output as it is ready
+    if stream:
+        counts = pipeline.RowCounts()
+        p = covered_calls_stream(tdc,
+                                 tickers,
+                                 output_csv,
+                                 workers=workers,
+                                 counts=counts,
+                                 screen_filter=screen_filter,
+                                 float32=float32,
+                                 market=market)
+        if p.failures:
+            ctx.log(p.report())
+        if not p.results:
+            raise click.ClickException("No tickers could be screened")
+        ctx.log(counts.report())
+        return
+
+    # fetch and process the tickers concurrently
+    counts = pipeline.RowCounts()
+    chains, p = covered_calls_screen(tdc,
+                                     tickers,
+                                     workers=workers,
+                                     counts=counts,
+                                     screen_filter=screen_filter,
+                                     float32=float32,
+                                     market=market)
+    if p.failures:
+        ctx.log(p.report())
+    if chains is None:
+        raise click.ClickException("No tickers could be screened")
+
+    # output the chains, which contain all of the tickers
+    covered_calls_csv_out(output_csv, chains, counts=counts, screen_filter=screen_filter)
+    ctx.log(counts.report())
+
+
+@cli.command('watch')
+@click.argument('config_yaml')
+@click.argument('output_csv')
+@click.option('--interval',
+              default=watch.DEFAULT_INTERVAL,
+              show_default=True,
+              help='Seconds between the start of each fetch cycle.')
+@click.option('--cycles', type=int, help='Stop after this many cycles instead of running until interrupted.')
+@click.option('--workers',
+              default=pipeline.DEFAULT_WORKERS,
+              show_default=True,
+              help='Number of tickers to fetch concurrently.')
+@click.option('--float32', is_flag=True, help='Hold fetched float columns as float32 to halve their memory.')
+@app_cli.pass_context
+def watch_command(ctx, config_yaml, output_csv, interval, cycles, workers, float32):
+    """This command loads config.yaml and keeps OUTPUT_CSV up to date,
+    re-screening only the tickers whose chains changed each cycle.
+    """
 
-        # ensure the all_df (contains all data from all tickers)
-        if all_df is None:
-            all_df = df.copy(deep=True)
-        else:
-            all_df = all_df.append(df)
+    # read the configuration file
+    c = app.get_config_dict(ctx, [config_yaml])
 
-    # output the all_df, which contains all of the tickers
-    covered_calls_csv_out(output_csv, all_df)
+    # get the client
+    tdc = TDAmeritrade().get_client()
+
+    tickers = c['config']['options']['covered_calls']
+    try:
+        screen_filter = filters.ScreenFilter.from_config(c['config'], 'covered_calls', default_filter)
+        market = greeks.Market.from_config(c['config'])
+    except (filters.FilterError, ValueError) as e:
+        raise click.ClickException(str(e))
+
+    w = covered_calls_watcher(tdc,
+                              output_csv,
+                              workers=workers,
+                              screen_filter=screen_filter,
+                              float32=float32,
+                              market=market)
+    try:
+        for cycle in w.watch(tickers, interval=interval, cycles=cycles):
+            if cycle.pipeline.failures:
+                ctx.log(cycle.pipeline.report())
+            ctx.log(cycle.report())
+    except KeyboardInterrupt:
+        pass
 
 
 #####################################################################
 # Functions
 
 
-def covered_calls_csv_out(filename, df):
-
-    # CSV columns to sort by
-    sort_cols = ['xo_staticRetAnn%', 'xo_staticRet%', 'xo_assignedRetAnn%']
-
+def covered_calls_csv_out(filename, chains, stream=None, counts=None, screen_filter=default_filter):
     # CSV columns to export first.  All fields will be included afterwards
     first_cols = [
         # 'xo_premium',
@@ -103,50 +234,269 @@ def covered_calls_csv_out(filename, df):
         'o_volatility',
     ]
 
+    # the filter only needs the stock columns it reads, the output needs all of them
+    options_df = chains.options
+    with trace.stage('derived predicates') as span:
+        df = covered_calls_join_dataframe(options_df, chains.underlyings, columns=screen_filter.columns)
+        filtered = covered_calls_join_dataframe(options_df.loc[screen_filter.mask(df)], chains.underlyings)
+        span.rows = len(filtered)
+    if counts is not None:
+        counts.add('derived predicates', len(filtered))
+
     # reorder the cols so that first_cols are first
-    csv_cols = df.columns.to_list().copy()
+    csv_cols = filtered.columns.to_list().copy()
     tmp_cols = []
     for c in first_cols:
         if c not in csv_cols:
-            print(f"{c} is not in csv_cols")
+            log.warning("{} is not in the covered calls columns".format(c))
+            continue
         csv_cols.remove(c)
         tmp_cols.append(c)
     csv_cols = tmp_cols + csv_cols
 
-    # calls
-    # out of the money
-    # greater than 2 weeks from expiration
-    # volume greater than 1
-    # open interest greater than 10
-    filtered = df.loc[True
-                      & (df['o_putCall'] == 'CALL')
-                      & (df['o_daysToExpiration'] >= 7)
-                      & (df['o_strikePrice'] > df['s_askPrice'])  # Uncomment to only show out of the money
-                      & (df['o_totalVolume'] > 1)
-                      & (df['o_openInterest'] > 20)
-                      & (df['o_bid'] > 0.25)]
-
-    ret = filtered.sort_values(by=sort_cols, ascending=False).to_csv(filename,
-                                                                     columns=csv_cols,
-                                                                     index=False,
-                                                                     float_format='%.2f')
+    with trace.stage('csv') as span:
+        span.rows = len(filtered)
+
+        # in stream mode, append the rows to the output and keep a sorted run for the final merge
+        if stream is not None:
+            return stream.add(filtered, csv_cols)
+
+        ret = filtered.sort_values(by=sort_cols, ascending=False).to_csv(filename,
+                                                                         columns=csv_cols,
+                                                                         index=False,
+                                                                         float_format='%.2f')
     return ret
 
 
-def covered_calls_process_dataframe(stock_df, options_df):
-    # reset_index()
-    #   copies multi-index values into columns
-    #   sets index to single ordinal integer
+def covered_calls_screen(tdc,
+                         tickers,
+                         workers=pipeline.DEFAULT_WORKERS,
+                         counts=None,
+                         screen_filter=default_filter,
+                         float32=False,
+                         market=greeks.default_market):
+    """Fetch and process every ticker, returning (chains, pipeline)
+
+    The quotes of every ticker are fetched up front in bulk, and only the
+    tickers whose quotes pass the raw predicates over s_* columns alone have
+    their chains fetched.  The raw predicates are applied to each ticker as
+    it arrives, the survivors are concatenated once, and the derived columns
+    are computed in one batch over the combined frame.  chains is None if no
+    ticker could be fetched.
+    """
+    def prepare(ticker, data):
+        return covered_calls_prepare_dataframe(*data, counts=counts, screen_filter=screen_filter)
+
+    quotes = covered_calls_quotes(tdc, tickers)
+    tickers = covered_calls_prefilter(quotes, tickers, screen_filter)
+    p = pipeline.Pipeline(covered_calls_fetcher(tdc, screen_filter, float32, quotes), prepare, workers=workers)
+    frames = p.run(tickers)
+    if not frames:
+        return None, p
+
+    # chains contains all data from all tickers
+    return covered_calls_metrics_dataframe(covered_calls_concat(frames), market=market), p
+
+
+def covered_calls_stream(tdc,
+                         tickers,
+                         filename,
+                         workers=pipeline.DEFAULT_WORKERS,
+                         counts=None,
+                         screen_filter=default_filter,
+                         float32=False,
+                         market=greeks.default_market):
+    """Fetch and process every ticker, streaming its rows to filename
+
+    Each ticker is processed and filtered on its own, and its rows are
+    appended to filename as soon as they are ready.  Once every ticker is
+    done, filename is rewritten globally sorted by a k-way merge of the
+    per-ticker runs.  Quotes are fetched in bulk and prefiltered as in
+    covered_calls_screen.  Returns the pipeline.
+    """
+    stream = csvstream.SortedCsvStream(filename, sort_cols, ascending=False)
+
+    def process(ticker, data):
+        chains = covered_calls_prepare_dataframe(*data, counts=counts, screen_filter=screen_filter)
+        chains = covered_calls_metrics_dataframe(chains, market=market)
+        return covered_calls_csv_out(filename, chains, stream=stream, counts=counts, screen_filter=screen_filter)
+
+    with stream:
+        quotes = covered_calls_quotes(tdc, tickers)
+        tickers = covered_calls_prefilter(quotes, tickers, screen_filter)
+        p = pipeline.Pipeline(covered_calls_fetcher(tdc, screen_filter, float32, quotes), process, workers=workers)
+        runs = p.run(tickers)
+        with trace.stage('merge'):
+            stream.merge(runs)
+    return p
+
+
+def covered_calls_watcher(tdc,
+                          filename,
+                          workers=pipeline.DEFAULT_WORKERS,
+                          screen_filter=default_filter,
+                          float32=False,
+                          market=greeks.default_market):
+    """Return a Watcher that keeps filename up to date
+
+    Each ticker is processed and filtered on its own, and only the tickers
+    whose chains changed since the last cycle are processed again.
+    """
+    output = csvstream.PatchedCsv(filename, sort_cols, ascending=False)
+
+    def process(ticker, data):
+        chains = covered_calls_prepare_dataframe(*data, screen_filter=screen_filter)
+        chains = covered_calls_metrics_dataframe(chains, market=market)
+        return covered_calls_csv_out(filename, chains, stream=output, screen_filter=screen_filter)
+
+    return watch.Watcher(covered_calls_fetcher(tdc, screen_filter, float32), process, output.write, workers=workers)
+
+
+def covered_calls_columns(screen_filter=default_filter):
+    """Return the fetched option columns read by the filter, without their o_ prefix"""
+    return [c[2:] for c in screen_filter.columns if c.startswith('o_')]
+
+
+def covered_calls_fetcher(tdc, screen_filter=default_filter, float32=False, quotes=None):
+    """Return fetch(ticker), which fetches the quote and the normalized chain through tdc
+
+    With quotes from covered_calls_quotes, the quote is read from them.
+    Only the envelope of the filter is requested from the chain.
+    """
+    return functools.partial(covered_calls_fetch,
+                             tdc,
+                             columns=covered_calls_columns(screen_filter),
+                             float32=float32,
+                             quotes=quotes,
+                             envelope=covered_calls_envelope(screen_filter))
+
+
+def covered_calls_envelope(screen_filter=default_filter):
+    """Return the envelopes.Envelope of the contracts that can pass the filter"""
+    return envelopes.Envelope.from_filter(screen_filter, envelope_columns)
+
+
+def covered_calls_fetch(tdc, ticker, columns=(), float32=False, quotes=None, envelope=None):
+    if quotes is not None and ticker.upper() in quotes.index:
+        stock_df = quotes.loc[[ticker.upper()]].reset_index(drop=True)
+    else:
+        with trace.stage('quote'):
+            stock_df = tdc.quoteDF(ticker)
+    params = tdameritrade.chain_params(envelope) if envelope is not None else {}
+    with trace.stage('options') as span:
+        options_df = tdc.optionsDF(ticker, **params)
+        span.rows = len(options_df)
+    with trace.stage('normalize'):
+        options_df = tdameritrade.normalize_options_dataframe(options_df, required=columns, float32=float32)
+    return stock_df, options_df
+
+
+def covered_calls_quotes(tdc, tickers, chunk=QUOTE_CHUNK):
+    """Return the quotes of tickers, indexed by symbol, fetched chunk symbols per request
+
+    A ticker missing from the quotes, because the endpoint did not know it
+    or its request failed, is left to covered_calls_fetch to quote alone.
+    """
+    symbols = list(dict.fromkeys(t.upper() for t in tickers))
+    frames = []
+    for i in range(0, len(symbols), chunk):
+        batch = symbols[i:i + chunk]
+        try:
+            with trace.stage('quotes') as span:
+                df = tdc.quoteDF(','.join(batch))
+                span.rows = len(df)
+        except Exception as e:
+            log.warning("Failed to quote {} tickers from {} error=[{}]".format(len(batch), batch[0], e))
+            continue
+        frames.append(df)
+    if not frames:
+        return pd.DataFrame(columns=['symbol'])
+    quotes = pd.concat(frames, ignore_index=True)
+    quotes.index = pd.Index(quotes['symbol'].to_numpy())
+    return quotes.loc[~quotes.index.duplicated()]
+
+
+def covered_calls_prefilter(quotes, tickers, screen_filter=default_filter):
+    """Return the tickers worth fetching chains for: those whose quotes pass the raw predicates over s_* columns
+
+    Tickers without a quote are kept, their fetch reports what went wrong.
+    """
+    underlyings = quotes.add_prefix('s_')
+    passed = set(quotes.index[screen_filter.readable_raw_mask(underlyings)])
+    kept = [t for t in tickers if t.upper() in passed or t.upper() not in quotes.index]
+    if len(kept) < len(tickers):
+        log.info("Skipping {} of {} tickers on their quotes".format(len(tickers) - len(kept), len(tickers)))
+    return kept
+
+
+def covered_calls_process_dataframe(stock_df, options_df, market=greeks.default_market):
+    return covered_calls_metrics_dataframe(covered_calls_merge_dataframe(stock_df, options_df), market=market)
+
+
+def covered_calls_prepare_dataframe(stock_df, options_df, counts=None, screen_filter=default_filter):
+    """Drop the contracts that fail the raw predicates, then key them to the stock"""
+    # the stock is a single quote, so its s_* values are scalars in scope
+    with trace.stage('raw predicates') as span:
+        mask = screen_filter.raw_mask(options_df.add_prefix('o_'), scope=stock_df.add_prefix('s_').iloc[0])
+        options_df = options_df.loc[mask]
+        span.rows = len(options_df)
+    if counts is not None:
+        counts.add('fetched', len(mask))
+        counts.add('raw predicates', len(options_df))
+    return covered_calls_merge_dataframe(stock_df, options_df)
+
+
+def covered_calls_merge_dataframe(stock_df, options_df):
+    """Return the Chains of one ticker: its o_* contracts keyed to its s_* quote
+
+    Every contract gets only the stock_key of the quote.  The other s_*
+    values are not copied into every row, see covered_calls_join_dataframe.
+    """
+    underlyings = stock_df.add_prefix("s_")
+    underlyings.index = pd.Index(underlyings[stock_key].to_numpy())
 
-    stock_df = stock_df.add_prefix("s_")
     options_df = options_df.add_prefix("o_")
+    symbol = underlyings.index[0]
+    options_df[stock_key] = pd.Categorical.from_codes(np.zeros(len(options_df), dtype=np.int8), [symbol])
+    return Chains(options_df, underlyings)
+
+
+def covered_calls_concat(chains):
+    """Concatenate the Chains of several tickers"""
+    chains = list(chains)
+    underlyings = pd.concat([c.underlyings for c in chains])
+    underlyings = underlyings.loc[~underlyings.index.duplicated()]
+    return Chains(normalize.concat_dataframes([c.options for c in chains]), underlyings)
+
+
+def covered_calls_join_dataframe(options_df, underlyings, columns=None):
+    """Return options_df with the s_* columns of its underlyings joined in
 
-    # copy every value in stock_df to every item in options_df
-    df = options_df.copy(deep=True)
-    for c in stock_df.columns.to_list():
-        df[c] = stock_df.iloc[0][c]
+    The stock columns take the place of the stock_key column, so the result
+    has the column order of a chain with its quote copied into every row:
+    the o_* columns, the s_* columns, then any derived columns.  columns
+    limits the stock columns joined to those listed, and the stock_key.
     """
-      ['s_52WkHigh', 's_52WkLow', 's_askId', 's_askPrice', 's_askSize',
+    stock_cols = [c for c in underlyings.columns if columns is None or c in columns or c == stock_key]
+    rows = underlyings.index.get_indexer(options_df[stock_key])
+    stock_df = underlyings[stock_cols].iloc[rows]
+    stock_df.index = options_df.index
+    stock_df[stock_key] = options_df[stock_key]
+
+    """
+      ['o_putCall', 'o_symbol', 'o_description', 'o_exchangeName', 'o_bid',
+       'o_ask', 'o_last', 'o_mark', 'o_bidSize', 'o_askSize', 'o_bidAskSize',
+       'o_lastSize', 'o_highPrice', 'o_lowPrice', 'o_openPrice',
+       'o_closePrice', 'o_totalVolume', 'o_tradeDate', 'o_tradeTimeInLong',
+       'o_quoteTimeInLong', 'o_netChange', 'o_volatility', 'o_delta',
+       'o_gamma', 'o_theta', 'o_vega', 'o_rho', 'o_openInterest',
+       'o_timeValue', 'o_theoreticalOptionValue', 'o_theoreticalVolatility',
+       'o_optionDeliverablesList', 'o_strikePrice', 'o_expirationDate',
+       'o_daysToExpiration', 'o_expirationType', 'o_lastTradingDay',
+       'o_multiplier', 'o_settlementType', 'o_deliverableNote',
+       'o_isIndexOption', 'o_percentChange', 'o_markChange',
+       'o_markPercentChange', 'o_mini', 'o_inTheMoney', 'o_nonStandard',
+       's_52WkHigh', 's_52WkLow', 's_askId', 's_askPrice', 's_askSize',
        's_assetMainType', 's_assetSubType', 's_assetType', 's_bidId',
        's_bidPrice', 's_bidSize', 's_bidTick', 's_closePrice', 's_cusip',
        's_delayed', 's_description', 's_digits', 's_divAmount', 's_divDate',
@@ -159,45 +509,20 @@ def covered_calls_process_dataframe(stock_df, options_df):
        's_regularMarketPercentChangeInDouble',
        's_regularMarketTradeTimeInLong', 's_securityStatus', 's_shortable',
        's_symbol', 's_totalVolume', 's_tradeTimeInLong', 's_volatility',
-       'o_putCall', 'o_symbol', 'o_description', 'o_exchangeName', 'o_bid',
-       'o_ask', 'o_last', 'o_mark', 'o_bidSize', 'o_askSize', 'o_bidAskSize',
-       'o_lastSize', 'o_highPrice', 'o_lowPrice', 'o_openPrice',
-       'o_closePrice', 'o_totalVolume', 'o_tradeDate', 'o_tradeTimeInLong',
-       'o_quoteTimeInLong', 'o_netChange', 'o_volatility', 'o_delta',
-       'o_gamma', 'o_theta', 'o_vega', 'o_rho', 'o_openInterest',
-       'o_timeValue', 'o_theoreticalOptionValue', 'o_theoreticalVolatility',
-       'o_optionDeliverablesList', 'o_strikePrice', 'o_expirationDate',
-       'o_daysToExpiration', 'o_expirationType', 'o_lastTradingDay',
-       'o_multiplier', 'o_settlementType', 'o_deliverableNote',
-       'o_isIndexOption', 'o_percentChange', 'o_markChange',
-       'o_markPercentChange', 'o_mini', 'o_inTheMoney', 'o_nonStandard']
+       ...]
     """
 
+    position = options_df.columns.get_loc(stock_key)
+    return pd.concat([options_df.iloc[:, :position], stock_df, options_df.iloc[:, position + 1:]], axis=1)
+
+
+def covered_calls_metrics_dataframe(chains, market=greeks.default_market):
     # calculate other values
-    #  The bid price is a conservative estimate of the current option price
-    df['xo_premium'] = df.apply(lambda row: row['o_bid'] if row['o_bid'] > 0 else row['o_last'], axis=1)
-    df['xo_inTheMoney%'] = df.apply(lambda row: 0 if row['o_inTheMoney'] == 'True' else
-                                    (100.0 * (row[stock_price] - row['o_strikePrice']) / row[stock_price]),
-                                    axis=1)
-
-    def static_return_dollars(row):
-        if row[stock_price] <= row['o_strikePrice']:
-            # out of the money or at the money
-            return row['xo_premium']
-        else:
-            # in the money
-            return row['xo_premium'] + row['o_strikePrice'] - row[stock_price]
-
-    df['xo_staticRet$'] = df.apply(static_return_dollars, axis=1)
-    df['xo_staticRet%'] = df.apply(lambda row: 100.0 * row['xo_staticRet$'] / row[stock_price], axis=1)
-    df['xo_staticRetAnn%'] = df.apply(lambda row: 0 if row['o_daysToExpiration'] <= 0 else
-                                      (row['xo_staticRet%'] * 365.0 / row['o_daysToExpiration']),
-                                      axis=1)
-    df['xo_assignedRet%'] = df.apply(lambda row: 100.0 *
-                                     (row['xo_premium'] + row['o_strikePrice'] - row[stock_price]) / row[stock_price],
-                                     axis=1)
-    df['xo_assignedRetAnn%'] = df.apply(
-        lambda row: 0 if row['o_daysToExpiration'] <= 0 else row['xo_assignedRet%'] * 365.0 / row['o_daysToExpiration'],
-        axis=1)
-
-    return df
+    with trace.stage('metrics') as span:
+        span.rows = len(chains.options)
+        kernels.covered_calls_kernel(chains.options,
+                                     chains.underlyings,
+                                     stock_price=stock_price,
+                                     key=stock_key,
+                                     market=market)
+    return chains
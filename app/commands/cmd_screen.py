@@ -0,0 +1,396 @@
+import click
+import collections
+import contextlib
+import logging
+import os
+
+from app import app
+from app import cli as app_cli
+from app import csvstream
+from app import filters
+from app import greeks
+from app import httpcache
+from app import longoptions
+from app import normalize
+from app import pipeline
+from app import snapshots
+from app import trace
+from app import yahoo
+from app.commands import cmd_coveredcalls
+
+from app.tdameritrade import TDAmeritrade
+
+log = logging.getLogger(__name__)
+
+app = app.App()
+
+#####################################################################
+# Settings
+
+# which fetched columns and part of the chain each strategy reads, how it applies its raw predicates to a
+# fetched chain, combines the chains of its tickers, derives its metrics and writes its CSV, with the
+# CSV columns where they do not depend on what was fetched
+Strategy = collections.namedtuple('Strategy', [
+    'source', 'output', 'columns', 'envelope', 'prepare', 'concat', 'metrics', 'csv_out', 'csv_cols', 'sort_cols',
+    'ascending', 'default_filter'
+])
+
+# every strategy, keyed by its watchlist name under options: in config.yaml
+strategies = collections.OrderedDict([
+    ('covered_calls',
+     Strategy(source='tdameritrade',
+              output='coveredcalls.csv',
+              columns=cmd_coveredcalls.covered_calls_columns,
+              envelope=cmd_coveredcalls.covered_calls_envelope,
+              prepare=lambda data, **kwargs: cmd_coveredcalls.covered_calls_prepare_dataframe(*data, **kwargs),
+              concat=cmd_coveredcalls.covered_calls_concat,
+              metrics=cmd_coveredcalls.covered_calls_metrics_dataframe,
+              csv_out=cmd_coveredcalls.covered_calls_csv_out,
+              csv_cols=None,
+              sort_cols=cmd_coveredcalls.sort_cols,
+              ascending=False,
+              default_filter=cmd_coveredcalls.default_filter)),
+    ('long_puts',
+     Strategy(source='yahoo',
+              output='longputs.csv',
+              columns=longoptions.long_puts.columns,
+              envelope=longoptions.long_puts.envelope,
+              prepare=longoptions.long_puts.prepare_dataframe,
+              concat=normalize.concat_dataframes,
+              metrics=longoptions.long_puts.metrics_dataframe,
+              csv_out=longoptions.long_puts.csv_out,
+              csv_cols=longoptions.long_puts.csv_cols,
+              sort_cols=longoptions.long_puts.sort_cols,
+              ascending=True,
+              default_filter=longoptions.long_puts.default_filter)),
+    ('long_calls',
+     Strategy(source='yahoo',
+              output='longcalls.csv',
+              columns=longoptions.long_calls.columns,
+              envelope=longoptions.long_calls.envelope,
+              prepare=longoptions.long_calls.prepare_dataframe,
+              concat=normalize.concat_dataframes,
+              metrics=longoptions.long_calls.metrics_dataframe,
+              csv_out=longoptions.long_calls.csv_out,
+              csv_cols=longoptions.long_calls.csv_cols,
+              sort_cols=longoptions.long_calls.sort_cols,
+              ascending=True,
+              default_filter=longoptions.long_calls.default_filter)),
+])
+
+# how to fetch and normalize one ticker from each data source
+fetchers = {
+    'tdameritrade': cmd_coveredcalls.covered_calls_fetch,
+    'yahoo': yahoo.fetch_options,
+}
+
+
+class Key(collections.namedtuple('Key', ['source', 'ticker'])):
+    """One ticker from one data source, fetched once per screen"""
+    def __str__(self):
+        return '{}:{}'.format(self.source, self.ticker)
+
+
+#####################################################################
+# Click Code
+
+
+@click.group()
+def cli():
+    """Subcommand for screening every strategy at once"""
+
+    pass
+
+
+@cli.command()
+@click.argument('config_yaml')
+@click.argument('output_dir', type=click.Path(file_okay=False))
+@click.option('--workers',
+              default=pipeline.DEFAULT_WORKERS,
+              show_default=True,
+              help='Number of tickers to fetch concurrently.')
+@click.option('--stream',
+              is_flag=True,
+              help='Append each ticker to the outputs as it is ready, then sort the files once all are done.')
+@click.option('--snapshots',
+              'snapshot_dir',
+              type=click.Path(file_okay=False),
+              help='Read quotes and chains through a Parquet snapshot store in this folder.')
+@click.option('--max-age',
+              default=snapshots.DEFAULT_MAX_AGE,
+              show_default=True,
+              help='Seconds a snapshot stays fresh enough to skip the network.')
+@click.option('--float32', is_flag=True, help='Hold fetched float columns as float32 to halve their memory.')
+@app_cli.pass_context
+def run(ctx, config_yaml, output_dir, workers, stream, snapshot_dir, max_age, float32):
+    """This command loads config.yaml, fetches every ticker in any watchlist
+    once, and writes one CSV per strategy into OUTPUT_DIR.
+    """
+
+    # read the configuration file
+    c = app.get_config_dict(ctx, [config_yaml])
+    watchlists = screen_watchlists(c['config']['options'])
+    if not watchlists:
+        raise click.ClickException("No strategy has any tickers to screen")
+    try:
+        screen_filters = {
+            name: filters.ScreenFilter.from_config(c['config'], name, strategies[name].default_filter)
+            for name in watchlists
+        }
+        market = greeks.Market.from_config(c['config'])
+    except (filters.FilterError, ValueError) as e:
+        raise click.ClickException(str(e))
+
+    # get a client for every data source in use
+    store = None
+    if snapshot_dir is not None:
+        store = snapshots.SnapshotStore(snapshot_dir, max_age=max_age)
+    clients = screen_clients({strategies[name].source for name in watchlists}, store)
+
+    os.makedirs(output_dir, exist_ok=True)
+    outputs = {name: os.path.join(output_dir, strategies[name].output) for name in watchlists}
+
+    counts = {name: pipeline.RowCounts('{} rows per stage'.format(name)) for name in watchlists}
+
+    # stream each ticker to the outputs as it is ready
+    if stream:
+        p = screen_stream(clients,
+                          watchlists,
+                          outputs,
+                          workers=workers,
+                          counts=counts,
+                          screen_filters=screen_filters,
+                          float32=float32,
+                          market=market)
+        if p.failures:
+            ctx.log(p.report())
+        if not p.results:
+            raise click.ClickException("No tickers could be screened")
+    else:
+        # fetch and process the tickers concurrently
+        frames, p = screen(clients,
+                           watchlists,
+                           workers=workers,
+                           counts=counts,
+                           screen_filters=screen_filters,
+                           float32=float32,
+                           market=market)
+        if p.failures:
+            ctx.log(p.report())
+        if not frames:
+            raise click.ClickException("No tickers could be screened")
+
+        for name, df in frames.items():
+            strategies[name].csv_out(outputs[name], df, counts=counts[name], screen_filter=screen_filters[name])
+
+    for name in watchlists:
+        ctx.log(counts[name].report())
+
+
+#####################################################################
+# Functions
+
+
+def screen_watchlists(options):
+    """Return the non-empty watchlist of every known strategy, in strategy order"""
+    for name in options:
+        if name not in strategies:
+            log.warning("Ignoring unknown strategy {}".format(name))
+    return collections.OrderedDict((name, options[name]) for name in strategies if options.get(name))
+
+
+def screen_clients(sources, store=None):
+    """Return a client for every named data source"""
+    clients = {}
+    if 'tdameritrade' in sources:
+        clients['tdameritrade'] = TDAmeritrade(snapshots=store).get_client()
+    if 'yahoo' in sources:
+        client = yahoo.YahooClient(httpcache.HttpCache.singleton().session())
+        if store is not None:
+            client = snapshots.SnapshotClient(client, store, 'yahoo')
+        clients['yahoo'] = client
+    return clients
+
+
+def screen(clients,
+           watchlists,
+           workers=pipeline.DEFAULT_WORKERS,
+           counts=None,
+           screen_filters=None,
+           float32=False,
+           market=greeks.default_market):
+    """Fetch every ticker once and run every strategy, returning (frames, pipeline)
+
+    frames maps each strategy to its processed frame, and leaves out
+    strategies where no ticker could be fetched.  Each strategy sees exactly
+    the rows its own command would produce.  counts and screen_filters
+    optionally map strategy names to their pipeline.RowCounts and
+    filters.ScreenFilter.  Each chain keeps the columns read by any strategy
+    watching its ticker, and with float32 holds its floats as float32.
+    market holds the rate and dividend yields of the Greeks.
+    """
+    watchers = screen_watchers(watchlists)
+    counts = counts or {}
+    screen_filters = screen_resolve_filters(watchlists, screen_filters)
+
+    def prepare(key, data):
+        return {
+            name: strategies[name].prepare(data, counts=counts.get(name), screen_filter=screen_filters[name])
+            for name in watchers[key]
+        }
+
+    quotes = screen_quotes(clients, watchers)
+    watchers = screen_prefilter(watchers, quotes, screen_filters)
+    p = screen_pipeline(clients, prepare, workers, screen_columns(watchlists, screen_filters), float32, quotes,
+                        screen_envelopes(watchers, screen_filters))
+    p.run(watchers)
+
+    frames = collections.OrderedDict()
+    for name, tickers in watchlists.items():
+        keys = screen_keys(name, tickers)
+        ticker_frames = [p.results[key][name] for key in keys if name in p.results.get(key, ())]
+        if not ticker_frames:
+            log.warning("No tickers could be screened for {}".format(name))
+            continue
+
+        # all_df contains all data from all tickers
+        all_df = strategies[name].concat(ticker_frames)
+        frames[name] = strategies[name].metrics(all_df, market=market)
+    return frames, p
+
+
+def screen_stream(clients,
+                  watchlists,
+                  outputs,
+                  workers=pipeline.DEFAULT_WORKERS,
+                  counts=None,
+                  screen_filters=None,
+                  float32=False,
+                  market=greeks.default_market):
+    """Fetch every ticker once, streaming each strategy's rows to its output
+
+    Every strategy's output is rewritten globally sorted once all tickers are
+    done, as in the --stream mode of the single strategy commands.  Returns
+    the pipeline.
+    """
+    watchers = screen_watchers(watchlists)
+    counts = counts or {}
+    screen_filters = screen_resolve_filters(watchlists, screen_filters)
+    # the runs of every stream are removed however the screen ends
+    with contextlib.ExitStack() as stack:
+        streams = {}
+        for name in watchlists:
+            s = strategies[name]
+            streams[name] = stack.enter_context(
+                csvstream.SortedCsvStream(outputs[name], s.sort_cols, ascending=s.ascending, columns=s.csv_cols))
+
+        def process(key, data):
+            runs = {}
+            for name in watchers[key]:
+                s = strategies[name]
+                df = s.prepare(data, counts=counts.get(name), screen_filter=screen_filters[name])
+                df = s.metrics(df, market=market)
+                runs[name] = s.csv_out(outputs[name],
+                                       df,
+                                       stream=streams[name],
+                                       counts=counts.get(name),
+                                       screen_filter=screen_filters[name])
+            return runs
+
+        quotes = screen_quotes(clients, watchers)
+        watchers = screen_prefilter(watchers, quotes, screen_filters)
+        p = screen_pipeline(clients, process, workers, screen_columns(watchlists, screen_filters), float32, quotes,
+                            screen_envelopes(watchers, screen_filters))
+        p.run(watchers)
+
+        for name, tickers in watchlists.items():
+            keys = screen_keys(name, tickers)
+            with trace.stage('merge'):
+                streams[name].merge([p.results[key][name] for key in keys if name in p.results.get(key, ())])
+        return p
+
+
+def screen_pipeline(clients, compute, workers, columns, float32=False, quotes=None, envelopes=None):
+    quotes = quotes or {}
+    envelopes = envelopes or {}
+
+    def fetch(key):
+        kwargs = {'quotes': quotes[key.source]} if key.source in quotes else {}
+        return fetchers[key.source](clients[key.source],
+                                    key.ticker,
+                                    columns=columns[key.source],
+                                    float32=float32,
+                                    envelope=envelopes.get(key),
+                                    **kwargs)
+
+    return pipeline.Pipeline(fetch, compute, workers=workers)
+
+
+def screen_envelopes(watchers, screen_filters):
+    """Map every (source, ticker) to the part of its chain any strategy watching it can use"""
+    envelopes = {}
+    for key, names in watchers.items():
+        for name in names:
+            envelope = strategies[name].envelope(screen_filters[name])
+            envelopes[key] = envelopes[key].union(envelope) if key in envelopes else envelope
+    return envelopes
+
+
+def screen_quotes(clients, watchers):
+    """Map every data source with a bulk quote endpoint to the quotes of its watched tickers"""
+    tickers = [key.ticker for key in watchers if key.source == 'tdameritrade']
+    if not tickers:
+        return {}
+    return {'tdameritrade': cmd_coveredcalls.covered_calls_quotes(clients['tdameritrade'], tickers)}
+
+
+def screen_prefilter(watchers, quotes, screen_filters):
+    """Stop each strategy watching the tickers its predicates on the quote reject
+
+    Tickers no strategy watches any more are not fetched at all.
+    """
+    tickers = collections.defaultdict(list)
+    for key, names in watchers.items():
+        if key.source in quotes:
+            for name in names:
+                tickers[name].append(key.ticker)
+    passed = {
+        name: set(cmd_coveredcalls.covered_calls_prefilter(quotes[strategies[name].source], t, screen_filters[name]))
+        for name, t in tickers.items()
+    }
+
+    prefiltered = collections.OrderedDict()
+    for key, names in watchers.items():
+        names = [name for name in names if name not in passed or key.ticker in passed[name]]
+        if names:
+            prefiltered[key] = names
+    return prefiltered
+
+
+def screen_keys(name, tickers):
+    source = strategies[name].source
+    return [Key(source, ticker) for ticker in dict.fromkeys(tickers)]
+
+
+def screen_watchers(watchlists):
+    """Map every (source, ticker) in any watchlist to the strategies watching it"""
+    watchers = collections.OrderedDict()
+    for name, tickers in watchlists.items():
+        for key in screen_keys(name, tickers):
+            watchers.setdefault(key, []).append(name)
+    return watchers
+
+
+def screen_columns(watchlists, screen_filters):
+    """Map every data source in use to the fetched columns read by any strategy using it"""
+    columns = {}
+    for name in watchlists:
+        s = strategies[name]
+        columns.setdefault(s.source, []).extend(s.columns(screen_filters[name]))
+    return {source: list(dict.fromkeys(names)) for source, names in columns.items()}
+
+
+def screen_resolve_filters(watchlists, screen_filters=None):
+    """Return the filter of every strategy, falling back to its default"""
+    screen_filters = screen_filters or {}
+    return {name: screen_filters.get(name, strategies[name].default_filter) for name in watchlists}
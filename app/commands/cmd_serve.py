@@ -0,0 +1,134 @@
+import click
+import functools
+import logging
+import os
+
+from app import app
+from app import cli as app_cli
+from app import csvstream
+from app import filters
+from app import greeks
+from app import pipeline
+from app import server
+from app.commands import cmd_screen
+
+log = logging.getLogger(__name__)
+
+app = app.App()
+
+#####################################################################
+# Click Code
+
+
+@click.group()
+def cli():
+    """Subcommand for serving the screens over HTTP"""
+
+    pass
+
+
+@cli.command()
+@click.argument('config_yaml')
+@click.option('--host', default=server.DEFAULT_HOST, show_default=True, help='Address to listen on.')
+@click.option('--port', default=server.DEFAULT_PORT, show_default=True, help='Port to listen on.')
+@click.option('--max-age',
+              default=server.DEFAULT_MAX_AGE,
+              show_default=True,
+              help='Seconds a fetched chain is served before it is fetched again.')
+@click.option('--workers',
+              default=pipeline.DEFAULT_WORKERS,
+              show_default=True,
+              help='Number of tickers to fetch concurrently.')
+@click.option('--float32', is_flag=True, help='Hold fetched float columns as float32 to halve their memory.')
+@app_cli.pass_context
+def run(ctx, config_yaml, host, port, max_age, workers, float32):
+    """This command loads config.yaml once, then serves every watched
+    strategy at GET /screen/<strategy>?tickers=A,B&format=json|csv,
+    keeping the clients and fetched chains resident between requests.
+    """
+
+    # read the configuration file
+    c = app.get_config_dict(ctx, [config_yaml])
+    watchlists = cmd_screen.screen_watchlists(c['config']['options'])
+    if not watchlists:
+        raise click.ClickException("No strategy has any tickers to serve")
+    try:
+        screen_filters = {
+            name: filters.ScreenFilter.from_config(c['config'], name, cmd_screen.strategies[name].default_filter)
+            for name in watchlists
+        }
+        market = greeks.Market.from_config(c['config'])
+    except (filters.FilterError, ValueError) as e:
+        raise click.ClickException(str(e))
+
+    # authenticate once, for every request
+    clients = cmd_screen.screen_clients({cmd_screen.strategies[name].source for name in watchlists})
+    screens = serve_screens(clients,
+                            watchlists,
+                            screen_filters=screen_filters,
+                            market=market,
+                            workers=workers,
+                            max_age=max_age,
+                            float32=float32)
+
+    # keep the chains fresh in the background, so requests only read them
+    for screen in screens.values():
+        screen.start()
+
+    httpd = server.ScreenServer((host, port), screens)
+    ctx.log('Serving {} on http://{}:{}/'.format(', '.join('/screen/' + name for name in screens), host,
+                                                 httpd.server_address[1]))
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        for screen in screens.values():
+            screen.stop()
+
+
+#####################################################################
+# Functions
+
+
+def serve_route(name):
+    """Return the route of a strategy, its command name: covered_calls is /screen/coveredcalls"""
+    return os.path.splitext(cmd_screen.strategies[name].output)[0]
+
+
+def serve_screens(clients,
+                  watchlists,
+                  screen_filters=None,
+                  market=greeks.default_market,
+                  workers=pipeline.DEFAULT_WORKERS,
+                  max_age=server.DEFAULT_MAX_AGE,
+                  float32=False):
+    """Return a resident server.Screen for every strategy in watchlists, keyed by its route"""
+    screen_filters = cmd_screen.screen_resolve_filters(watchlists, screen_filters)
+    screens = {}
+    for name, tickers in watchlists.items():
+        s = cmd_screen.strategies[name]
+        screen_filter = screen_filters[name]
+        output = csvstream.PatchedCsv(None, s.sort_cols, ascending=s.ascending)
+        fetch = functools.partial(cmd_screen.fetchers[s.source],
+                                  clients[s.source],
+                                  columns=s.columns(screen_filter),
+                                  float32=float32,
+                                  envelope=s.envelope(screen_filter))
+        screens[serve_route(name)] = server.Screen(fetch,
+                                                   serve_process(s, output, screen_filter, market),
+                                                   output,
+                                                   watchlist=tickers,
+                                                   workers=workers,
+                                                   max_age=max_age)
+    return screens
+
+
+def serve_process(strategy, output, screen_filter, market=greeks.default_market):
+    """Return process(ticker, data), which screens one chain and hands its rows to output"""
+    def process(ticker, data):
+        df = strategy.metrics(strategy.prepare(data, screen_filter=screen_filter), market=market)
+        return strategy.csv_out(None, df, stream=output, screen_filter=screen_filter)
+
+    return process
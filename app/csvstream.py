@@ -0,0 +1,149 @@
+import csv
+import heapq
+import math
+import operator
+import os
+import tempfile
+
+import pandas as pd
+
+from app import normalize
+from app.utils import FileUtils
+
+
+class SortedCsvStream(object):
+    """Stream filtered rows to a CSV file and sort it with an external merge
+
+    Each call to add() sorts one ticker's rows into a run file and appends
+    them to the output file right away, so partial results can be tailed
+    during long runs.  merge() then rewrites the output as a single globally
+    sorted file with a k-way merge of the runs, holding only one row per run
+    in memory.  columns are the output columns, so a merge of no runs still
+    writes their header.  Without them, the columns given to the first add()
+    are used, and a merge of no runs writes an empty file.
+
+    The runs are spilled to a temporary directory, removed by close() or on
+    leaving a with block, whether or not the merge ran.
+    """
+    def __init__(self, filename, sort_cols, ascending=True, float_format='%.2f', columns=None):
+        self.filename = filename
+        self.sort_cols = list(sort_cols)
+        if isinstance(ascending, bool):
+            ascending = [ascending] * len(self.sort_cols)
+        self.ascending = list(ascending)
+        self.float_format = float_format
+        self.columns = None if columns is None else list(columns)
+        self.runs = tempfile.TemporaryDirectory(prefix='runs_', dir=os.path.dirname(os.path.abspath(filename)))
+        self.run_dir = self.runs.name
+        self.run_count = 0
+
+        # start with an empty output, the header is written with the first rows
+        FileUtils.ensure_removed(self.filename)
+
+    def add(self, df, columns):
+        """Sort df, append it to the output, and return the path of its run"""
+        if self.columns is None:
+            self.columns = list(columns)
+        df = df.sort_values(by=self.sort_cols, ascending=self.ascending, kind='mergesort').reset_index(drop=True)
+
+        # partial output, in arrival order
+        df.to_csv(self.filename,
+                  mode='a',
+                  header=not os.path.exists(self.filename),
+                  columns=self.columns,
+                  index=False,
+                  float_format=self.float_format)
+
+        # the run keeps the sort keys at full precision ahead of the output columns
+        keys = df[self.sort_cols].astype(str)
+        keys.columns = ['_key{}'.format(i) for i in range(len(self.sort_cols))]
+        run = keys.join(df.reindex(columns=self.columns))
+        path = os.path.join(self.run_dir, 'run{:06d}.csv'.format(self.run_count))
+        self.run_count += 1
+        run.to_csv(path, header=False, index=False, float_format=self.float_format)
+        return path
+
+    def merge(self, runs):
+        """Rewrite the output as the k-way merge of runs
+
+        Rows with equal keys keep the order of the runs list, which matches a
+        stable sort of the concatenated runs.
+        """
+        tmp_filename = self.filename + '.tmp'
+        files = []
+        try:
+            files = [open(path, newline='') for path in runs]
+            with open(tmp_filename, 'w', newline='') as f:
+                writer = csv.writer(f, lineterminator=os.linesep)
+                if self.columns is not None:
+                    writer.writerow(self.columns)
+                num_keys = len(self.sort_cols)
+                keyed_runs = [self._keyed_rows(csv.reader(run)) for run in files]
+                for _, row in heapq.merge(*keyed_runs, key=operator.itemgetter(0)):
+                    writer.writerow(row[num_keys:])
+            os.replace(tmp_filename, self.filename)
+        finally:
+            for run in files:
+                run.close()
+            FileUtils.ensure_removed(tmp_filename)
+            self.close()
+
+    def close(self):
+        """Remove the runs"""
+        self.runs.cleanup()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _keyed_rows(self, reader):
+        # Build ascending keys, with NaN last in either direction like pandas
+        for row in reader:
+            key = []
+            for text, ascending in zip(row, self.ascending):
+                value = float(text) if text else math.nan
+                if math.isnan(value):
+                    key.append((1, 0.0))
+                else:
+                    key.append((0, value if ascending else -value))
+            yield key, row
+
+
+class PatchedCsv(object):
+    """A sorted CSV file rebuilt from per-ticker rows kept in memory
+
+    add() has the signature of SortedCsvStream.add, so a strategy's csv_out
+    can hand over one ticker's filtered rows.  It returns them sorted instead
+    of writing them, and write() later rewrites the output from the current
+    rows of every ticker.  The rows of a ticker that did not change are
+    reused as they are.
+    """
+    def __init__(self, filename, sort_cols, ascending=True, float_format='%.2f'):
+        self.filename = filename
+        self.sort_cols = list(sort_cols)
+        self.ascending = ascending
+        self.float_format = float_format
+        self.columns = None
+
+    def add(self, df, columns):
+        """Return the rows of one ticker, sorted and limited to columns"""
+        if self.columns is None:
+            self.columns = list(columns)
+        return df.sort_values(by=self.sort_cols, ascending=self.ascending, kind='mergesort')[self.columns]
+
+    def frame(self, runs):
+        """Return the runs merged into one sorted frame"""
+        runs = list(runs)
+        if not runs:
+            return pd.DataFrame(columns=self.columns)
+        df = normalize.concat_dataframes(runs)
+        return df.sort_values(by=self.sort_cols, ascending=self.ascending, kind='mergesort')
+
+    def write(self, runs):
+        """Atomically replace the output with the merged runs"""
+        df = self.frame(runs)
+        tmp_filename = self.filename + '.tmp'
+        df.to_csv(tmp_filename, columns=self.columns, index=False, float_format=self.float_format)
+        os.replace(tmp_filename, self.filename)
@@ -5,19 +5,12 @@ import re
 import json
 import pandas as pd
 
-from selenium import webdriver
-import selenium.webdriver.chrome.service as service
-from selenium.webdriver.support.ui import Select
-
-from pandas_datareader.data import Options
-import requests_cache
+from app import httpcache
+from app import occ
 
 #####################################################################
 # Settings
 
-# cache settings
-seconds_to_cache = 180  # seconds
-
 seconds_to_pause = 3  # seconds
 
 yahoo_columns = [
@@ -34,11 +27,13 @@ common_columns = [
 class Datareader(object):
     """ This class is unused """
     def __init__(self):
-        # Create the requests cache
-        self.session = requests_cache.CachedSession(cache_name='cache', backend='sqlite', expire_after=seconds_to_cache)
+        # Use the shared requests cache
+        self.session = httpcache.HttpCache.singleton().session()
 
     def yahoo_options_dataframe(self, ticker):
 
+        from pandas_datareader.data import Options
+
         # fetch all data
         option = Options(ticker, 'yahoo', session=self.session)
         df = option.get_all_data()
@@ -88,40 +83,47 @@ class Datareader(object):
         schwab.get(url)
 
         options_dict = json.loads(self.striphtml(schwab.page_source()))
+        return Datareader.schwab_options_dataframe_from_dict(options_dict)
+
+    @staticmethod
+    def schwab_options_dataframe_from_dict(options_dict):
+        """Parse an optionChainsJson payload into a DataFrame
 
-        df = pd.DataFrame(columns=common_columns)
+        The nested JSON is walked once into per-column lists, and the frame is
+        built once at the end.  Dates and OCC symbols are converted a whole
+        column at a time.
+        """
+        cols = {c: [] for c in common_columns}
+        expiry_strs = []
 
-        i = 0
         for root in options_dict['Roots']:
-            _underlying = options_dict['UnderLying']
-            _underlying_price = 0  # TODO
-            _quotetime = pd.to_datetime(options_dict['TimeStamp'])
             _adjusted = True if root['IsAdjusted'] == 'Y' else False
             _root = root['Root']
             for expiration in root['Expirations']:
-                _expiry = pd.to_datetime(expiration['Date'])
                 for strike in expiration['Strikes']:
-                    _strike = strike['Price']
                     for option in ['Call', 'Put']:
-                        _type = option.lower()
-                        _lst = strike[option]['Lst']
-                        _chg = strike[option]['Chg']
-                        _bid = strike[option]['Bid']
-                        _ask = strike[option]['Ask']
-                        _vol = strike[option]['Vol']
-                        _oi = strike[option]['OI']
-
-                        _symbol = ('{0}{1:02d}{2:02d}{3:02d}{4}{5:08d}'.format(_underlying, _expiry.year - 2000,
-                                                                               _expiry.month, _expiry.day,
-                                                                               "C" if _type == "call" else "P",
-                                                                               int(_strike * 1000)))
-
-                        df.loc[i] = [
-                            _strike, _expiry, _type, _symbol, _lst, _bid, _ask, _chg, _vol, _oi, _root, _adjusted,
-                            _underlying, _underlying_price, _quotetime
-                        ]
-                        i += 1
-        return df
+                        quote = strike[option]
+                        expiry_strs.append(expiration['Date'])
+                        cols['strike'].append(strike['Price'])
+                        cols['type'].append(option.lower())
+                        cols['lst'].append(quote['Lst'])
+                        cols['bid'].append(quote['Bid'])
+                        cols['ask'].append(quote['Ask'])
+                        cols['chg'].append(quote['Chg'])
+                        cols['vol'].append(quote['Vol'])
+                        cols['oi'].append(quote['OI'])
+                        cols['root'].append(_root)
+                        cols['nonstandard'].append(_adjusted)
+
+        n = len(expiry_strs)
+        _underlying = options_dict['UnderLying']
+        cols['expiry'] = pd.to_datetime(pd.Series(expiry_strs, dtype=object))
+        cols['underlying'] = [_underlying] * n
+        cols['underlyingprice'] = [0] * n  # TODO
+        cols['quotetime'] = [pd.to_datetime(options_dict['TimeStamp'])] * n
+        cols['symbol'] = occ.occ_encode(_underlying, cols['expiry'], cols['type'], cols['strike'])
+
+        return pd.DataFrame(cols, columns=common_columns)
 
     def striphtml(self, data):
         p = re.compile(r'<.*?>')
@@ -150,6 +152,8 @@ class SchwabBrowser(object):
         self.SCHWAB_USER = os.environ['SCHWAB_USER']
         self.SCHWAB_PASSWORD = os.environ['SCHWAB_PASSWORD']
 
+        import selenium.webdriver.chrome.service as service
+
         self.service = service.Service('chromedriver')
         self.browser = None
         self.is_started = False
@@ -157,6 +161,8 @@ class SchwabBrowser(object):
 
     def start(self):
 
+        from selenium import webdriver
+
         if self.is_started is False:
             self.service.start()
 
@@ -188,6 +194,8 @@ class SchwabBrowser(object):
         pass_ = br.find_element_by_name("txtPassword")
         pass_.send_keys(self.SCHWAB_PASSWORD)
 
+        from selenium.webdriver.support.ui import Select
+
         select = Select(br.find_element_by_id('ctl00_WebPartManager1_CenterLogin_LoginUserControlId_drpStartPage'))
         select.select_by_visible_text('Research')
 
@@ -0,0 +1,174 @@
+import collections
+import datetime
+import math
+import operator
+
+#####################################################################
+# Settings
+
+CONTRACT_TYPES = ('CALL', 'PUT')
+
+# ranges of strikes relative to the underlying price: in, near and out of the money, and strikes above, below
+# and near the market
+STRIKE_RANGES = ('ITM', 'NTM', 'OTM', 'SAK', 'SBK', 'SNK')
+
+# the columns of a strategy's chains that its predicates on the envelope read
+Columns = collections.namedtuple('Columns', ['contract_type', 'strike', 'underlying', 'days'])
+
+# the comparison seen from the other operand
+flipped = {
+    operator.eq: operator.eq,
+    operator.lt: operator.gt,
+    operator.le: operator.ge,
+    operator.gt: operator.lt,
+    operator.ge: operator.le,
+}
+
+
+class Envelope(collections.namedtuple('Envelope',
+                                      ['contract_type', 'strike_range', 'strike_count', 'min_days', 'max_days'])):
+    """The part of a chain a strategy can use, requested instead of the whole chain
+
+    contract_type is CALL or PUT, strike_range one of STRIKE_RANGES,
+    strike_count the number of strikes above and below the money, and
+    min_days and max_days bound the days to expiration.  None leaves a field
+    unbounded.
+    """
+    __slots__ = ()
+
+    def __new__(cls, contract_type=None, strike_range=None, strike_count=None, min_days=None, max_days=None):
+        return super().__new__(cls, contract_type, strike_range, strike_count, min_days, max_days)
+
+    @property
+    def bounded(self):
+        return any(value is not None for value in self)
+
+    def narrow(self, other):
+        """Return the contracts in both envelopes, other wins where they name different types or ranges"""
+        return Envelope(contract_type=_first(other.contract_type, self.contract_type),
+                        strike_range=_first(other.strike_range, self.strike_range),
+                        strike_count=_bound(min, self.strike_count, other.strike_count),
+                        min_days=_bound(max, self.min_days, other.min_days),
+                        max_days=_bound(min, self.max_days, other.max_days))
+
+    def union(self, other):
+        """Return an envelope holding the contracts of both, such as for one chain fetched for two strategies"""
+        return Envelope(contract_type=self.contract_type if self.contract_type == other.contract_type else None,
+                        strike_range=self.strike_range if self.strike_range == other.strike_range else None,
+                        strike_count=_unbound(max, self.strike_count, other.strike_count),
+                        min_days=_unbound(min, self.min_days, other.min_days),
+                        max_days=_unbound(max, self.max_days, other.max_days))
+
+    def covers(self, days):
+        """Return True if an expiration days away is in the envelope"""
+        return (self.min_days is None or days >= self.min_days) and (self.max_days is None or days <= self.max_days)
+
+    def dates(self, today):
+        """Return the first and last expiration dates to request, or None when unbounded
+
+        Each side has a day to spare, since the server may count days to
+        expiration from another time zone.
+        """
+        from_date = None if self.min_days is None else today + datetime.timedelta(days=self.min_days - 1)
+        to_date = None if self.max_days is None else today + datetime.timedelta(days=self.max_days + 1)
+        return from_date, to_date
+
+    @staticmethod
+    def from_filter(screen_filter, columns):
+        """Return the envelope of the contracts that can pass the predicates every ticker shares
+
+        Reads comparisons of columns.contract_type with a literal, of
+        columns.days with a number, and strict comparisons of columns.strike
+        with columns.underlying.  columns.underlying must be the price the
+        source itself decides the money by, else no range is derived: a
+        strike between another price and that one would be dropped.  An
+        envelope set under fetch: in the filter's config narrows the result.
+        """
+        contract_type = None
+        strike_side = None
+        min_days = max_days = None
+        for predicates in screen_filter.stages.values():
+            for p in predicates:
+                if p.op is None:
+                    continue
+                (left_is_column, left), (right_is_column, right) = p.operands
+                op = p.op
+                if not left_is_column:
+                    (left_is_column, left), (right_is_column, right) = p.operands[::-1]
+                    op = flipped.get(op)
+                if not left_is_column or op is None:
+                    continue
+
+                if left == columns.contract_type and not right_is_column and op is operator.eq:
+                    if str(right).upper() in CONTRACT_TYPES:
+                        contract_type = str(right).upper()
+                elif left == columns.days and not right_is_column and _is_number(right):
+                    if op in (operator.ge, operator.gt, operator.eq):
+                        low = math.ceil(right) if op is not operator.gt else math.floor(right) + 1
+                        min_days = _bound(max, min_days, low)
+                    if op in (operator.le, operator.lt, operator.eq):
+                        high = math.floor(right) if op is not operator.lt else math.ceil(right) - 1
+                        max_days = _bound(min, max_days, high)
+                elif left == columns.strike and right_is_column and right == columns.underlying:
+                    # at the money strikes are in neither range, so only strict comparisons fit one
+                    if op is operator.gt:
+                        strike_side = 'above'
+                    elif op is operator.lt:
+                        strike_side = 'below'
+
+        strike_range = None
+        if strike_side is not None:
+            if contract_type is None:
+                strike_range = 'SAK' if strike_side == 'above' else 'SBK'
+            else:
+                strike_range = 'OTM' if (strike_side == 'above') == (contract_type == 'CALL') else 'ITM'
+        derived = Envelope(contract_type=contract_type, strike_range=strike_range, min_days=min_days,
+                           max_days=max_days)
+        return derived.narrow(screen_filter.fetch)
+
+    @staticmethod
+    def from_config(section):
+        """Return the envelope of a fetch: section, raising ValueError if it is not one"""
+        if not section:
+            return Envelope()
+        if not isinstance(section, dict):
+            raise ValueError("fetch must be a mapping of {}".format(', '.join(Envelope._fields)))
+        unknown = set(section) - set(Envelope._fields)
+        if unknown:
+            raise ValueError("Unknown fetch settings: {}".format(', '.join(sorted(unknown))))
+        values = dict(section)
+        for name, choices in [('contract_type', CONTRACT_TYPES), ('strike_range', STRIKE_RANGES)]:
+            if values.get(name) is not None:
+                values[name] = str(values[name]).upper()
+                if values[name] not in choices:
+                    raise ValueError("fetch: {} must be one of {}".format(name, ', '.join(choices)))
+        for name in ['strike_count', 'min_days', 'max_days']:
+            if values.get(name) is not None:
+                try:
+                    values[name] = int(values[name])
+                except (TypeError, ValueError):
+                    raise ValueError("fetch: {} must be a whole number".format(name))
+        return Envelope(**values)
+
+
+#####################################################################
+# Functions
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _first(*values):
+    return next((v for v in values if v is not None), None)
+
+
+def _bound(pick, *values):
+    # the tightest of the bounds given, None when none are
+    values = [v for v in values if v is not None]
+    return pick(values) if values else None
+
+
+def _unbound(pick, *values):
+    # the loosest of the bounds, None if any side is unbounded
+    return None if any(v is None for v in values) else pick(values)
@@ -0,0 +1,248 @@
+import operator
+import re
+
+import numpy as np
+
+from app import envelopes
+
+#####################################################################
+# Settings
+
+# comparison operators of the filter language
+operators = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+
+# names of derived metric columns start with this prefix
+DERIVED_PREFIX = 'x'
+
+# sections of a strategy's filters: in config.yaml
+STAGES = ('raw', 'derived')
+
+name_regex = r'[A-Za-z_][A-Za-z0-9_%$]*'
+literal_regex = r"-?\d+(?:\.\d*)?(?:[eE][-+]?\d+)?|'[^']*'|\"[^\"]*\"|True|False"
+operand_regex = r'({})|({})'.format(literal_regex, name_regex)
+comparison_regex = re.compile(r'^\s*(?:{})\s*(==|!=|<=|>=|<|>)\s*(?:{})\s*$'.format(operand_regex, operand_regex))
+flag_regex = re.compile(r'^\s*(not\s+)?({})\s*$'.format(name_regex))
+
+
+class FilterError(ValueError):
+    """A screen filter could not be parsed or evaluated"""
+    pass
+
+
+def resolve(df, scope, name, text):
+    """Return the values of a name: a column, an index level or a scalar in scope"""
+    if name in df.columns:
+        values = df[name]
+    elif name in df.index.names:
+        values = df.index.get_level_values(name)
+    elif scope is not None and name in scope:
+        return scope[name]
+    else:
+        raise FilterError("Unknown column '{}' in filter '{}'".format(name, text))
+
+    # numbers and dates compare fastest as numpy arrays, while strings compare
+    # fastest in their own dtype rather than as an array of python objects
+    if values.dtype.kind in 'biufmM':
+        return values.to_numpy()
+    return values
+
+
+class Predicate(object):
+    """One parsed predicate of the filter language
+
+    A predicate compares two operands, each a column name or a literal:
+
+      o_bid > 0.25
+      o_strikePrice > s_askPrice
+      Type == 'put'
+
+    or tests a boolean column, optionally negated:
+
+      not xExpired
+    """
+    def __init__(self, text):
+        self.text = text
+        self.negate = False
+        m = comparison_regex.match(text)
+        if m is not None:
+            self.op = operators[m.group(3)]
+            self.operands = [Predicate._operand(m.group(1), m.group(2)), Predicate._operand(m.group(4), m.group(5))]
+            return
+        m = flag_regex.match(text)
+        if m is not None and m.group(2) not in ('not', 'True', 'False'):
+            self.op = None
+            self.negate = m.group(1) is not None
+            self.operands = [(True, m.group(2))]
+            return
+        raise FilterError("Unable to parse filter '{}'".format(text))
+
+    @property
+    def columns(self):
+        return [value for is_column, value in self.operands if is_column]
+
+    def evaluate(self, df, scope=None):
+        """Return the predicate over the rows of df, as a bool array or scalar"""
+        values = [resolve(df, scope, value, self.text) if is_column else value for is_column, value in self.operands]
+        if self.op is None:
+            values = np.asarray(values[0], dtype=bool)
+            return np.logical_not(values) if self.negate else values
+        result = self.op(*values)
+        return result.to_numpy(dtype=bool) if hasattr(result, 'to_numpy') else result
+
+    @staticmethod
+    def _operand(literal, name):
+        if name is not None:
+            return True, name
+        if literal in ('True', 'False'):
+            return False, literal == 'True'
+        if literal[0] in '\'"':
+            return False, literal[1:-1]
+        if re.match(r'^-?\d+$', literal):
+            return False, int(literal)
+        return False, float(literal)
+
+
+class ScreenFilter(object):
+    """The compiled screen predicates of one strategy
+
+    Raw predicates may only read fetched columns, so they can run before the
+    derived metrics are computed.  Derived predicates may read any column.
+    Each ticker may add predicates of its own, which apply to the rows whose
+    ticker_column matches it.  fetch optionally narrows the part of the chain
+    fetched beyond what the predicates allow, see envelopes.Envelope.
+
+    Every predicate is parsed and validated once, up front.  A mask is then
+    built in a single pass: each predicate is and-ed in place into one bool
+    array instead of chaining boolean Series, which allocate a new Series at
+    every step.
+    """
+    def __init__(self,
+                 raw=(),
+                 derived=(),
+                 tickers=None,
+                 ticker_column=None,
+                 derived_prefix=DERIVED_PREFIX,
+                 fetch=None):
+        self.derived_prefix = derived_prefix
+        try:
+            self.fetch = fetch if isinstance(fetch, envelopes.Envelope) else envelopes.Envelope.from_config(fetch)
+        except ValueError as e:
+            raise FilterError(str(e))
+        self.ticker_column = ticker_column
+        self.stages = ScreenFilter._compile_stages({'raw': raw, 'derived': derived}, derived_prefix)
+        self.tickers = {}
+        for ticker, stages in (tickers or {}).items():
+            if not isinstance(stages, dict):
+                raise FilterError("Filters for ticker {} must be a mapping of {}".format(ticker, ' and '.join(STAGES)))
+            self.tickers[str(ticker).upper()] = ScreenFilter._compile_stages(stages, derived_prefix)
+        if self.tickers and ticker_column is None:
+            raise FilterError("Per ticker filters need a ticker column")
+
+    @staticmethod
+    def from_config(config, name, default):
+        """Return the filter of strategy name under filters: in config.yaml
+
+        Sections missing from the config keep the predicates of default.
+        """
+        section = (config.get('filters') or {}).get(name)
+        if not section:
+            return default
+        try:
+            if not isinstance(section, dict):
+                raise FilterError("must be a mapping of {}, tickers and fetch".format(', '.join(STAGES)))
+            unknown = set(section) - set(STAGES) - {'tickers', 'fetch'}
+            if unknown:
+                raise FilterError("Unknown filter sections: {}".format(', '.join(sorted(unknown))))
+            return ScreenFilter(raw=section.get('raw', [p.text for p in default.stages['raw']]),
+                                derived=section.get('derived', [p.text for p in default.stages['derived']]),
+                                tickers=section.get('tickers'),
+                                ticker_column=default.ticker_column,
+                                derived_prefix=default.derived_prefix,
+                                fetch=section.get('fetch', default.fetch))
+        except FilterError as e:
+            raise FilterError("filters: {}: {}".format(name, e))
+
+    @property
+    def columns(self):
+        """Every name the predicates read, including the ticker column if used"""
+        names = []
+        for stages in [self.stages] + list(self.tickers.values()):
+            for predicates in stages.values():
+                for predicate in predicates:
+                    names.extend(predicate.columns)
+        if self.tickers:
+            names.append(self.ticker_column)
+        return list(dict.fromkeys(names))
+
+    def raw_mask(self, df, scope=None):
+        """Return the rows of df passing the raw predicates
+
+        scope maps names that are not columns of df to scalar values, such
+        as the quote of the underlying before it is merged into its chain.
+        """
+        return self._mask(df, scope, ['raw'])
+
+    def readable_raw_mask(self, df):
+        """Return the rows of df passing the raw predicates that read only its columns
+
+        The other predicates are skipped, so a table of the underlying quotes
+        can be screened on the predicates over s_* columns alone, before any
+        chain is fetched.
+        """
+        return self._mask(df, None, ['raw'], readable=set(df.columns) | set(df.index.names))
+
+    def derived_mask(self, df, scope=None):
+        """Return the rows of df passing the derived predicates"""
+        return self._mask(df, scope, ['derived'])
+
+    def mask(self, df, scope=None):
+        """Return the rows of df passing every predicate"""
+        return self._mask(df, scope, STAGES)
+
+    def _mask(self, df, scope, stages, readable=None):
+        # with readable, only the predicates reading nothing else are applied
+        def applies(predicate):
+            return readable is None or set(predicate.columns) <= readable
+
+        out = np.ones(len(df), dtype=bool)
+        with np.errstate(invalid='ignore'):
+            for stage in stages:
+                for predicate in filter(applies, self.stages[stage]):
+                    np.logical_and(out, predicate.evaluate(df, scope), out=out)
+
+            symbols = None
+            for ticker, ticker_stages in self.tickers.items():
+                predicates = [p for stage in stages for p in ticker_stages[stage] if applies(p)]
+                if not predicates or (readable is not None and self.ticker_column not in readable):
+                    continue
+                if symbols is None:
+                    symbols = resolve(df, scope, self.ticker_column, 'ticker column')
+                # rows of other tickers pass, rows of this ticker must pass its predicates too
+                others = np.logical_not(symbols == ticker)
+                for predicate in predicates:
+                    np.logical_and(out, np.logical_or(others, predicate.evaluate(df, scope)), out=out)
+        return out
+
+    @staticmethod
+    def _compile_stages(stages, derived_prefix):
+        unknown = set(stages) - set(STAGES)
+        if unknown:
+            raise FilterError("Unknown filter sections: {}".format(', '.join(sorted(unknown))))
+        compiled = {}
+        for stage in STAGES:
+            texts = stages.get(stage) or []
+            if isinstance(texts, str) or not all(isinstance(t, str) for t in texts):
+                raise FilterError("Filters under {} must be a list of strings".format(stage))
+            compiled[stage] = [Predicate(t) for t in texts]
+        for predicate in compiled['raw']:
+            for c in predicate.columns:
+                if c.startswith(derived_prefix):
+                    raise FilterError("Raw filter '{}' reads derived column '{}'".format(predicate.text, c))
+        return compiled
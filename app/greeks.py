@@ -0,0 +1,202 @@
+import numpy as np
+
+#####################################################################
+# Settings
+
+# volatility bracket of the implied volatility solver, as a fraction per year
+MIN_VOLATILITY = 1e-4
+MAX_VOLATILITY = 10.0
+
+# the solver stops once the model price is within this many dollars of the market, or
+# once a Newton step would move the volatility by less than VOLATILITY_TOLERANCE
+PRICE_TOLERANCE = 1e-8
+VOLATILITY_TOLERANCE = 1e-10
+MAX_ITERATIONS = 100
+
+SQRT_2PI = np.sqrt(2.0 * np.pi)
+
+
+class Market(object):
+    """The risk free rate and dividend yields the Greeks are computed with
+
+    Both are continuously compounded annual fractions, so 0.05 is 5%.
+    Tickers without a configured dividend yield use the yield of their quote
+    where the data source has one, and no dividend otherwise.
+    """
+    def __init__(self, rate=0.0, dividend_yields=None):
+        self.rate = float(rate)
+        self.dividend_yields = {str(k).upper(): float(v) for k, v in (dividend_yields or {}).items()}
+
+    @staticmethod
+    def from_config(config):
+        """Return the Market under greeks: in config.yaml"""
+        section = config.get('greeks') or {}
+        if not isinstance(section, dict):
+            raise ValueError("greeks: must be a mapping of rate and dividend_yields")
+        return Market(rate=section.get('rate', 0.0), dividend_yields=section.get('dividend_yields'))
+
+    def dividend_yield(self, symbols, default=0.0):
+        """Return the dividend yield of each symbol, or default where none is configured"""
+        symbols = np.asarray(symbols, dtype=object)
+        out = np.broadcast_to(np.asarray(default, dtype=np.float64), symbols.shape).copy()
+        for symbol, q in self.dividend_yields.items():
+            out[symbols == symbol] = q
+        return out
+
+
+default_market = Market()
+
+#####################################################################
+# Functions
+
+
+def norm_pdf(x):
+    return np.exp(-0.5 * x * x) / SQRT_2PI
+
+
+def norm_cdf(x):
+    """The standard normal distribution, to double precision
+
+    numpy has no erf, so this is Hart's rational approximation as given by
+    West, "Better approximations to cumulative normal functions" (2005).
+    """
+    z = np.abs(x)
+    e = np.exp(-0.5 * z * z)
+    n = (((((0.0352624965998911 * z + 0.700383064443688) * z + 6.37396220353165) * z + 33.912866078383) * z +
+          112.079291497871) * z + 221.213596169931) * z + 220.206867912376
+    d = ((((((0.0883883476483184 * z + 1.75566716318264) * z + 16.064177579207) * z + 86.7807322029461) * z +
+           296.564248779674) * z + 637.333633378831) * z + 793.826512519948) * z + 440.413735824752
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        tail = z + 1.0 / (z + 2.0 / (z + 3.0 / (z + 4.0 / (z + 0.65))))
+        # compare so that a NaN falls through to the rational branch and stays NaN
+        c = np.where(z >= 37.0, 0.0, np.where(z >= 7.07106781186547, e / (tail * SQRT_2PI), e * n / d))
+    return np.where(x > 0, 1.0 - c, c)
+
+
+def _broadcast(*args):
+    return [np.asarray(a, dtype=np.float64) for a in np.broadcast_arrays(*args)]
+
+
+def _d1_d2(spot, strike, years, rate, dividend, sigma):
+    vol_time = sigma * np.sqrt(years)
+    d1 = (np.log(spot / strike) + (rate - dividend + 0.5 * sigma * sigma) * years) / vol_time
+    return d1, d1 - vol_time
+
+
+def black_scholes_price(is_call, spot, strike, years, rate, dividend, sigma):
+    """Return the Black-Scholes-Merton price of European options
+
+    Every argument may be a scalar or an array.  years is the time to
+    expiration, rate and dividend are continuously compounded annual yields.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        d1, d2 = _d1_d2(spot, strike, years, rate, dividend, sigma)
+        forward = spot * np.exp(-dividend * years)
+        discounted = strike * np.exp(-rate * years)
+        call = forward * norm_cdf(d1) - discounted * norm_cdf(d2)
+        # put-call parity is cancellation prone deep in the money, so price puts directly
+        put = discounted * norm_cdf(-d2) - forward * norm_cdf(-d1)
+    return np.where(is_call, call, put)
+
+
+def implied_volatility(price, is_call, spot, strike, years, rate=0.0, dividend=0.0):
+    """Solve the Black-Scholes-Merton volatility of a whole chain at once
+
+    Each contract takes Newton steps on its vega from a closed form
+    estimate.  A step that leaves the contract's bracket of known too
+    low and too high volatilities falls back to bisecting the bracket, so
+    every contract converges.  Only the contracts still in play are
+    computed at each iteration.
+
+    Returns NaN for contracts without a solution: no time left, no time
+    value, or a price outside the no-arbitrage bounds.
+    """
+    arrays = np.broadcast_arrays(is_call, price, spot, strike, years, rate, dividend)
+    shape = arrays[0].shape
+    is_call = arrays[0].astype(bool).ravel()
+    price, spot, strike, years, rate, dividend = (np.asarray(a, dtype=np.float64).ravel() for a in arrays[1:])
+    out = np.full(price.shape, np.nan)
+
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        forward = spot * np.exp(-dividend * years)
+        discounted = strike * np.exp(-rate * years)
+        lower = np.maximum(np.where(is_call, forward - discounted, discounted - forward), 0.0)
+        upper = np.where(is_call, forward, discounted)
+        solvable = (years > 0) & (spot > 0) & (strike > 0) & (price - lower > PRICE_TOLERANCE) & (price < upper)
+
+        # start from the Corrado-Miller estimate on the call price, or where it has no
+        # solution from the volatility where vega peaks, from which Newton converges
+        call_price = np.where(is_call, price, price + forward - discounted)
+        half = call_price - 0.5 * (forward - discounted)
+        radicand = half * half - (forward - discounted)**2 / np.pi
+        corrado_miller = SQRT_2PI / np.sqrt(years) / (forward + discounted) * (half + np.sqrt(radicand))
+        manaster_koehler = np.sqrt(2.0 * np.abs(np.log(forward / discounted)) / years)
+        guess = np.where((radicand > 0) & (corrado_miller > 0), corrado_miller, manaster_koehler)
+
+    index = np.flatnonzero(solvable)
+    sigma = np.clip(guess[index], MIN_VOLATILITY, MAX_VOLATILITY)
+    low = np.full(len(index), MIN_VOLATILITY)
+    high = np.full(len(index), MAX_VOLATILITY)
+    c, s, k, t, r, q, p = (a[index] for a in (is_call, spot, strike, years, rate, dividend, price))
+
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        for _ in range(MAX_ITERATIONS):
+            if len(index) == 0:
+                break
+            d1, d2 = _d1_d2(s, k, t, r, q, sigma)
+            forward = s * np.exp(-q * t)
+            discounted = k * np.exp(-r * t)
+            model = np.where(c, forward * norm_cdf(d1) - discounted * norm_cdf(d2),
+                             discounted * norm_cdf(-d2) - forward * norm_cdf(-d1))
+            diff = model - p
+            vega = forward * norm_pdf(d1) * np.sqrt(t)
+
+            # the price rises with volatility, so each evaluation narrows the bracket
+            high = np.where(diff > 0, sigma, high)
+            low = np.where(diff < 0, sigma, low)
+
+            step = sigma - diff / vega
+            done = ((np.abs(diff) < PRICE_TOLERANCE) | (np.abs(step - sigma) < VOLATILITY_TOLERANCE) |
+                    (high - low < VOLATILITY_TOLERANCE))
+            out[index[done]] = np.where(np.abs(diff) < PRICE_TOLERANCE, sigma, step)[done]
+
+            bisect = ~((step > low) & (step < high))
+            sigma = np.where(bisect, 0.5 * (low + high), step)
+
+            active = ~done
+            if not active.all():
+                index, sigma, low, high = index[active], sigma[active], low[active], high[active]
+                c, s, k, t, r, q, p = (a[active] for a in (c, s, k, t, r, q, p))
+    return out.reshape(shape)
+
+
+def greeks(is_call, spot, strike, years, sigma, rate=0.0, dividend=0.0):
+    """Return the Black-Scholes-Merton Greeks of a whole chain at once
+
+    Returns a dict of arrays: delta, gamma, theta per calendar day, vega and
+    rho per volatility or rate point (1%), and probITM, the risk neutral
+    probability of expiring in the money.  Contracts with a NaN sigma get
+    NaN Greeks.
+    """
+    is_call = np.asarray(is_call, dtype=bool)
+    spot, strike, years, sigma, rate, dividend = _broadcast(spot, strike, years, sigma, rate, dividend)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        d1, d2 = _d1_d2(spot, strike, years, rate, dividend, sigma)
+        sqrt_years = np.sqrt(years)
+        carry = np.exp(-dividend * years)
+        discount = np.exp(-rate * years)
+        pdf = norm_pdf(d1)
+        sign = np.where(is_call, 1.0, -1.0)
+        cdf1 = norm_cdf(sign * d1)
+        cdf2 = norm_cdf(sign * d2)
+
+        theta = (-spot * carry * pdf * sigma / (2.0 * sqrt_years) - sign * rate * strike * discount * cdf2 +
+                 sign * dividend * spot * carry * cdf1)
+        return {
+            'delta': sign * carry * cdf1,
+            'gamma': carry * pdf / (spot * sigma * sqrt_years),
+            'theta': theta / 365.0,
+            'vega': spot * carry * pdf * sqrt_years / 100.0,
+            'rho': sign * strike * years * discount * cdf2 / 100.0,
+            'probITM': cdf2,
+        }
@@ -0,0 +1,84 @@
+import threading
+
+#####################################################################
+# Settings
+
+CACHE_NAME = 'cache'
+
+# time to live per class of endpoint
+DEFAULT_TTLS = {
+    'quotes': 60,  # seconds
+    'chains': 5 * 60,  # seconds
+    'reference': 24 * 60 * 60,  # seconds
+}
+
+# class of every known endpoint, matched as glob patterns without the scheme
+ENDPOINTS = [
+    ('api.tdameritrade.com/v1/marketdata/quotes*', 'quotes'),
+    ('api.tdameritrade.com/v1/marketdata/*/quotes*', 'quotes'),
+    ('api.tdameritrade.com/v1/marketdata/chains*', 'chains'),
+    ('query*.finance.yahoo.com/v7/finance/options/*', 'chains'),
+    ('api.tdameritrade.com/v1/marketdata/hours*', 'reference'),
+    ('api.tdameritrade.com/v1/marketdata/*/hours*', 'reference'),
+    ('api.tdameritrade.com/v1/instruments*', 'reference'),
+]
+
+# unknown endpoints get the shortest time to live
+DEFAULT_CLASS = 'quotes'
+
+# serve stale responses this long past expiry while refreshing in the background
+STALE_WHILE_REVALIDATE = 60  # seconds
+
+
+class HttpCache(object):
+    """One shared HTTP cache for every client in the app
+
+    Each endpoint gets the time to live of its class: quotes are short,
+    chains medium and reference data long.  An expired response is returned
+    right away for up to stale_while_revalidate seconds while a background
+    request refreshes it.  Responses carrying an ETag or Last-Modified header
+    are refreshed with a conditional request, so an unchanged resource costs
+    a 304 instead of a full download.
+    """
+
+    _Singleton = None
+    _lock = threading.Lock()
+
+    @staticmethod
+    def singleton():
+        with HttpCache._lock:
+            if HttpCache._Singleton is None:
+                HttpCache._Singleton = HttpCache()
+            return HttpCache._Singleton
+
+    def __init__(self,
+                 cache_name=CACHE_NAME,
+                 backend='sqlite',
+                 ttls=None,
+                 endpoints=ENDPOINTS,
+                 stale_while_revalidate=STALE_WHILE_REVALIDATE):
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self.settings = dict(
+            cache_name=cache_name,
+            backend=backend,
+            expire_after=self.ttls[DEFAULT_CLASS],
+            urls_expire_after={pattern: self.ttls[cls]
+                               for pattern, cls in endpoints},
+            stale_while_revalidate=stale_while_revalidate,
+        )
+        self._session = None
+
+    def session(self):
+        """Return the shared cached requests session"""
+        with HttpCache._lock:
+            if self._session is None:
+                import requests_cache
+
+                self._session = requests_cache.CachedSession(**self.settings)
+            return self._session
+
+    def install(self):
+        """Cache requests made by libraries that do not accept a session"""
+        import requests_cache
+
+        requests_cache.install_cache(**self.settings)
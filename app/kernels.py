@@ -0,0 +1,173 @@
+import collections
+
+import numpy as np
+
+from app import greeks
+
+#####################################################################
+# Helpers
+
+
+def _float_array(series):
+    return series.to_numpy(dtype=np.float64, na_value=np.nan)
+
+
+def _bool_array(series):
+    # TD returns real booleans, but CSV and YAML round trips leave us with
+    # 'True'/'False' strings.  Accept both.
+    if series.dtype == bool:
+        return series.to_numpy()
+    return series.astype(str).str.lower().to_numpy() == 'true'
+
+
+def _mid_price(bid, ask, last):
+    # The middle of the quote is the market's best estimate of the option value
+    return np.where((bid > 0) & (ask > 0), 0.5 * (bid + ask), last)
+
+
+# Column name suffix of the implied volatility and of each Greek
+greek_names = collections.OrderedDict([
+    ('iv', 'IV'),
+    ('delta', 'Delta'),
+    ('gamma', 'Gamma'),
+    ('theta', 'Theta'),
+    ('vega', 'Vega'),
+    ('rho', 'Rho'),
+    ('probITM', 'ProbITM'),
+])
+
+
+def _add_greeks(df, prefix, price, is_call, spot, strike, days, rate, dividend):
+    # Solve the implied volatility of every contract, then its Greeks at that volatility.
+    # The volatility is reported in percent, like the data sources report theirs.
+    with np.errstate(divide='ignore', invalid='ignore'):
+        years = np.where(days > 0, days / 365.0, np.nan)
+    iv = greeks.implied_volatility(price, is_call, spot, strike, years, rate, dividend)
+    values = greeks.greeks(is_call, spot, strike, years, iv, rate, dividend)
+    values['iv'] = 100.0 * iv
+    for name, suffix in greek_names.items():
+        df[prefix + suffix] = values[name]
+
+
+def _annualize(pct, days):
+    # Contracts at or past expiration have no meaningful annualized return
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(days <= 0, 0.0, pct * 365.0 / days)
+
+
+#####################################################################
+# Kernels
+
+
+def covered_calls_kernel(df, underlyings, stock_price='s_askPrice', key='s_symbol', market=greeks.default_market):
+    """Compute the xo_* covered call columns a whole column at a time
+
+    Expects the o_* option frame produced by the covered calls command, and
+    the quotes of its underlyings indexed by symbol.  The stock price of each
+    contract is aligned from underlyings on its key column.  The implied
+    volatility and Greeks use the rate of market, and the dividend yield it
+    has for the symbol or else the s_divYield of the quote.  The columns are
+    added to df in place, and df is returned.
+    """
+    bid = _float_array(df['o_bid'])
+    last = _float_array(df['o_last'])
+    strike = _float_array(df['o_strikePrice'])
+    days = _float_array(df['o_daysToExpiration'])
+    price = _float_array(underlyings[stock_price].reindex(df[key]))
+    in_the_money = _bool_array(df['o_inTheMoney'])
+
+    symbols = df[key].to_numpy(dtype=object)
+    quote_yield = 0.0
+    if 's_divYield' in underlyings.columns:
+        quote_yield = np.nan_to_num(_float_array(underlyings['s_divYield'].reindex(df[key])) / 100.0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # The bid price is a conservative estimate of the current option price
+        premium = np.where(bid > 0, bid, last)
+        itm_pct = np.where(in_the_money, 0.0, 100.0 * (price - strike) / price)
+
+        # Out of the money or at the money keeps the whole premium.  In the
+        # money gives back the difference between the price and the strike.
+        static_dollars = np.where(price <= strike, premium, premium + strike - price)
+        static_pct = 100.0 * static_dollars / price
+        assigned_pct = 100.0 * (premium + strike - price) / price
+
+    df['xo_premium'] = premium
+    df['xo_inTheMoney%'] = itm_pct
+    df['xo_staticRet$'] = static_dollars
+    df['xo_staticRet%'] = static_pct
+    df['xo_staticRetAnn%'] = _annualize(static_pct, days)
+    df['xo_assignedRet%'] = assigned_pct
+    df['xo_assignedRetAnn%'] = _annualize(assigned_pct, days)
+
+    _add_greeks(df,
+                'xo_',
+                price=_mid_price(bid, _float_array(df['o_ask']), last),
+                is_call=df['o_putCall'].to_numpy(dtype=object) == 'CALL',
+                spot=price,
+                strike=strike,
+                days=days,
+                rate=market.rate,
+                dividend=market.dividend_yield(symbols, default=quote_yield))
+    return df
+
+
+# Column name fragment and break even sign for each long option direction
+long_directions = {
+    'put': ('Drop', -1.0),
+    'call': ('Rise', 1.0),
+}
+
+# Columns of the yahoo chain read by long_options_kernel
+long_options_inputs = ['Expiry', 'Type', 'Bid', 'Ask', 'Last', 'Strike', 'Root', 'Underlying_Price']
+
+
+def long_options_kernel(df, direction, today, market=greeks.default_market):
+    """Compute the x* long put or long call columns a whole column at a time
+
+    direction is 'put' or 'call'.  Expects the reset_index() frame returned
+    by the yahoo Options reader.  The implied volatility and Greeks use the
+    rate of market and the dividend yield it has for the Root symbol.  The
+    columns are added to df in place, and df is returned.
+    """
+    move, sign = long_directions[direction]
+
+    days = (df['Expiry'] - today).dt.days.to_numpy()
+    bid = _float_array(df['Bid'])
+    ask = _float_array(df['Ask'])
+    last = _float_array(df['Last'])
+    strike = _float_array(df['Strike'])
+    price = _float_array(df['Underlying_Price'])
+    dividend = market.dividend_yield(df['Root'].to_numpy(dtype=object))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # The ask price is a conservative estimate of the current option price
+        premium = np.where(ask > 0, ask, last)
+        break_even_price = strike + sign * ask
+        break_even_move = sign * (break_even_price - price)
+        break_even_pct = 100.0 * break_even_move / price
+        per_day_pct = np.where(days == 0, 0.0, break_even_pct / days)
+
+    df['xDaysUntilExpiration'] = days
+    df['xExpired'] = days <= 0
+    df['xDividend'] = dividend
+    df['xPremium'] = premium
+    df['xBreakEvenPrice'] = break_even_price
+    df['xBreakEven' + move] = break_even_move
+    df['xBreakEven' + move + '%'] = break_even_pct
+    df['xBreakEven' + move + '%PerDayUntilExpiration'] = per_day_pct
+
+    if direction == 'put':
+        with np.errstate(divide='ignore', invalid='ignore'):
+            df['xBankrupcyReturn%'] = np.where(premium == 0, 0.0, 100.0 * (strike - premium) / premium)
+
+    _add_greeks(df,
+                'x',
+                price=_mid_price(bid, ask, last),
+                is_call=df['Type'].to_numpy(dtype=object) == 'call',
+                spot=price,
+                strike=strike,
+                days=days,
+                rate=market.rate,
+                dividend=dividend)
+    return df
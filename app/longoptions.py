@@ -0,0 +1,426 @@
+import datetime
+import click
+import functools
+import logging
+
+from app import app
+from app import cli as app_cli
+from app import csvstream
+from app import envelopes
+from app import filters
+from app import greeks
+from app import httpcache
+from app import kernels
+from app import normalize
+from app import pipeline
+from app import snapshots
+from app import trace
+from app import watch
+from app import yahoo
+
+log = logging.getLogger(__name__)
+
+app = app.App()
+
+#####################################################################
+# Settings
+
+# the columns the fetch envelope of a filter is read from, so only the expiries and contract
+# type that can pass it are fetched
+envelope_columns = envelopes.Columns(contract_type='Type',
+                                     strike='Strike',
+                                     underlying='Underlying_Price',
+                                     days='xDaysUntilExpiration')
+
+
+class LongOptions(object):
+    """The long puts or long calls screen of the yahoo chains
+
+    direction is 'put' or 'call'.  name is the watchlist and filters key in
+    config.yaml, csv_cols the CSV columns to export, sort_cols the columns
+    to sort them by, and default_filter the screen predicates used when the
+    config has none.
+    """
+    def __init__(self, direction, name, csv_cols, sort_cols, default_filter):
+        self.direction = direction
+        self.name = name
+        self.csv_cols = csv_cols
+        self.sort_cols = sort_cols
+        self.default_filter = default_filter
+
+    def csv_out(self, filename, df, stream=None, counts=None, screen_filter=None):
+        screen_filter = screen_filter or self.default_filter
+        with trace.stage('derived predicates') as span:
+            filtered = df.loc[screen_filter.mask(df)]
+            span.rows = len(filtered)
+        if counts is not None:
+            counts.add('derived predicates', len(filtered))
+
+        with trace.stage('csv') as span:
+            span.rows = len(filtered)
+
+            # in stream mode, append the rows to the output and keep a sorted run for the final merge
+            if stream is not None:
+                return stream.add(filtered, self.csv_cols)
+
+            ret = filtered.sort_values(by=self.sort_cols, ascending=True).to_csv(filename,
+                                                                                 columns=self.csv_cols,
+                                                                                 index=False,
+                                                                                 float_format='%.2f')
+        return ret
+
+    def screen(self,
+               client,
+               tickers,
+               workers=pipeline.DEFAULT_WORKERS,
+               counts=None,
+               screen_filter=None,
+               float32=False,
+               market=greeks.default_market):
+        """Fetch and process every ticker, returning (all_df, pipeline)
+
+        The raw predicates are applied to each ticker as it arrives, the
+        survivors are concatenated once, and the derived columns are computed
+        in one batch over the combined frame.  all_df is None if no ticker
+        could be fetched.
+        """
+        screen_filter = screen_filter or self.default_filter
+        today = datetime.datetime.today()
+
+        def prepare(ticker, df):
+            return self.prepare_dataframe(df, counts=counts, screen_filter=screen_filter)
+
+        p = pipeline.Pipeline(self.fetcher(client, screen_filter, float32), prepare, workers=workers)
+        frames = p.run(tickers)
+        if not frames:
+            return None, p
+
+        # all_df contains all data from all tickers
+        all_df = normalize.concat_dataframes(frames)
+        return self.metrics_dataframe(all_df, market=market, today=today), p
+
+    def stream(self,
+               client,
+               tickers,
+               filename,
+               workers=pipeline.DEFAULT_WORKERS,
+               counts=None,
+               screen_filter=None,
+               float32=False,
+               market=greeks.default_market):
+        """Fetch and process every ticker, streaming its rows to filename
+
+        Each ticker is processed and filtered on its own, and its rows are
+        appended to filename as soon as they are ready.  Once every ticker is
+        done, filename is rewritten globally sorted by a k-way merge of the
+        per-ticker runs.  Returns the pipeline.
+        """
+        screen_filter = screen_filter or self.default_filter
+        stream = csvstream.SortedCsvStream(filename, self.sort_cols, ascending=True, columns=self.csv_cols)
+        today = datetime.datetime.today()
+
+        def process(ticker, df):
+            df = self.prepare_dataframe(df, counts=counts, screen_filter=screen_filter)
+            df = self.metrics_dataframe(df, market=market, today=today)
+            return self.csv_out(filename, df, stream=stream, counts=counts, screen_filter=screen_filter)
+
+        p = pipeline.Pipeline(self.fetcher(client, screen_filter, float32), process, workers=workers)
+        with stream:
+            runs = p.run(tickers)
+            with trace.stage('merge'):
+                stream.merge(runs)
+        return p
+
+    def watcher(self,
+                client,
+                filename,
+                workers=pipeline.DEFAULT_WORKERS,
+                screen_filter=None,
+                float32=False,
+                market=greeks.default_market):
+        """Return a Watcher that keeps filename up to date
+
+        Each ticker is processed and filtered on its own, and only the tickers
+        whose chains changed since the last cycle are processed again.
+        """
+        screen_filter = screen_filter or self.default_filter
+        output = csvstream.PatchedCsv(filename, self.sort_cols, ascending=True)
+
+        def process(ticker, data):
+            df = self.prepare_dataframe(data, screen_filter=screen_filter)
+            df = self.metrics_dataframe(df, market=market)
+            return self.csv_out(filename, df, stream=output, screen_filter=screen_filter)
+
+        return watch.Watcher(self.fetcher(client, screen_filter, float32), process, output.write, workers=workers)
+
+    def columns(self, screen_filter=None):
+        """Return the fetched columns read by the CSV, the metrics and the filter"""
+        screen_filter = screen_filter or self.default_filter
+        return list(dict.fromkeys(self.csv_cols + kernels.long_options_inputs + screen_filter.columns))
+
+    def fetcher(self, client, screen_filter=None, float32=False):
+        """Return fetch(ticker), which fetches and normalizes the envelope of the filter from one chain"""
+        return functools.partial(yahoo.fetch_options,
+                                 client,
+                                 columns=self.columns(screen_filter),
+                                 float32=float32,
+                                 envelope=self.envelope(screen_filter))
+
+    def envelope(self, screen_filter=None):
+        """Return the envelopes.Envelope of the contracts that can pass the filter"""
+        return envelopes.Envelope.from_filter(screen_filter or self.default_filter, envelope_columns)
+
+    def process_dataframe(self, df, market=greeks.default_market, today=None):
+        # reset_index()
+        #   copies multi-index values into columns
+        #   sets index to single ordinal integer
+        df.reset_index(inplace=True)
+        return self.metrics_dataframe(df, market=market, today=today)
+
+    def prepare_dataframe(self, df, counts=None, screen_filter=None):
+        """Drop the contracts that fail the raw predicates, then flatten the chain"""
+        # the predicates read the multi-index levels directly, so only the
+        # surviving contracts are copied by reset_index()
+        #   copies multi-index values into columns
+        #   sets index to single ordinal integer
+        screen_filter = screen_filter or self.default_filter
+        with trace.stage('raw predicates') as span:
+            filtered = df.loc[screen_filter.raw_mask(df)].reset_index()
+            span.rows = len(filtered)
+        if counts is not None:
+            counts.add('fetched', len(df))
+            counts.add('raw predicates', len(filtered))
+        return filtered
+
+    def metrics_dataframe(self, df, market=greeks.default_market, today=None):
+        """Add the x* columns to df, counting the days to expiration from today, or from now when it is None"""
+        # today is read on every call, so a long running watch or serve stays current
+        if today is None:
+            today = datetime.datetime.today()
+        with trace.stage('metrics') as span:
+            span.rows = len(df)
+            return kernels.long_options_kernel(df, self.direction, today, market=market)
+
+
+long_puts = LongOptions(
+    'put',
+    'long_puts',
+    csv_cols=[
+        'xBreakEvenDrop%PerDayUntilExpiration',
+        'xBreakEvenDrop%',
+        'xPremium',
+        'xDaysUntilExpiration',
+        'xBreakEvenDrop',
+        'xBreakEvenPrice',
+        'Root',
+        'Underlying_Price',
+        'Strike',
+        'Type',
+        'Expiry',
+        'Symbol',
+        'Bid',
+        'Ask',
+        'Last',
+        'Vol',
+        'Open_Int',
+        'IV',
+        'xBankrupcyReturn%',
+        'xIV',
+        'xDelta',
+        'xGamma',
+        'xTheta',
+        'xVega',
+        'xRho',
+        'xProbITM',
+    ],
+    sort_cols=['xBreakEvenDrop%PerDayUntilExpiration', 'xDaysUntilExpiration', 'xBreakEvenDrop%'],
+    # screen predicates, overridden by filters: long_puts: in config.yaml
+    default_filter=filters.ScreenFilter(
+        raw=[
+            "Type == 'put'",  # puts
+            'Strike < Underlying_Price',  # out of the money
+            'Vol > 1',  # volume greater than 1
+            'Open_Int > 10',  # open interest greater than 10
+        ],
+        derived=[
+            'not xExpired',  # not expired
+            'xDaysUntilExpiration >= 14',  # greater than 2 weeks from expiration
+            'xDaysUntilExpiration > 30',  # greater than 30 days from expiration
+        ],
+        ticker_column='Underlying'))
+
+long_calls = LongOptions(
+    'call',
+    'long_calls',
+    csv_cols=[
+        'xBreakEvenRise%PerDayUntilExpiration',
+        'xBreakEvenRise%',
+        'xPremium',
+        'xDaysUntilExpiration',
+        'xBreakEvenRise',
+        'xBreakEvenPrice',
+        'Root',
+        'Underlying_Price',
+        'Strike',
+        'Type',
+        'Expiry',
+        'Symbol',
+        'Bid',
+        'Ask',
+        'Last',
+        'Vol',
+        'Open_Int',
+        'IV',
+        'xIV',
+        'xDelta',
+        'xGamma',
+        'xTheta',
+        'xVega',
+        'xRho',
+        'xProbITM',
+    ],
+    sort_cols=['xBreakEvenRise%PerDayUntilExpiration', 'xDaysUntilExpiration', 'xBreakEvenRise%'],
+    # screen predicates, overridden by filters: long_calls: in config.yaml
+    default_filter=filters.ScreenFilter(
+        raw=[
+            "Type == 'call'",  # calls
+            'Strike > Underlying_Price',  # out of the money
+            'Vol > 1',  # volume greater than 1
+            'Open_Int > 10',  # open interest greater than 10
+        ],
+        derived=[
+            'not xExpired',  # not expired
+            'xDaysUntilExpiration >= 14',  # greater than 2 weeks from expiration
+            'xDaysUntilExpiration > 4',  # greater than 4 days from expiration
+        ],
+        ticker_column='Underlying'))
+
+#####################################################################
+# Click Code
+
+
+def add_commands(group, strategy):
+    """Add the run and watch commands of strategy to the click group of its subcommand"""
+    @group.command()
+    @click.argument('config_yaml')
+    @click.argument('output_csv')
+    @click.option('--workers',
+                  default=pipeline.DEFAULT_WORKERS,
+                  show_default=True,
+                  help='Number of tickers to fetch concurrently.')
+    @click.option('--stream',
+                  is_flag=True,
+                  help='Append each ticker to the output as it is ready, then sort the file once all are done.')
+    @click.option('--snapshots',
+                  'snapshot_dir',
+                  type=click.Path(file_okay=False),
+                  help='Read chains through a Parquet snapshot store in this folder.')
+    @click.option('--max-age',
+                  default=snapshots.DEFAULT_MAX_AGE,
+                  show_default=True,
+                  help='Seconds a snapshot stays fresh enough to skip the network.')
+    @click.option('--float32', is_flag=True, help='Hold fetched float columns as float32 to halve their memory.')
+    @app_cli.pass_context
+    def run(ctx, config_yaml, output_csv, workers, stream, snapshot_dir, max_age, float32):
+        """This command loads config.yaml and the current ENV-ironment,
+        creates a single merged dict, and prints to stdout.
+        """
+
+        # read the configuration file
+        c = app.get_config_dict(ctx, [config_yaml])
+
+        # use cache to reduce web traffic
+        client = yahoo.YahooClient(httpcache.HttpCache.singleton().session())
+        if snapshot_dir is not None:
+            client = snapshots.SnapshotClient(client, snapshots.SnapshotStore(snapshot_dir, max_age=max_age), 'yahoo')
+
+        tickers = c['config']['options'][strategy.name]
+        try:
+            screen_filter = filters.ScreenFilter.from_config(c['config'], strategy.name, strategy.default_filter)
+            market = greeks.Market.from_config(c['config'])
+        except (filters.FilterError, ValueError) as e:
+            raise click.ClickException(str(e))
+
+        # stream each ticker to the output as it is ready
+        if stream:
+            counts = pipeline.RowCounts()
+            p = strategy.stream(client,
+                                tickers,
+                                output_csv,
+                                workers=workers,
+                                counts=counts,
+                                screen_filter=screen_filter,
+                                float32=float32,
+                                market=market)
+            if p.failures:
+                ctx.log(p.report())
+            if not p.results:
+                raise click.ClickException("No tickers could be screened")
+            ctx.log(counts.report())
+            return
+
+        # fetch and process the tickers concurrently
+        counts = pipeline.RowCounts()
+        all_df, p = strategy.screen(client,
+                                    tickers,
+                                    workers=workers,
+                                    counts=counts,
+                                    screen_filter=screen_filter,
+                                    float32=float32,
+                                    market=market)
+        if p.failures:
+            ctx.log(p.report())
+        if all_df is None:
+            raise click.ClickException("No tickers could be screened")
+
+        # output the all_df, which contains all of the tickers
+        strategy.csv_out(output_csv, all_df, counts=counts, screen_filter=screen_filter)
+        ctx.log(counts.report())
+
+    @group.command('watch')
+    @click.argument('config_yaml')
+    @click.argument('output_csv')
+    @click.option('--interval',
+                  default=watch.DEFAULT_INTERVAL,
+                  show_default=True,
+                  help='Seconds between the start of each fetch cycle.')
+    @click.option('--cycles', type=int, help='Stop after this many cycles instead of running until interrupted.')
+    @click.option('--workers',
+                  default=pipeline.DEFAULT_WORKERS,
+                  show_default=True,
+                  help='Number of tickers to fetch concurrently.')
+    @click.option('--float32', is_flag=True, help='Hold fetched float columns as float32 to halve their memory.')
+    @app_cli.pass_context
+    def watch_command(ctx, config_yaml, output_csv, interval, cycles, workers, float32):
+        """This command loads config.yaml and keeps OUTPUT_CSV up to date,
+        re-screening only the tickers whose chains changed each cycle.
+        """
+
+        # read the configuration file
+        c = app.get_config_dict(ctx, [config_yaml])
+
+        # use cache to reduce web traffic
+        client = yahoo.YahooClient(httpcache.HttpCache.singleton().session())
+
+        tickers = c['config']['options'][strategy.name]
+        try:
+            screen_filter = filters.ScreenFilter.from_config(c['config'], strategy.name, strategy.default_filter)
+            market = greeks.Market.from_config(c['config'])
+        except (filters.FilterError, ValueError) as e:
+            raise click.ClickException(str(e))
+
+        w = strategy.watcher(client,
+                             output_csv,
+                             workers=workers,
+                             screen_filter=screen_filter,
+                             float32=float32,
+                             market=market)
+        try:
+            for cycle in w.watch(tickers, interval=interval, cycles=cycles):
+                if cycle.pipeline.failures:
+                    ctx.log(cycle.pipeline.report())
+                ctx.log(cycle.report())
+        except KeyboardInterrupt:
+            pass
+
+    return group
@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+
+
+def normalize_dataframe(df, keep=None, drop=(), categorical=(), flags=(), float32=False):
+    """Return a compact copy of a fetched frame
+
+    Only the columns in keep are kept if it is given, and the columns in drop
+    are removed.  Of the remaining columns, those in categorical become
+    categoricals and those in flags become bools when every value is a bool
+    or a 'True'/'False' string.  With float32, every float64 column is
+    downcast.  Index levels are left alone, since a MultiIndex already stores
+    each level once.
+    """
+    if keep is not None:
+        df = df[[c for c in df.columns if c in keep]]
+    drop = [c for c in drop if c in df.columns]
+    if drop:
+        df = df.drop(columns=drop)
+
+    converted = {}
+    for c in df.columns:
+        s = df[c]
+        if c in categorical:
+            if pd.api.types.is_string_dtype(s.dtype) and not isinstance(s.dtype, pd.CategoricalDtype):
+                converted[c] = s.astype('category')
+        elif c in flags:
+            if s.dtype != bool:
+                flag = _as_bool(s)
+                if flag is not None:
+                    converted[c] = flag
+        elif float32 and s.dtype == np.float64:
+            converted[c] = s.astype(np.float32)
+
+    if converted:
+        df = df.copy(deep=False)
+        for c, s in converted.items():
+            df[c] = s
+    return df
+
+
+def concat_dataframes(frames):
+    """Concatenate frames with a fresh index, keeping categorical columns categorical
+
+    pd.concat falls back to object dtype when the categories of a column
+    differ between frames, as they do between tickers, so every frame is
+    first given the union of the categories.
+    """
+    frames = list(frames)
+    for c in frames[0].columns:
+        if not all(c in f.columns and isinstance(f[c].dtype, pd.CategoricalDtype) for f in frames):
+            continue
+        categories = pd.api.types.union_categoricals([f[c] for f in frames]).categories
+        for i, f in enumerate(frames):
+            if not f[c].cat.categories.equals(categories):
+                f = f.copy(deep=False)
+                f[c] = f[c].cat.set_categories(categories)
+                frames[i] = f
+    return pd.concat(frames, ignore_index=True)
+
+
+def memory_usage(df):
+    """Return the bytes held by df, including its index and python objects"""
+    return int(df.memory_usage(deep=True, index=True).sum())
+
+
+def _as_bool(s):
+    # Missing values have no bool, so leave those columns as they are
+    if s.isna().any():
+        return None
+    text = s.astype(str)
+    if not text.isin(['True', 'False']).all():
+        return None
+    return text == 'True'
@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+
+#####################################################################
+# Settings
+
+# OCC option symbols are the underlying, the expiration as yymmdd, C or P,
+# and the strike times 1000 as eight digits.  For example:
+#   GOOG170113C00620000 is the GOOG 2017-01-13 620.0 call
+occ_regex = r'^(?P<underlying>.+?)\s*(?P<expiry>\d{6})(?P<putCall>[CP])(?P<strike>\d{8})$'
+
+
+def occ_encode(underlying, expiry, put_call, strike):
+    """Encode whole arrays of contracts into OCC option symbols
+
+    underlying may be a single string or an array.  expiry is anything
+    pd.to_datetime accepts.  put_call accepts 'call'/'put' in any case, or
+    'C'/'P'.  The strike is rounded to the nearest thousandth.  Returns a
+    numpy array of strings.
+    """
+    expiry = pd.DatetimeIndex(pd.to_datetime(np.asarray(expiry)))
+    n = len(expiry)
+
+    yymmdd = (expiry.year - 2000) * 10000 + expiry.month * 100 + expiry.day
+    put_call = np.char.upper(np.asarray(put_call, dtype=str))
+    letter = np.where(np.char.startswith(put_call, 'C'), 'C', 'P')
+    strike = np.rint(np.asarray(strike, dtype=np.float64) * 1000).astype(np.int64)
+
+    underlying = np.broadcast_to(np.asarray(underlying, dtype=str), (n, ))
+    symbols = np.char.add(underlying, np.char.zfill(np.asarray(yymmdd, dtype=np.int64).astype(str), 6))
+    symbols = np.char.add(symbols, letter)
+    symbols = np.char.add(symbols, np.char.zfill(strike.astype(str), 8))
+    return symbols.astype(object)
+
+
+def occ_decode(symbols):
+    """Decode whole arrays of OCC option symbols
+
+    Returns a DataFrame with columns underlying, expiry, type ('call' or
+    'put') and strike.  Space padded roots are accepted.  Symbols that do not
+    parse become rows of NaN.
+    """
+    parts = pd.Series(np.asarray(symbols, dtype=object)).str.extract(occ_regex)
+    return pd.DataFrame({
+        'underlying': parts['underlying'],
+        'expiry': pd.to_datetime(parts['expiry'], format='%y%m%d'),
+        'type': parts['putCall'].map({
+            'C': 'call',
+            'P': 'put'
+        }),
+        'strike': parts['strike'].astype(float) / 1000.0,
+    })
@@ -0,0 +1,123 @@
+import collections
+import logging
+import queue
+import threading
+
+from app import trace
+
+log = logging.getLogger(__name__)
+
+#####################################################################
+# Settings
+
+# number of concurrent fetch workers
+DEFAULT_WORKERS = 4
+
+# fetched chains allowed to wait for the compute stage, per worker
+QUEUE_DEPTH_PER_WORKER = 2
+
+
+class Pipeline(object):
+    """Overlap network fetches with computation over a bounded queue
+
+    A pool of worker threads calls fetch(ticker) and feeds the results into a
+    bounded queue.  The calling thread drains the queue and calls
+    compute(ticker, data) as each chain arrives, so ticker N is computed while
+    ticker N+1 is still downloading.  A failure in either stage is recorded
+    against its ticker and does not abort the run.
+    """
+    def __init__(self, fetch, compute, workers=DEFAULT_WORKERS):
+        self.fetch = fetch
+        self.compute = compute
+        self.workers = max(1, int(workers))
+        self.results = {}
+        self.failures = {}
+
+    def run(self, tickers):
+        """Run every ticker through the pipeline
+
+        Returns the compute results in the order the tickers were given,
+        skipping any ticker that failed.
+        """
+        tickers = list(dict.fromkeys(tickers))  # drop duplicates, keep order
+
+        pending = queue.Queue()
+        for ticker in tickers:
+            pending.put(ticker)
+        fetched = queue.Queue(maxsize=self.workers * QUEUE_DEPTH_PER_WORKER)
+
+        threads = []
+        for i in range(min(self.workers, len(tickers))):
+            t = threading.Thread(target=self._fetch_worker, args=(pending, fetched), name='fetch-{}'.format(i))
+            t.daemon = True
+            t.start()
+            threads.append(t)
+
+        for _ in range(len(tickers)):
+            ticker, data, error = fetched.get()
+            if error is not None:
+                self._fail(ticker, 'fetch', error)
+                continue
+            try:
+                with trace.stage('compute', ticker):
+                    self.results[ticker] = self.compute(ticker, data)
+            except Exception as e:
+                self._fail(ticker, 'compute', e)
+
+        for t in threads:
+            t.join()
+
+        return [self.results[ticker] for ticker in tickers if ticker in self.results]
+
+    def report(self):
+        """Return a human readable summary of the failed tickers"""
+        if not self.failures:
+            return ''
+        total = len(self.results) + len(self.failures)
+        lines = ['{} of {} tickers failed:'.format(len(self.failures), total)]
+        for ticker, (stage, error) in sorted(self.failures.items()):
+            lines.append('  {} ({}): {}: {}'.format(ticker, stage, type(error).__name__, error))
+        return '\n'.join(lines)
+
+    def _fetch_worker(self, pending, fetched):
+        while True:
+            try:
+                ticker = pending.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                with trace.stage('fetch', ticker):
+                    data = self.fetch(ticker)
+            except Exception as e:
+                fetched.put((ticker, None, e))
+            else:
+                fetched.put((ticker, data, None))
+
+    def _fail(self, ticker, stage, error):
+        log.warning("Failed to {} ticker {} error=[{}]".format(stage, ticker, error))
+        self.failures[ticker] = (stage, error)
+
+
+class RowCounts(object):
+    """Rows left after each stage of a screen, summed over tickers
+
+    Stages are reported in the order they were first counted, each as a share
+    of the first stage.
+    """
+    def __init__(self, title='Rows per stage'):
+        self.title = title
+        self.counts = collections.OrderedDict()
+
+    def add(self, stage, rows):
+        self.counts[stage] = self.counts.get(stage, 0) + int(rows)
+
+    def report(self):
+        """Return a human readable table of the rows left after each stage"""
+        if not self.counts:
+            return ''
+        first = next(iter(self.counts.values()))
+        lines = ['{}:'.format(self.title)]
+        for stage, rows in self.counts.items():
+            share = 100.0 * rows / first if first else 0.0
+            lines.append('  {:<20} {:>12,} {:>7.2f}%'.format(stage, rows, share))
+        return '\n'.join(lines)
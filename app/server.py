@@ -0,0 +1,249 @@
+import collections
+import hashlib
+import http.server
+import json
+import logging
+import threading
+import urllib.parse
+import uuid
+
+from app import pipeline
+from app import watch
+from app.utils import LogUtils
+
+log = logging.getLogger(__name__)
+
+#####################################################################
+# Settings
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8080
+
+# seconds a fetched chain is served before it is fetched again
+DEFAULT_MAX_AGE = 15
+
+# the shortest wait between background refreshes, however low max_age is
+MIN_INTERVAL = 1
+
+# tickers outside the watchlist kept resident at once
+DEFAULT_MAX_TICKERS = 50
+
+# seconds a ticker that failed waits before it is fetched again, doubled on every further failure
+DEFAULT_BACKOFF = 60
+
+# response formats, chosen by ?format= or the Accept header
+content_types = collections.OrderedDict([
+    ('json', 'application/json'),
+    ('csv', 'text/csv'),
+])
+
+Response = collections.namedtuple('Response', ['status', 'headers', 'body'])
+
+# the rows and content hashes of the last refresh of a Screen, and every ticker tried so far
+Snapshot = collections.namedtuple('Snapshot', ['rows', 'hashes', 'tried'])
+
+
+class Screen(object):
+    """One strategy screened over chains kept resident between requests
+
+    process(ticker, chain) hands the filtered rows of a ticker to
+    output.add(), a csvstream.PatchedCsv.  Once start() is called, a
+    background thread runs a watch.Watcher cycle every max_age seconds,
+    which refetches the chains and processes again only those whose content
+    changed, and requests are answered from the rows of the last cycle.
+    Only a ticker that was never fetched is fetched by the request asking
+    for it.  A ticker that fails is retried after backoff seconds, doubling
+    on every further failure.
+
+    Besides the watchlist, at most max_tickers other tickers are kept, and
+    the one asked for least recently is dropped first.  The ETag of a
+    response is derived from the content hashes of its chains, so a client
+    that already has the current rows gets a 304 before anything is rendered.
+    """
+    def __init__(self, fetch, process, output, watchlist=(), workers=pipeline.DEFAULT_WORKERS,
+                 max_age=DEFAULT_MAX_AGE, max_tickers=DEFAULT_MAX_TICKERS, backoff=DEFAULT_BACKOFF):
+        self.output = output
+        # spelled like the tickers of requests, which are upper-cased
+        self.watchlist = list(dict.fromkeys(t.strip().upper() for t in watchlist))
+        self.max_age = max_age
+        self.max_tickers = max_tickers
+        self.watcher = watch.Watcher(fetch, process, None, workers=workers, max_age=max_age, backoff=backoff)
+        # guards the watcher, so one cycle runs at a time
+        self.refresh_lock = threading.Lock()
+        # guards the snapshot, the other tickers and the rendered bodies
+        self.lock = threading.Lock()
+        # the rows and hashes of the last cycle, and every ticker tried so far
+        self.snapshot = Snapshot({}, {}, frozenset())
+        # the tickers asked for beyond the watchlist, least recently asked first
+        self.others = collections.OrderedDict()
+        # the last rendered body of each format, with its ETag
+        self.rendered = {}
+        # tells apart the ETags of different servers over the same chains
+        self.generation = uuid.uuid4().hex
+        self.thread = None
+        self.stopping = threading.Event()
+
+    def get(self, tickers, fmt='json', if_none_match=None):
+        """Return the Response for the rows of tickers in fmt"""
+        tickers = list(dict.fromkeys(tickers))  # drop duplicates, keep order
+        with self.lock:
+            others = [t for t in tickers if t not in self.watchlist]
+            if len(others) > self.max_tickers:
+                return error_response(
+                    400, 'At most {} tickers outside the watchlist may be asked for'.format(self.max_tickers))
+            for ticker in others:
+                self.others[ticker] = True
+                self.others.move_to_end(ticker)
+            while len(self.others) > self.max_tickers:
+                self.others.popitem(last=False)
+            new = [t for t in tickers if t not in self.snapshot.tried]
+
+        # only the tickers never tried wait on a fetch
+        if new:
+            self.refresh(new)
+
+        with self.lock:
+            snapshot = self.snapshot
+            present = [t for t in tickers if t in snapshot.rows]
+            missing = [t for t in tickers if t not in snapshot.rows]
+            etag = self.etag(fmt, snapshot, present, missing)
+            headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+            if if_none_match is not None and etag_matches(if_none_match, etag):
+                return Response(304, headers, b'')
+
+            cached = self.rendered.get(fmt)
+            if cached is None or cached[0] != etag:
+                cached = (etag, self.render(fmt, snapshot, present, missing))
+                self.rendered[fmt] = cached
+        headers['Content-Type'] = content_types[fmt]
+        return Response(200, headers, cached[1])
+
+    def refresh(self, tickers=None):
+        """Run one watcher cycle over tickers, or over every ticker kept, and return the Cycle"""
+        with self.refresh_lock:
+            with self.lock:
+                kept = self.watchlist + [t for t in self.others if t not in self.watchlist]
+                dropped = [t for t in self.snapshot.tried if t not in kept]
+            for ticker in dropped:
+                self.watcher.forget(ticker)
+            cycle = self.watcher.cycle(kept if tickers is None else tickers)
+            with self.lock:
+                self.snapshot = Snapshot(dict(self.watcher.rows), dict(self.watcher.hashes),
+                                         (self.snapshot.tried - set(dropped)) | set(cycle.tickers))
+        if cycle.pipeline.failures:
+            log.warning(cycle.pipeline.report())
+        return cycle
+
+    def start(self):
+        """Refresh the chains every max_age seconds in a background thread until stop()"""
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.stopping.clear()
+            self.thread = threading.Thread(target=self._run, name='screen-refresh')
+            self.thread.daemon = True
+            self.thread.start()
+
+    def stop(self):
+        with self.lock:
+            thread, self.thread = self.thread, None
+        if thread is not None:
+            self.stopping.set()
+            thread.join()
+
+    def _run(self):
+        delay = 0.0
+        while not self.stopping.wait(delay):
+            try:
+                delay = max(MIN_INTERVAL, self.max_age - self.refresh().seconds)
+            except Exception:
+                log.exception("Failed to refresh the chains")
+                delay = max(MIN_INTERVAL, self.max_age)
+
+    def etag(self, fmt, snapshot, present, missing):
+        h = hashlib.blake2b(self.generation.encode(), digest_size=16)
+        h.update(fmt.encode())
+        for ticker in present:
+            h.update('\0{}\0{}'.format(ticker, snapshot.hashes[ticker]).encode())
+        h.update('\0'.join(missing).encode())
+        return '"{}"'.format(h.hexdigest())
+
+    def render(self, fmt, snapshot, present, missing):
+        df = self.output.frame(snapshot.rows[t] for t in present)
+        if fmt == 'csv':
+            return df.to_csv(index=False, float_format=self.output.float_format).encode()
+        return '{{"tickers": {}, "missing": {}, "rows": {}}}'.format(
+            json.dumps(present), json.dumps(missing), df.to_json(orient='records', date_format='iso')).encode()
+
+
+class ScreenServer(http.server.ThreadingHTTPServer):
+    """Serve GET /screen/<name>?tickers=A,B&format=json|csv from resident Screens
+
+    Without tickers, the watchlist of the screen is used.  GET /health
+    answers once the server is up.  Every request is logged through
+    access_log, LogUtils.get_fast_logger() by default, so logging never
+    waits on stderr.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, screens, access_log=None):
+        super().__init__(address, ScreenRequestHandler)
+        self.screens = screens
+        self.access_log = access_log if access_log is not None else LogUtils.get_fast_logger("INFO")
+
+
+class ScreenRequestHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):  # noqa: N802
+        try:
+            self.send(self.route())
+        except Exception as e:
+            log.exception("Failed to serve {}".format(self.path))
+            self.send(error_response(500, '{}: {}'.format(type(e).__name__, e)))
+
+    def route(self):
+        url = urllib.parse.urlsplit(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        parts = url.path.strip('/').split('/')
+        if parts == ['health']:
+            return Response(200, {'Content-Type': content_types['json']}, b'{"status": "ok"}')
+        if len(parts) != 2 or parts[0] != 'screen' or parts[1] not in self.server.screens:
+            return error_response(404, 'No screen at {}, try one of: {}'.format(
+                url.path, ', '.join('/screen/' + name for name in self.server.screens)))
+        screen = self.server.screens[parts[1]]
+
+        fmt = query.get('format', [None])[-1]
+        if fmt is None:
+            fmt = 'csv' if content_types['csv'] in self.headers.get('Accept', '') else 'json'
+        if fmt not in content_types:
+            return error_response(400, 'format must be one of: {}'.format(', '.join(content_types)))
+
+        tickers = [t.strip().upper() for t in ','.join(query.get('tickers', [])).split(',') if t.strip()]
+        tickers = tickers or screen.watchlist
+        if not tickers:
+            return error_response(400, 'No tickers given and none are watched')
+        return screen.get(tickers, fmt, self.headers.get('If-None-Match'))
+
+    def send(self, response):
+        self.send_response(response.status)
+        for name, value in response.headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(response.body)))
+        self.end_headers()
+        self.wfile.write(response.body)
+
+    def log_message(self, format, *args):
+        self.server.access_log.info(format, *args, client=self.address_string())
+
+
+#####################################################################
+# Functions
+
+
+def error_response(status, message):
+    return Response(status, {'Content-Type': content_types['json']}, json.dumps({'error': message}).encode())
+
+
+def etag_matches(if_none_match, etag):
+    """Return True if an If-None-Match header lists etag, weakly compared"""
+    tags = [t.strip() for t in if_none_match.split(',')]
+    return '*' in tags or etag in [t[2:] if t.startswith('W/') else t for t in tags]
@@ -0,0 +1,183 @@
+import datetime
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import time
+
+log = logging.getLogger(__name__)
+
+#####################################################################
+# Settings
+
+# default freshness window for read-through
+DEFAULT_MAX_AGE = 180  # seconds
+
+# parquet schema metadata key listing the columns stored as JSON strings
+JSON_COLUMNS_KEY = b'options_screener.json_columns'
+
+snapshot_regex = re.compile(r'^(\d+)\.parquet$')
+
+
+class SnapshotStore(object):
+    """Persist quotes and option chains as Parquet snapshots
+
+    Snapshots are partitioned by ticker and quote date:
+
+      <root>/<source>/<kind>/ticker=<TICKER>/date=<YYYY-MM-DD>/<epoch_ms>.parquet
+
+    read_through() returns the newest snapshot if it is younger than max_age
+    seconds, and otherwise fetches, persists and returns fresh data.
+    """
+    def __init__(self, root, max_age=DEFAULT_MAX_AGE):
+        self.root = root
+        self.max_age = max_age
+
+    def write(self, source, kind, ticker, df, timestamp=None):
+        """Persist df as the snapshot taken at timestamp, and return its path"""
+        if timestamp is None:
+            timestamp = time.time()
+        date = datetime.datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d')
+        dir_ = os.path.join(self._ticker_dir(source, kind, ticker), 'date=' + date)
+        os.makedirs(dir_, exist_ok=True)
+        path = os.path.join(dir_, '{}.parquet'.format(int(timestamp * 1000)))
+
+        # write to a temporary file and rename, so readers never see partial files
+        fd, tmp_path = tempfile.mkstemp(dir=dir_, suffix='.tmp')
+        os.close(fd)
+        import pyarrow.parquet as pq
+
+        try:
+            pq.write_table(SnapshotStore._to_table(df), tmp_path)
+            os.replace(tmp_path, path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+        return path
+
+    def latest(self, source, kind, ticker):
+        """Return (timestamp, path) of the newest snapshot, or None"""
+        ticker_dir = self._ticker_dir(source, kind, ticker)
+        if not os.path.isdir(ticker_dir):
+            return None
+        for date_dir in sorted(os.listdir(ticker_dir), reverse=True):
+            stamps = []
+            for filename in os.listdir(os.path.join(ticker_dir, date_dir)):
+                m = snapshot_regex.match(filename)
+                if m is not None:
+                    stamps.append(int(m.group(1)))
+            if stamps:
+                stamp = max(stamps)
+                return stamp / 1000.0, os.path.join(ticker_dir, date_dir, '{}.parquet'.format(stamp))
+        return None
+
+    def read(self, source, kind, ticker, max_age=None):
+        """Return the newest snapshot younger than max_age seconds, or None"""
+        if max_age is None:
+            max_age = self.max_age
+        found = self.latest(source, kind, ticker)
+        if found is None:
+            return None
+        timestamp, path = found
+        if time.time() - timestamp > max_age:
+            return None
+        import pyarrow.parquet as pq
+
+        # the ticker= and date= directories are not columns, though older pyarrow reads them as partitions
+        return SnapshotStore._from_table(pq.read_table(path, partitioning=None))
+
+    def read_through(self, source, kind, ticker, fetch):
+        """Return a fresh snapshot, or call fetch() and persist its result"""
+        df = self.read(source, kind, ticker)
+        if df is not None:
+            log.debug("Snapshot hit for {} {} {}".format(source, kind, ticker))
+            return df
+        df = fetch()
+        self.write(source, kind, ticker, df)
+        return df
+
+    def _ticker_dir(self, source, kind, ticker):
+        return os.path.join(self.root, source, kind, 'ticker=' + ticker.upper())
+
+    @staticmethod
+    def _to_table(df):
+        # Nested values (lists and dicts) do not have a stable Arrow type
+        # across tickers, so store them as JSON strings
+        json_cols = []
+        for c in df.columns:
+            if df[c].dtype == object:
+                non_null = df[c].dropna()
+                if len(non_null) and isinstance(non_null.iloc[0], (list, dict)):
+                    json_cols.append(c)
+        if json_cols:
+            df = df.copy()
+            for c in json_cols:
+                df[c] = [None if v is None else json.dumps(v) for v in df[c]]
+
+        import pyarrow as pa
+
+        table = pa.Table.from_pandas(df)
+        metadata = dict(table.schema.metadata or {})
+        metadata[JSON_COLUMNS_KEY] = json.dumps(json_cols).encode('utf-8')
+        return table.replace_schema_metadata(metadata)
+
+    @staticmethod
+    def _from_table(table):
+        df = table.to_pandas()
+        metadata = table.schema.metadata or {}
+        for c in json.loads(metadata.get(JSON_COLUMNS_KEY, b'[]').decode('utf-8')):
+            df[c] = [json.loads(v) if isinstance(v, str) else None for v in df[c]]
+        return df
+
+
+class SnapshotClient(object):
+    """Read quotes and chains through a SnapshotStore
+
+    Wraps any client with quoteDF(ticker) and optionsDF(ticker) methods.
+    Every other attribute is passed through to the wrapped client.  A
+    comma separated list of tickers is quoted per ticker: the fresh quotes
+    come from the store and the others from one request, whose rows are
+    stored by their symbol column.
+    """
+    def __init__(self, client, store, source):
+        self.client = client
+        self.store = store
+        self.source = source
+
+    def quoteDF(self, ticker):
+        if ',' not in ticker:
+            return self.store.read_through(self.source, 'quote', ticker, lambda: self.client.quoteDF(ticker))
+
+        import pandas as pd
+
+        tickers = ticker.split(',')
+        frames = {t: self.store.read(self.source, 'quote', t) for t in tickers}
+        missing = [t for t, df in frames.items() if df is None]
+        if missing:
+            fetched = self.client.quoteDF(','.join(missing))
+            for symbol, df in fetched.groupby('symbol', sort=False):
+                df = df.reset_index(drop=True)
+                self.store.write(self.source, 'quote', symbol, df)
+                frames[symbol] = df
+        return pd.concat([frames[t] for t in tickers if frames.get(t) is not None], ignore_index=True)
+
+    def optionsDF(self, ticker, **params):
+        return self.store.read_through(self.source, chain_kind(params), ticker,
+                                       lambda: self.client.optionsDF(ticker, **params))
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+
+#####################################################################
+# Functions
+
+
+def chain_kind(params):
+    """Return the snapshot kind of a chain requested with params, 'chain' for the full chain"""
+    if not params:
+        return 'chain'
+    key = json.dumps(sorted(params.items()), default=str)
+    return 'chain-' + hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]
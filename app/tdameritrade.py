@@ -1,26 +1,44 @@
 #!/usr/bin/env python3
 
-import time
+import datetime
+import inspect
 from os import path
-import requests_cache
-
-import tdameritrade as td
-from tdameritrade import auth as tdauth
 
+from app import normalize
+from app import tdchain
+from app import tokens
+from app import trace
+from app.httpcache import HttpCache
+from app.snapshots import SnapshotClient
 from app.utils import YamlUtils
 
 # SETTINGS
 CONFIG_FILE = path.expanduser('~/.tdameritrade')
-SECONDS_TO_CACHE = 180  # seconds
+
+# option chain columns no screen reads: a python list and a long text per contract
+unused_option_columns = ['optionDeliverablesList', 'description']
+
+# repeated strings stored once per chain
+categorical_option_columns = ['putCall', 'exchangeName', 'expirationType', 'settlementType', 'deliverableNote']
+
+# 'True'/'False' columns
+flag_option_columns = ['inTheMoney', 'mini', 'nonStandard', 'isIndexOption']
 
 
 class TDAmeritrade(object):
     config = None
 
-    def __init__(self):
-        # Create the requests cache to reduce web traffic
-        self.session = requests_cache.CachedSession(cache_name='cache', backend='sqlite', expire_after=SECONDS_TO_CACHE)
+    def __init__(self, snapshots=None):
+        # Optionally read quotes and chains through a snapshot store
+        self.snapshots = snapshots
+
+        # Use the shared requests cache to reduce web traffic.  The tdameritrade
+        # library makes its own requests, so install the cache for those too.
+        cache = HttpCache.singleton()
+        cache.install()
+        self.session = cache.session()
         self.init_config()
+        self.tokens = tokens.TokenManager(self.config, CONFIG_FILE, authenticate=authenticate, refresh=refresh)
         self.save_config()
 
     def init_config(self):
@@ -60,48 +78,96 @@ class TDAmeritrade(object):
                                                 '  From https://developer.tdameritrade.com/user/me/apps:\n: ')
 
     def save_config(self):
-        # Write the configuration back to file
-        if YamlUtils.yaml_dict_to_string(self.config) != YamlUtils.yaml_dict_to_string(
-                YamlUtils.yaml_dict_from_file(CONFIG_FILE)):
-            print(f"Updating configuration file at {CONFIG_FILE}")
-            YamlUtils.yaml_dict_to_file(self.config, CONFIG_FILE)
+        # Write the configuration back to file, if it changed
+        self.tokens.save()
 
     def ensure_auth(self):
         # Handle Authentication/Authorization
-        now = int(time.time())
-        if (self.config['_oauth2']['access_token_timestamp'] == ''):
-            print("New Authentication Required: Empty Auth State")
-            self.config['_oauth2'].update(
-                tdauth.authentication(client_id=self.config['client_id'],
-                                      redirect_uri=self.config['redirect_uri'],
-                                      tdauser=self.config['tda_user'],
-                                      tdapass=self.config['tda_pass']))
-            self.config['_oauth2']['access_token_timestamp'] = now
-            self.config['_oauth2']['refresh_token_timestamp'] = now
-        elif (now > int(self.config['_oauth2']['refresh_token_timestamp']) +
-              int(self.config['_oauth2']['refresh_token_expires_in']) - (24 * 60 * 60)):
-            print("New Authentication Required: Access Token And Refresh Token Expired")
-            self.config['_oauth2'].update(
-                tdauth.authentication(client_id=self.config['client_id'],
-                                      redirect_uri=self.config['redirect_uri'],
-                                      tdauser=self.config['tda_user'],
-                                      tdapass=self.config['tda_pass']))
-            self.config['_oauth2']['access_token_timestamp'] = now
-            self.config['_oauth2']['refresh_token_timestamp'] = now
-        elif (now > int(self.config['_oauth2']['access_token_timestamp']) + int(self.config['_oauth2']['expires_in']) -
-              (5 * 60)):
-            print("Refresh Authentication Required: Access Token Expired, Exchanging Valid Refresh Token")
-            self.config['_oauth2'].update(
-                tdauth.refresh_token(refresh_token=self.config['_oauth2']['refresh_token'],
-                                     client_id=self.config['client_id']))
-            self.config['_oauth2']['access_token_timestamp'] = now
-        else:
-            print("Current Authentication Tokens Valid")
-
-        self.saveConfig()
+        self.tokens.ensure()
 
     def get_client(self):
-        self.ensureAuth()
+        import tdameritrade as td
+
+        with trace.stage('auth'):
+            self.ensure_auth()
+
+        # Return the client, which takes every token refreshed in the background from now on
+        client, set_token = make_client(td, self.config, self.tokens)
+        self.tokens.subscribe(set_token)
+        self.tokens.start()
+
+        # Chains are large, so they are requested and decoded without the library
+        client = tdchain.ChainClient(client, self.session, lambda: self.tokens.access_token)
+        if self.snapshots is not None:
+            client = SnapshotClient(client, self.snapshots, 'tdameritrade')
+        return client
+
+
+def authenticate(config):
+    from tdameritrade import auth as tdauth
+
+    return tdauth.authentication(client_id=config['client_id'],
+                                 redirect_uri=config['redirect_uri'],
+                                 tdauser=config['tda_user'],
+                                 tdapass=config['tda_pass'])
+
+
+def refresh(config):
+    from tdameritrade import auth as tdauth
+
+    # renamed access_token in tdameritrade 0.1.1
+    renew = getattr(tdauth, 'refresh_token', None) or tdauth.access_token
+    return renew(refresh_token=config['_oauth2']['refresh_token'], client_id=config['client_id'])
+
+
+def make_client(td, config, tokens):
+    """Return (client, set_token(access_token)), a td.TDClient sending the access token of tokens
+
+    tdameritrade 0.1.0 takes the access token and sends _token with every
+    request.  0.1.1 and later take the client id and refresh token, and
+    keep the access token in their session, renewing it themselves once it
+    is about to expire; the token of tokens is handed to the session so it
+    never has to.
+    """
+    if 'access_token' in inspect.signature(td.TDClient).parameters:
+        client = td.TDClient(access_token=tokens.access_token, accountIds=None)
+        return client, lambda token: setattr(client, '_token', token)
+
+    client = td.TDClient(client_id=config['client_id'], refresh_token=tokens.oauth['refresh_token'])
+
+    def set_token(token):
+        expires_in = tokens.access_expires_at() - int(tokens.clock())
+        client.session._set_access_token({'access_token': token, 'expires_in': expires_in})
+
+    set_token(tokens.access_token)
+    return client, set_token
+
+
+def chain_params(envelope, today=None):
+    """Return the optionsDF query parameters requesting only the contracts in envelope"""
+    params = {}
+    if envelope.contract_type is not None:
+        params['contractType'] = envelope.contract_type
+    if envelope.strike_range is not None:
+        params['range'] = envelope.strike_range
+    if envelope.strike_count is not None:
+        params['strikeCount'] = envelope.strike_count
+    from_date, to_date = envelope.dates(today or datetime.date.today())
+    if from_date is not None:
+        params['fromDate'] = from_date.isoformat()
+    if to_date is not None:
+        params['toDate'] = to_date.isoformat()
+    return params
+
+
+def normalize_options_dataframe(df, required=(), float32=False):
+    """Return the chain without its unused columns, in compact dtypes
 
-        # Return the client
-        return td.TDClient(access_token=self.config['_oauth2']['access_token'], accountIds=None)
+    Columns in required are kept even if they are otherwise unused, such as
+    the columns read by configured filters.
+    """
+    return normalize.normalize_dataframe(df,
+                                         drop=[c for c in unused_option_columns if c not in required],
+                                         categorical=categorical_option_columns,
+                                         flags=flag_option_columns,
+                                         float32=float32)
@@ -0,0 +1,146 @@
+import itertools
+import json
+import operator
+
+import numpy as np
+import pandas as pd
+
+from app import trace
+
+#####################################################################
+# Settings
+
+CHAIN_URL = 'https://api.tdameritrade.com/v1/marketdata/chains'
+
+# the type of every known contract field, which decides the array it is decoded into
+float_fields = [
+    'bid', 'ask', 'last', 'mark', 'highPrice', 'lowPrice', 'openPrice', 'closePrice', 'netChange', 'volatility',
+    'delta', 'gamma', 'theta', 'vega', 'rho', 'timeValue', 'theoreticalOptionValue', 'theoreticalVolatility',
+    'strikePrice', 'multiplier', 'percentChange', 'markChange', 'markPercentChange'
+]
+int_fields = ['bidSize', 'askSize', 'lastSize', 'totalVolume', 'openInterest', 'daysToExpiration']
+bool_fields = ['mini', 'inTheMoney', 'nonStandard', 'pennyPilot']
+time_fields = ['tradeTimeInLong', 'quoteTimeInLong', 'expirationDate', 'lastTradingDay']
+
+# repeated strings, decoded straight into categoricals
+category_fields = ['putCall', 'exchangeName', 'expirationType', 'settlementType', 'deliverableNote']
+
+# chain fields copied onto every contract, as the tdameritrade library does
+chain_fields = ['interestRate', 'underlyingPrice']
+
+field_dtypes = dict([(f, np.float64) for f in float_fields] + [(f, np.int64) for f in int_fields] +
+                    [(f, np.bool_) for f in bool_fields] + [(f, 'time') for f in time_fields] +
+                    [(f, 'category') for f in category_fields])
+
+
+class ChainClient(object):
+    """Fetch chains as raw JSON and decode them with decode_chain
+
+    Wraps a tdameritrade client: optionsDF(ticker, **params) requests the
+    chain through session with the token returned by access_token(), and
+    every other attribute is passed through to the wrapped client.
+    """
+    def __init__(self, client, session, access_token):
+        self.client = client
+        self.session = session
+        self.access_token = access_token
+
+    def optionsDF(self, ticker, **params):
+        params = dict(params, symbol=ticker)
+        response = self.session.get(CHAIN_URL,
+                                    params=params,
+                                    headers={'Authorization': 'Bearer ' + self.access_token()})
+        response.raise_for_status()
+        with trace.stage('decode'):
+            return decode_chain(response.content)
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+
+#####################################################################
+# Functions
+
+
+def decode_chain(payload):
+    """Return the contracts of a chain response as a DataFrame, like the tdameritrade library's optionsDF
+
+    payload is the response body.  It is parsed with orjson when that is
+    installed, and the fields of every contract are gathered in one pass into
+    a preallocated array, from which each column is converted to its type,
+    instead of building a frame from a list of dicts.  Repeated strings
+    become categoricals and the times datetimes.
+    """
+    chain = _loads(payload)
+    if chain.get('status') != 'SUCCESS':
+        raise ValueError("No chain for {}: status {}".format(chain.get('symbol'), chain.get('status')))
+
+    contracts = [
+        contract for exp_map in (chain.get('callExpDateMap') or {}, chain.get('putExpDateMap') or {})
+        for strikes in exp_map.values() for contract_list in strikes.values() for contract in contract_list
+    ]
+    fields, values = _gather(contracts)
+
+    n = len(contracts)
+    columns = {field: _column(values[:, i], field_dtypes.get(field)) for i, field in enumerate(fields)}
+    for field in chain_fields:
+        if field in chain:
+            columns[field] = np.full(n, chain[field], dtype=np.float64 if _is_number(chain[field]) else object)
+    return pd.DataFrame(columns, index=pd.RangeIndex(n), copy=False)
+
+
+def _loads(payload):
+    try:
+        import orjson
+    except ImportError:
+        return json.loads(payload)
+    return orjson.loads(payload)
+
+
+def _gather(contracts):
+    # Return the fields and a contracts x fields array of their values.
+    # Every contract normally has the fields of the first, and any that does
+    # not sends every contract down the slower path, with None for the fields
+    # a contract is missing.
+    if not contracts:
+        return [], np.empty((0, 0), dtype=object)
+    fields = list(contracts[0])
+    if all(map(len(fields).__eq__, map(len, contracts))):
+        try:
+            return fields, _fill(map(operator.itemgetter(*fields), contracts), len(contracts), fields)
+        except KeyError:
+            pass
+    fields = list(dict.fromkeys(itertools.chain.from_iterable(contracts)))
+    return fields, _fill(([contract.get(f) for f in fields] for contract in contracts), len(contracts), fields)
+
+
+def _fill(rows, n, fields):
+    if len(fields) == 1:
+        rows = ((value, ) for value in rows)
+    values = np.fromiter(itertools.chain.from_iterable(rows), dtype=object, count=n * len(fields))
+    return values.reshape(n, len(fields))
+
+
+def _column(values, dtype):
+    # Convert a column of values to the type of its field, and fall back to
+    # the inference of pandas for unknown fields and values that do not fit,
+    # such as nulls in an int field or "NaN" strings in a float field
+    try:
+        if dtype == 'time':
+            return pd.to_datetime(values.astype(np.int64), unit='ms')
+        if dtype == 'category':
+            return pd.Categorical(values)
+        if dtype is np.bool_:
+            if pd.api.types.infer_dtype(values, skipna=False) == 'boolean':
+                return values.astype(np.bool_)
+        elif dtype is not None:
+            return values.astype(dtype)
+    except (TypeError, ValueError):
+        if dtype == 'time':
+            return pd.to_datetime(pd.to_numeric(values, errors='coerce'), unit='ms')
+        return pd.to_numeric(values, errors='coerce')
+    return pd.Series(values.copy()).infer_objects()
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
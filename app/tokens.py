@@ -0,0 +1,192 @@
+import contextlib
+import copy
+import fcntl
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from app.utils import YamlUtils
+
+log = logging.getLogger(__name__)
+
+#####################################################################
+# Settings
+
+# seconds before the access token expires that it is refreshed
+DEFAULT_REFRESH_MARGIN = 5 * 60
+
+# seconds before the refresh token expires that a new login is required
+LOGIN_MARGIN = 24 * 60 * 60
+
+# seconds before a failed background refresh is tried again
+RETRY_INTERVAL = 30
+
+
+class TokenManager(object):
+    """The OAuth tokens of a config file, kept fresh in memory
+
+    config holds the tokens under '_oauth2', as written by the
+    authentication and refresh responses plus the access_token_timestamp
+    and refresh_token_timestamp of when they were issued.
+    authenticate(config) and refresh(config) return the new '_oauth2'
+    fields.
+
+    After start(), a background thread refreshes the access token
+    refresh_margin seconds before it expires, so requests never wait on
+    auth.  Renewals are serialized across processes by an advisory lock on
+    filename + '.lock': a process that gets the lock re-reads the file first
+    and adopts the tokens another process already renewed, and writes the
+    file by atomic rename.  Callbacks added with subscribe(callback) are
+    called with every new access token.
+    """
+    def __init__(self,
+                 config,
+                 filename,
+                 authenticate,
+                 refresh,
+                 refresh_margin=DEFAULT_REFRESH_MARGIN,
+                 clock=time.time):
+        self.config = config
+        self.filename = filename
+        self.authenticate = authenticate
+        self.refresh = refresh
+        self.refresh_margin = refresh_margin
+        self.clock = clock
+        self.lock = threading.RLock()
+        self.listeners = []
+        self.thread = None
+        self.stopping = threading.Event()
+        # the config as it is on disk, read now rather than copied from config, which may already
+        # hold answers prompted for since it was read, so saving needs no read to tell if anything changed
+        self.saved = self.read()
+
+    @property
+    def oauth(self):
+        return self.config['_oauth2']
+
+    @property
+    def access_token(self):
+        """Return the current access token, renewing it first only if it already expired"""
+        if self.clock() >= self.access_expires_at():
+            self.ensure()
+        return self.oauth['access_token']
+
+    def access_expires_at(self, oauth=None):
+        oauth = oauth or self.oauth
+        if oauth.get('access_token_timestamp') in ('', None):
+            return 0
+        return int(oauth['access_token_timestamp']) + int(oauth['expires_in'])
+
+    def needs(self, oauth=None, now=None):
+        """Return 'authenticate', 'refresh' or None, what the tokens need to stay valid"""
+        oauth = oauth or self.oauth
+        now = self.clock() if now is None else now
+        if oauth.get('access_token_timestamp') in ('', None):
+            return 'authenticate'
+        if now > int(oauth['refresh_token_timestamp']) + int(oauth['refresh_token_expires_in']) - LOGIN_MARGIN:
+            return 'authenticate'
+        if now > self.access_expires_at(oauth) - self.refresh_margin:
+            return 'refresh'
+        return None
+
+    def ensure(self):
+        """Renew the tokens now if they expire within the margins"""
+        with self.lock:
+            if self.needs() is None:
+                return
+            with self.file_lock():
+                # another process may have renewed them while we waited
+                self.adopt(self.read())
+                need = self.needs()
+                if need is None:
+                    log.info("Using the tokens renewed by another process")
+                else:
+                    now = int(self.clock())
+                    if need == 'authenticate':
+                        log.info("New authentication required")
+                        self.oauth.update(self.authenticate(self.config))
+                        self.oauth['refresh_token_timestamp'] = now
+                    else:
+                        log.info("Refreshing the access token")
+                        self.oauth.update(self.refresh(self.config))
+                    self.oauth['access_token_timestamp'] = now
+                    self.write()
+            token = self.oauth['access_token']
+        for callback in self.listeners:
+            callback(token)
+
+    def save(self):
+        """Write the config if it changed since it was read or written"""
+        with self.lock:
+            if self.config == self.saved:
+                return
+            with self.file_lock():
+                self.adopt(self.read())
+                self.write()
+
+    def subscribe(self, callback):
+        self.listeners.append(callback)
+
+    def start(self):
+        """Refresh the tokens in a background thread until stop()"""
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.stopping.clear()
+            self.thread = threading.Thread(target=self._run, name='token-refresh')
+            self.thread.daemon = True
+            self.thread.start()
+
+    def stop(self):
+        with self.lock:
+            thread, self.thread = self.thread, None
+        if thread is not None:
+            self.stopping.set()
+            thread.join()
+
+    def _run(self):
+        delay = 0.0
+        while not self.stopping.wait(delay):
+            try:
+                self.ensure()
+                delay = max(0.0, self.access_expires_at() - self.refresh_margin - self.clock())
+            except Exception as e:
+                log.warning("Failed to refresh the access token error=[{}]".format(e))
+                delay = RETRY_INTERVAL
+
+    def adopt(self, config):
+        """Take the tokens of config if they were issued after ours"""
+        if not config or '_oauth2' not in config:
+            return
+        theirs = config['_oauth2']
+        if self.access_expires_at(theirs) > self.access_expires_at():
+            self.oauth.update(theirs)
+
+    def read(self):
+        try:
+            return YamlUtils.yaml_dict_from_file(self.filename)
+        except OSError:
+            return None
+
+    def write(self):
+        # write to a temporary file only the user can read, then rename, so readers never see partial files
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.filename)), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(YamlUtils.yaml_dict_to_string(self.config))
+            os.replace(tmp_path, self.filename)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self.saved = copy.deepcopy(self.config)
+
+    @contextlib.contextmanager
+    def file_lock(self):
+        with open(self.filename + '.lock', 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
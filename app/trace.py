@@ -0,0 +1,205 @@
+import collections
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+#####################################################################
+# Settings
+
+# the active Tracer, None while tracing is disabled
+_tracer = None
+
+Event = collections.namedtuple('Event', ['name', 'ticker', 'thread', 'start', 'wall', 'cpu', 'rows', 'peak'])
+
+
+class Span(object):
+    """One timed stage, used as a context manager
+
+    Set rows to the number of rows the stage produced.  A span without a
+    ticker takes the ticker of the span it runs in on the same thread.
+    """
+    def __init__(self, tracer, name, ticker=None):
+        self.tracer = tracer
+        self.name = name
+        self.ticker = ticker
+        self.rows = None
+        self.peak = 0
+
+    def __enter__(self):
+        stack = self.tracer.stack()
+        if self.ticker is None and stack:
+            self.ticker = stack[-1].ticker
+        stack.append(self)
+        self.tracer.enter(self)
+        self.cpu = time.thread_time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        wall = time.perf_counter() - self.start
+        cpu = time.thread_time() - self.cpu
+        self.tracer.exit(self)
+        self.tracer.stack().pop()
+        self.tracer.events.append(
+            Event(self.name, self.ticker, threading.current_thread().name, self.start - self.tracer.origin, wall, cpu,
+                  self.rows, self.peak))
+        return False
+
+
+class NullSpan(object):
+    """The span of a disabled tracer, which ignores everything"""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+
+null_span = NullSpan()
+
+
+class Tracer(object):
+    """Wall time, CPU time, rows and peak traced memory of every stage
+
+    The memory peak of a span is the highest memory traced by tracemalloc
+    while it was open, above what was traced when it opened, so spans open
+    at the same time on several threads all see it.
+    """
+    def __init__(self, memory=True):
+        self.memory = memory
+        self.events = []
+        self.origin = time.perf_counter()
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.open = set()
+        self.baselines = {}
+        self.started_tracemalloc = False
+
+    def stack(self):
+        try:
+            return self.local.stack
+        except AttributeError:
+            self.local.stack = []
+            return self.local.stack
+
+    def enter(self, span):
+        if not self.memory:
+            return
+        with self.lock:
+            current = self._fold_peak()
+            self.open.add(span)
+            self.baselines[span] = current
+
+    def exit(self, span):
+        if not self.memory:
+            return
+        with self.lock:
+            self._fold_peak()
+            self.open.discard(span)
+            span.peak = max(0, span.peak - self.baselines.pop(span))
+
+    def _fold_peak(self):
+        # credit the peak since the last reset to every open span, then start a new interval
+        current, peak = tracemalloc.get_traced_memory()
+        for span in self.open:
+            span.peak = max(span.peak, peak)
+        tracemalloc.reset_peak()
+        return current
+
+    def chrome_trace(self):
+        """Return the events in the Chrome trace event format, as loaded by chrome://tracing or Perfetto"""
+        pid = os.getpid()
+        threads = {}
+        trace_events = []
+        for e in sorted(self.events, key=lambda e: e.start):
+            tid = threads.setdefault(e.thread, len(threads))
+            args = {'cpu_ms': round(e.cpu * 1e3, 3)}
+            if e.ticker is not None:
+                args['ticker'] = str(e.ticker)
+            if e.rows is not None:
+                args['rows'] = int(e.rows)
+            if self.memory:
+                args['peak_kb'] = round(e.peak / 1024.0, 1)
+            trace_events.append({
+                'name': e.name if e.ticker is None else '{} {}'.format(e.name, e.ticker),
+                'cat': e.name,
+                'ph': 'X',
+                'ts': round(e.start * 1e6, 1),
+                'dur': round(e.wall * 1e6, 1),
+                'pid': pid,
+                'tid': tid,
+                'args': args,
+            })
+        for thread, tid in threads.items():
+            trace_events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': thread}})
+        return {'traceEvents': trace_events, 'displayTimeUnit': 'ms'}
+
+    def write(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.chrome_trace(), f)
+
+    def summary(self):
+        """Return a human readable table of every stage, summed over its calls"""
+        if not self.events:
+            return ''
+        stages = collections.OrderedDict()
+        for e in sorted(self.events, key=lambda e: e.start):
+            s = stages.setdefault(e.name, {'calls': 0, 'wall': 0.0, 'cpu': 0.0, 'rows': None, 'peak': 0})
+            s['calls'] += 1
+            s['wall'] += e.wall
+            s['cpu'] += e.cpu
+            if e.rows is not None:
+                s['rows'] = (s['rows'] or 0) + int(e.rows)
+            s['peak'] = max(s['peak'], e.peak)
+        lines = ['Stages, summed over their calls:',
+                 '  {:<20} {:>7} {:>10} {:>10} {:>12} {:>10}'.format('stage', 'calls', 'wall s', 'cpu s', 'rows',
+                                                                     'peak MiB')]
+        for name, s in stages.items():
+            rows = '-' if s['rows'] is None else '{:,}'.format(s['rows'])
+            peak = '{:.1f}'.format(s['peak'] / 2.0**20) if self.memory else '-'
+            lines.append('  {:<20} {:>7} {:>10.3f} {:>10.3f} {:>12} {:>10}'.format(
+                name, s['calls'], s['wall'], s['cpu'], rows, peak))
+        return '\n'.join(lines)
+
+
+#####################################################################
+# Functions
+
+
+def stage(name, ticker=None):
+    """Return a span timing the stage name, or a span that does nothing while tracing is disabled
+
+        with trace.stage('fetch', ticker) as span:
+            df = fetch(ticker)
+            span.rows = len(df)
+    """
+    if _tracer is None:
+        return null_span
+    return Span(_tracer, name, ticker)
+
+
+def start(memory=True):
+    """Enable tracing and return the Tracer, with memory tracing through tracemalloc"""
+    global _tracer
+    started = memory and not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    _tracer = Tracer(memory=memory)
+    _tracer.started_tracemalloc = started
+    return _tracer
+
+
+def stop():
+    """Disable tracing and return the Tracer that was active"""
+    global _tracer
+    tracer, _tracer = _tracer, None
+    if tracer is not None and tracer.started_tracemalloc:
+        tracemalloc.stop()
+    return tracer
@@ -1,28 +1,26 @@
 import base64
-import copy
+import collections
 import datetime
 import errno
 import inspect
-import jinja2
 import json
 import logging
-import pythonjsonlogger.jsonlogger as jsonlogger
 import os
 import random
 import re
-import sh
 import shutil
 import string
 import struct
-import structlog
-from structlog._frames import _find_first_app_frame_and_name
 import subprocess
+import sys
 import tempfile
+import threading
 import time
 import uuid
 import yaml
 
-from OpenSSL import crypto
+# jinja2, OpenSSL, sh, structlog and pythonjsonlogger are imported where they are used,
+# so that importing this module stays cheap for the CLI
 
 log = logging.getLogger(__name__)
 
@@ -84,13 +82,28 @@ class FileUtils(object):
 
 
 class JinjaUtils(object):
+    _environment = None
+
+    # the filters and globals known to return the same for the same arguments, so a render that
+    # uses only these may be cached.  random and lipsum are left out, like mkpass, uuid and the rest.
+    deterministic_filters = [
+        'abs', 'attr', 'batch', 'capitalize', 'center', 'count', 'd', 'default', 'dictsort', 'e', 'escape',
+        'filesizeformat', 'first', 'float', 'forceescape', 'format', 'groupby', 'indent', 'int', 'items', 'join',
+        'last', 'length', 'list', 'lower', 'map', 'max', 'min', 'pprint', 'reject', 'rejectattr', 'replace',
+        'reverse', 'round', 'safe', 'select', 'selectattr', 'slice', 'sort', 'string', 'striptags', 'sum', 'title',
+        'tojson', 'trim', 'truncate', 'unique', 'upper', 'urlencode', 'urlize', 'wordcount', 'wordwrap', 'xmlattr',
+        'bool', 'yaml', 'base64encode'
+    ]
+    deterministic_globals = ['range', 'dict', 'cycler', 'joiner', 'namespace', 'raise', 'gen_names']
+
     @staticmethod
-    def render_jinja(dict_, template_str):
-        """Render dict onto jinja template and return the string result"""
-        name = 'jvars'
-        j2env = jinja2.Environment(loader=jinja2.DictLoader({name: template_str}),
-                                   undefined=jinja2.StrictUndefined,
-                                   extensions=["jinja2.ext.do"])
+    def environment():
+        """Return the jinja environment shared by every render, built once"""
+        if JinjaUtils._environment is not None:
+            return JinjaUtils._environment
+        import jinja2
+
+        j2env = jinja2.Environment(undefined=jinja2.StrictUndefined, extensions=["jinja2.ext.do"])
 
         # Add some custom jinja filters
         j2env.filters['bool'] = TypeUtils.str_to_bool
@@ -106,27 +119,23 @@ class JinjaUtils(object):
         j2env.globals['ceph_key'] = JinjaUtils.ceph_key
         j2env.globals['uuid'] = JinjaUtils.uuid
 
-        # Render the template
-        rendered_template = j2env.get_template(name).render(dict_)
-        return rendered_template + "\n"
+        JinjaUtils._environment = j2env
+        return j2env
+
+    @staticmethod
+    def render_jinja(dict_, template_str):
+        """Render dict onto jinja template and return the string result"""
+        return JinjaUtils.environment().from_string(template_str).render(dict_) + "\n"
 
     @staticmethod
     def dict_self_render(dict_):
         """Render dict_ values containing nested jinja variables
 
-        Resolve these values by rendering the jinja dict on itself, as many
-        times as jinja variables contain other jinja variables.  Stop when the
-        rendered output stops changing.
+        Each templated value is rendered once, after the templated values it
+        reads, with the values rendered so far in scope, and every scalar and
+        key comes back a string.  See TemplateGraph.
         """
-        d = copy.deepcopy(dict_)
-        template = None
-        for i in range(0, 10):
-            template = YamlUtils.yaml_dict_to_string_jinja(d)
-            rendered_template = JinjaUtils.render_jinja(d, template)
-            d = YamlUtils.yaml_dict_from_string(rendered_template)
-            if rendered_template.strip() == template.strip():
-                return d
-        raise Exception("Unable to fully render jinja variables")
+        return TemplateGraph(dict_).render()
 
     @staticmethod
     def _jinja_keyword_raise(message):
@@ -162,6 +171,8 @@ class JinjaUtils(object):
     def keygen(keytype='rsa', bits=4096, comment='', passphrase=''):
         ''' generates an ssh key, returns a (priv, pub) tuple. '''
         # We have to manage two files here, so just handle the files manually
+        import sh
+
         tmpdir = tempfile.mkdtemp(prefix='keygen')
         try:
             priv_path = os.path.join(tmpdir, 'key')
@@ -184,7 +195,7 @@ class JinjaUtils(object):
 
     @staticmethod
     def self_signed_cert_gen(
-        key_type=crypto.TYPE_RSA,
+        key_type=None,  # crypto.TYPE_RSA
         key_bits=4096,
         country="US",
         state_province="California",
@@ -196,7 +207,11 @@ class JinjaUtils(object):
         # ^ must look like: ["DNS:*.domain.com", "DNS:domain.ym"]
         validity_days=10 * 365):  # noqa: E129
 
+        from OpenSSL import crypto
+
         # Create a key pair
+        if key_type is None:
+            key_type = crypto.TYPE_RSA
         k = crypto.PKey()
         k.generate_key(key_type, key_bits)
 
@@ -241,6 +256,138 @@ class JinjaUtils(object):
         return str(uuid.uuid4())
 
 
+class TemplateGraph(object):
+    """The jinja templated values of a dict, and the values each one reads
+
+    Every string value or list item containing jinja markup is a template.
+    A template that reads a dotted path, like {{ n1.nn1 }} or {{ options }},
+    depends on every template at, under or above that path.  render()
+    renders each template once, in dependency order, and raises on a cycle
+    naming the paths on it.  Mapping keys are not rendered.
+
+    Like the YAML round trip dict_self_render used to make, the rendered dict
+    holds every scalar and key as the string YAML writes for it: 5 is '5',
+    True is 'true' and None is 'null'.
+    """
+    def __init__(self, dict_):
+        self.templates = collections.OrderedDict()
+        self.dict = self._collect(dict_, ())
+
+        import jinja2.meta
+        import jinja2.nodes as nodes
+
+        # every prefix of a template's path, mapped to the templates under it
+        under = collections.defaultdict(list)
+        for path in self.templates:
+            for i in range(1, len(path) + 1):
+                under[path[:i]].append(path)
+
+        self.names = set()
+        self.filters = set()
+        self.dependencies = collections.OrderedDict()
+        for path, ast in self.templates.items():
+            names = jinja2.meta.find_undeclared_variables(ast)
+            self.names.update(node.name for node in ast.find_all(nodes.Name) if node.ctx == 'load')
+            self.filters.update(node.name for node in ast.find_all(nodes.Filter))
+            deps = []
+            for ref in TemplateGraph._references(ast):
+                if ref[0] not in names:
+                    continue
+                deps.extend(under.get(ref, []))
+                deps.extend(ref[:i] for i in range(1, len(ref)) if ref[:i] in self.templates)
+            self.dependencies[path] = list(dict.fromkeys(deps))
+
+    @property
+    def volatile(self):
+        """True unless every filter and global the templates use is known to be deterministic"""
+        globals_ = JinjaUtils.environment().globals
+        return (any(f not in JinjaUtils.deterministic_filters for f in self.filters)
+                or any(name in globals_ and name not in self.dict and name not in JinjaUtils.deterministic_globals
+                       for name in self.names))
+
+    def order(self):
+        """Return the template paths, each after the templates it depends on"""
+        order = []
+        state = {}  # path -> 'visiting' or 'done'
+
+        def visit(path, stack):
+            if state.get(path) == 'done':
+                return
+            if state.get(path) == 'visiting':
+                cycle = [TemplateGraph.dotted(p) for p in stack[stack.index(path):] + [path]]
+                raise Exception("Cyclic jinja variables: {}".format(' -> '.join(cycle)))
+            state[path] = 'visiting'
+            stack.append(path)
+            for dep in self.dependencies[path]:
+                visit(dep, stack)
+            stack.pop()
+            state[path] = 'done'
+            order.append(path)
+
+        for path in self.templates:
+            visit(path, [])
+        return order
+
+    def render(self):
+        """Return a copy of the dict with every template rendered"""
+        j2env = JinjaUtils.environment()
+        for path in self.order():
+            parent = self.dict
+            for key in path[:-1]:
+                parent = parent[key]
+            parent[path[-1]] = j2env.from_string(self.templates[path]).render(self.dict)
+        return TemplateGraph.stringify(self.dict)
+
+    def _collect(self, value, path):
+        # copy the containers, noting the templates on the way
+        if isinstance(value, dict):
+            return {k: self._collect(v, path + (k, )) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self._collect(v, path + (i, )) for i, v in enumerate(value)]
+        if isinstance(value, str) and ('{{' in value or '{%' in value):
+            self.templates[path] = JinjaUtils.environment().parse(value)
+        return value
+
+    @staticmethod
+    def stringify(value, representer=None):
+        """Return value with every scalar and mapping key as the string YAML writes for it"""
+        representer = representer or yaml.representer.SafeRepresenter()
+        if isinstance(value, dict):
+            return {
+                TemplateGraph.stringify(k, representer): TemplateGraph.stringify(v, representer)
+                for k, v in value.items()
+            }
+        if isinstance(value, list):
+            return [TemplateGraph.stringify(v, representer) for v in value]
+        if isinstance(value, str):
+            return value
+        return representer.represent_data(value).value
+
+    @staticmethod
+    def dotted(path):
+        return '.'.join(str(key) for key in path)
+
+    @staticmethod
+    def _references(node):
+        """Yield the paths read by a jinja node, as tuples of keys"""
+        import jinja2.nodes as nodes
+
+        chain = []
+        inner = node
+        while isinstance(inner, nodes.Getattr) or (isinstance(inner, nodes.Getitem)
+                                                   and isinstance(inner.arg, nodes.Const)):
+            chain.append(inner.attr if isinstance(inner, nodes.Getattr) else inner.arg.value)
+            inner = inner.node
+        if isinstance(inner, nodes.Name) and inner.ctx == 'load':
+            yield (inner.name, ) + tuple(reversed(chain))
+        elif chain:
+            # an attribute of a call or of a computed item
+            yield from TemplateGraph._references(inner)
+        else:
+            for child in node.iter_child_nodes():
+                yield from TemplateGraph._references(child)
+
+
 class StringUtils(object):
     @staticmethod
     def pad_str(pad, num, s):
@@ -352,6 +499,9 @@ class LogUtils(object):
       log = LogUtils.get_logger()
       log.info("hi", a='b')
 
+      # in hot loops, filtered on level up front and written by a background thread
+      log = LogUtils.get_fast_logger("INFO")
+
       LEVELS:
         critical
         error
@@ -360,21 +510,28 @@ class LogUtils(object):
         debug
         notset
     """
-    class CustomJsonFormatter(jsonlogger.JsonFormatter):
-        def add_fields(self, log_record, record, message_dict):
-            super(LogUtils.CustomJsonFormatter, self).add_fields(log_record, record, message_dict)
-            if not log_record.get('timestamp'):
-                now = datetime.datetime.now().strftime('%Y-%m-%dT%H:%M:%S.%fZ')
-                log_record['timestamp'] = now
-            log_record['level'] = record.levelname
-            keep_keys = ["timestamp", "level", "loc", "message"]
-            params = {}
-            param_keys = [key for key in log_record if (key not in keep_keys)]
-            for key in sorted(param_keys):
-                params[key] = log_record[key]
-                del log_record[key]
-            if (params):
-                log_record.update(params)
+    @staticmethod
+    def json_formatter(fmt):
+        """Return a JSON formatter that puts timestamp, level and loc first"""
+        import pythonjsonlogger.jsonlogger as jsonlogger
+
+        class CustomJsonFormatter(jsonlogger.JsonFormatter):
+            def add_fields(self, log_record, record, message_dict):
+                super(CustomJsonFormatter, self).add_fields(log_record, record, message_dict)
+                if not log_record.get('timestamp'):
+                    now = datetime.datetime.now().strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+                    log_record['timestamp'] = now
+                log_record['level'] = record.levelname
+                keep_keys = ["timestamp", "level", "loc", "message"]
+                params = {}
+                param_keys = [key for key in log_record if (key not in keep_keys)]
+                for key in sorted(param_keys):
+                    params[key] = log_record[key]
+                    del log_record[key]
+                if (params):
+                    log_record.update(params)
+
+        return CustomJsonFormatter(fmt)
 
     @staticmethod
     def __add_code_location_processor(logger, _, event_dict):
@@ -382,6 +539,8 @@ class LogUtils(object):
         #   https://stackoverflow.com/questions/54872447/how-to-add-code-line-number-using-structlog
         # If by any chance the record already contains a `modline` key,
         # (very rare) move that into a 'modline_original' key
+        from structlog._frames import _find_first_app_frame_and_name
+
         if 'modline' in event_dict:
             event_dict['modline_original'] = event_dict['modline']
         f, name = _find_first_app_frame_and_name(additional_ignores=[
@@ -406,6 +565,8 @@ class LogUtils(object):
 
     @staticmethod
     def get_logger(log_level="DEBUG"):
+        import structlog
+
         structlog.configure(
             processors=[
                 structlog.stdlib.filter_by_level,
@@ -424,7 +585,7 @@ class LogUtils(object):
             cache_logger_on_first_use=True,
         )
 
-        json_formatter = LogUtils.CustomJsonFormatter('(timestamp) (level) (loc) (message)')
+        json_formatter = LogUtils.json_formatter('(timestamp) (level) (loc) (message)')
 
         console_handler = logging.StreamHandler()
         console_handler.setFormatter(json_formatter)
@@ -433,3 +594,110 @@ class LogUtils(object):
         logger = structlog.get_logger()
         logger.addHandler(console_handler)
         return logger
+
+    # per code object, the file name it logs as, or '' for frames of structlog, logging and this module
+    _locations = {}
+
+    # the thread writing the records of get_fast_logger, started by the first call
+    _listener = None
+    _fast_lock = threading.Lock()
+    _stop_registered = False
+
+    @staticmethod
+    def _add_cached_code_location(logger, _, event_dict):
+        # Like __add_code_location_processor, but a frame is only looked into
+        # the first time its code object logs
+        frame = sys._getframe(1)
+        while frame is not None:
+            code = frame.f_code
+            name = LogUtils._locations.get(code)
+            if name is None:
+                module = frame.f_globals.get('__name__') or ''
+                ignored = module == __name__ or module.split('.')[0] in ('structlog', 'logging')
+                name = '' if ignored else os.path.basename(code.co_filename)
+                LogUtils._locations[code] = name
+            if name:
+                event_dict['loc'] = '{}:{}'.format(name, frame.f_lineno)
+                break
+            frame = frame.f_back
+        return event_dict
+
+    class FastJsonFormatter(logging.Formatter):
+        """Format a record as JSON: timestamp, level, loc and message, then the other fields as given"""
+        # the attributes of every LogRecord, anything else was passed as a field
+        standard = frozenset(logging.LogRecord('', 0, '', 0, '', (), None).__dict__) | {'message', 'asctime'}
+
+        def format(self, record):
+            fields = {k: v for k, v in record.__dict__.items() if k not in self.standard}
+            log_record = {
+                'timestamp': datetime.datetime.fromtimestamp(record.created).strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
+                'level': record.levelname,
+            }
+            if 'loc' in fields:
+                log_record['loc'] = fields.pop('loc')
+            log_record['message'] = record.getMessage()
+            log_record.update(fields)
+            if record.exc_info:
+                log_record['exc_info'] = self.formatException(record.exc_info)
+            return json.dumps(log_record, default=str)
+
+    class QueueHandler(logging.Handler):
+        """Put records on a queue as they are, formatting is left to the listener"""
+        def __init__(self, queue):
+            super().__init__()
+            self.queue = queue
+
+        def emit(self, record):
+            self.queue.put_nowait(record)
+
+    @staticmethod
+    def get_fast_logger(log_level="INFO", stream=None):
+        """Return a structlog logger cheap enough for hot loops
+
+        Calls below log_level return before any processor runs, code locations
+        are cached per code object, and records are formatted and written to
+        stream (stderr by default) by a background thread, so the caller never
+        waits on I/O.  The thread and its stream are set up by the first call,
+        and structlog's global configuration is left alone.
+        stop_fast_logger() flushes the records still queued.
+        """
+        import atexit
+        import logging.handlers
+        import queue
+        import structlog
+
+        # one stdlib logger for every caller, the location comes from the processor
+        stdlib_logger = logging.getLogger(__name__ + '.fast')
+        with LogUtils._fast_lock:
+            if LogUtils._listener is None:
+                records = queue.SimpleQueue()
+                console_handler = logging.StreamHandler(stream if stream is not None else sys.stderr)
+                console_handler.setFormatter(LogUtils.FastJsonFormatter())
+                LogUtils._listener = logging.handlers.QueueListener(records, console_handler)
+                LogUtils._listener.start()
+
+                # the level is checked by each bound logger, so this one passes everything
+                stdlib_logger.handlers = [LogUtils.QueueHandler(records)]
+                stdlib_logger.setLevel(logging.DEBUG)
+                stdlib_logger.propagate = False
+            if not LogUtils._stop_registered:
+                atexit.register(LogUtils.stop_fast_logger)
+                LogUtils._stop_registered = True
+
+        # bound right away, a lazy proxy would bind again on every call
+        return structlog.wrap_logger(stdlib_logger,
+                                     processors=[
+                                         LogUtils._add_cached_code_location,
+                                         structlog.stdlib.render_to_log_kwargs,
+                                     ],
+                                     context_class=dict,
+                                     wrapper_class=structlog.make_filtering_bound_logger(
+                                         logging.getLevelName(log_level.upper()))).bind()
+
+    @staticmethod
+    def stop_fast_logger():
+        """Write the records still queued by get_fast_logger and stop its thread"""
+        with LogUtils._fast_lock:
+            if LogUtils._listener is not None:
+                LogUtils._listener.stop()
+                LogUtils._listener = None
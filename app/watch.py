@@ -0,0 +1,133 @@
+import collections
+import hashlib
+import itertools
+import logging
+import time
+
+import pandas as pd
+
+from app import pipeline
+
+log = logging.getLogger(__name__)
+
+#####################################################################
+# Settings
+
+# seconds between the start of each fetch cycle
+DEFAULT_INTERVAL = 60
+
+# the longest a failing ticker waits before it is fetched again
+MAX_BACKOFF = 15 * 60
+
+
+class Cycle(collections.namedtuple('Cycle', ['number', 'tickers', 'changed', 'written', 'pipeline', 'seconds'])):
+    """What one fetch cycle of a Watcher found and did"""
+    def report(self):
+        return 'Cycle {}: {} of {} tickers changed{} in {:.2f}s'.format(
+            self.number, len(self.changed), len(self.tickers), ', output rewritten' if self.written else '',
+            self.seconds)
+
+
+class Watcher(object):
+    """Re-screen only the tickers whose chains changed since the last cycle
+
+    Each cycle fetches every ticker through a Pipeline and hashes the fetched
+    chain.  A ticker with the same hash as in the last cycle keeps its
+    previous rows without being processed again.  Only when some ticker
+    changed is write(rows) called with the rows of every ticker, in ticker
+    order.  A ticker that fails keeps the rows of its last good chain.
+
+    A ticker fetched less than max_age seconds ago is not fetched again, and
+    write may be None when the caller reads the rows itself.  With a
+    backoff, a ticker that failed is not fetched again for backoff seconds,
+    doubled on every further failure up to MAX_BACKOFF.
+    """
+    def __init__(self,
+                 fetch,
+                 process,
+                 write,
+                 workers=pipeline.DEFAULT_WORKERS,
+                 sleep=time.sleep,
+                 max_age=0,
+                 backoff=0,
+                 clock=time.monotonic):
+        self.fetch = fetch
+        self.process = process
+        self.write = write
+        self.workers = workers
+        self.sleep = sleep
+        self.max_age = max_age
+        self.backoff = backoff
+        self.clock = clock
+        self.hashes = {}
+        self.rows = {}
+        self.fetched = {}
+        # ticker: (failures in a row, when it is fetched again)
+        self.failed = {}
+        self.cycles = 0
+
+    def cycle(self, tickers):
+        """Fetch every stale ticker once, process the changed ones, and return the Cycle"""
+        tickers = list(dict.fromkeys(tickers))  # drop duplicates, keep order
+        start = time.perf_counter()
+        now = self.clock()
+        stale = [
+            t for t in tickers if (t not in self.fetched or now - self.fetched[t] >= self.max_age) and
+            (t not in self.failed or now >= self.failed[t][1])
+        ]
+        changed = []
+
+        def compute(ticker, data):
+            digest = content_hash(data)
+            if self.hashes.get(ticker) != digest:
+                self.rows[ticker] = self.process(ticker, data)
+                self.hashes[ticker] = digest
+                changed.append(ticker)
+            self.fetched[ticker] = now
+
+        p = pipeline.Pipeline(self.fetch, compute, workers=self.workers)
+        p.run(stale)
+        for ticker in stale:
+            if ticker not in p.failures:
+                self.failed.pop(ticker, None)
+            elif self.backoff:
+                failures = self.failed.get(ticker, (0, now))[0] + 1
+                self.failed[ticker] = (failures, now + min(MAX_BACKOFF, self.backoff * 2**(failures - 1)))
+        written = bool(changed) and self.write is not None
+        if written:
+            self.write([self.rows[ticker] for ticker in tickers if ticker in self.rows])
+
+        self.cycles += 1
+        return Cycle(self.cycles, tickers, changed, written, p, time.perf_counter() - start)
+
+    def forget(self, ticker):
+        """Drop everything kept for ticker"""
+        for kept in (self.hashes, self.rows, self.fetched, self.failed):
+            kept.pop(ticker, None)
+
+    def watch(self, tickers, interval=DEFAULT_INTERVAL, cycles=None):
+        """Yield a Cycle every interval seconds, until cycles have run or forever"""
+        cycle = None
+        for _ in itertools.count() if cycles is None else range(cycles):
+            if cycle is not None:
+                self.sleep(max(0.0, interval - cycle.seconds))
+            cycle = self.cycle(tickers)
+            yield cycle
+
+
+#####################################################################
+# Functions
+
+
+def content_hash(data):
+    """Return a digest of a fetched frame, or of a tuple of frames
+
+    The digest covers the column names, the index and every value, so it
+    changes whenever anything that could change the screen does.
+    """
+    frames = data if isinstance(data, tuple) else (data, )
+    h = hashlib.blake2b(digest_size=16)
+    for df in frames:
+        h.update('\0'.join(str(c) for c in df.columns).encode())
+        h.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    return h.hexdigest()
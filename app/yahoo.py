@@ -0,0 +1,85 @@
+import datetime
+
+from app import normalize
+from app import trace
+
+# SETTINGS
+
+# repeated strings stored once per chain
+categorical_columns = ['Root', 'Underlying']
+
+# 'True'/'False' columns
+flag_columns = ['IsNonstandard']
+
+
+class YahooClient(object):
+    """Fetch option chains from yahoo through the given requests session"""
+    def __init__(self, session=None):
+        self.session = session
+
+    def optionsDF(self, ticker, call=True, put=True, from_date=None, to_date=None):
+        """Return the chain of ticker, limited to the given contract types and range of expiration dates"""
+        import pandas as pd
+        from pandas_datareader.data import Options
+
+        option = Options(ticker, 'yahoo', session=self.session)
+
+        # fetch all data
+        if from_date is None and to_date is None:
+            return option.get_all_data(call=call, put=put)
+
+        # or one request per expiry in range, skipping the others
+        dates = [
+            d for d in option.expiry_dates
+            if (from_date is None or d >= from_date) and (to_date is None or d <= to_date)
+        ]
+        if not dates:
+            raise ValueError("No expiries of {} from {} to {}".format(ticker, from_date, to_date))
+        frames = []
+        for date in dates:
+            if call:
+                frames.append(option.get_call_data(expiry=date))
+            if put:
+                frames.append(option.get_put_data(expiry=date))
+        return pd.concat(frames).sort_index()
+
+
+def chain_params(envelope, today=None):
+    """Return the optionsDF arguments requesting only the contracts in envelope"""
+    params = {}
+    if envelope.contract_type is not None:
+        params['call'] = envelope.contract_type == 'CALL'
+        params['put'] = envelope.contract_type == 'PUT'
+    from_date, to_date = envelope.dates(today or datetime.date.today())
+    if from_date is not None:
+        params['from_date'] = from_date
+    if to_date is not None:
+        params['to_date'] = to_date
+    return params
+
+
+def fetch_options(client, ticker, columns=None, float32=False, envelope=None):
+    """Fetch the chain of ticker through client, normalized as it arrives
+
+    With an envelope, only its contract types and expiries are fetched.
+    """
+    params = chain_params(envelope) if envelope is not None else {}
+    with trace.stage('options') as span:
+        df = client.optionsDF(ticker, **params)
+        span.rows = len(df)
+    with trace.stage('normalize'):
+        return normalize_options_dataframe(df, columns=columns, float32=float32)
+
+
+def normalize_options_dataframe(df, columns=None, float32=False):
+    """Return the chain with only the given columns, in compact dtypes
+
+    The Strike, Expiry, Type and Symbol index levels are always kept.  The
+    per-contract JSON dicts and the quote times are dropped unless listed
+    in columns.
+    """
+    return normalize.normalize_dataframe(df,
+                                         keep=columns,
+                                         categorical=categorical_columns,
+                                         flags=flag_columns,
+                                         float32=float32)
@@ -0,0 +1,381 @@
+"""Microbenchmarks for the screening kernels
+
+Times each stage on synthetic chains of increasing size, measures the
+footprint of the fetched chains before and after normalization, and writes
+the throughput and peak memory of every run to a JSON results file:
+
+  python -m benchmarks.run --sizes 1000,100000,1000000 --output bench_results.json
+
+Recorded TD Ameritrade chain responses given with --payload are decoded by
+both the tdameritrade library path and app.tdchain:
+
+  python -m benchmarks.run --only td_chain --payload spy_chain.json
+
+End to end scenarios follow the kernels: screens of a growing watchlist,
+overlapped fetches, snapshot reads, disabled trace stages, requests to a
+warm server and the startup of the command line, each timed per call.
+"""
+import contextlib
+import datetime
+import functools
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.request
+
+import click
+import numpy as np
+import pandas as pd
+
+from app import greeks
+from app import longoptions
+from app import normalize
+from app import pipeline
+from app import server
+from app import snapshots
+from app import tdameritrade
+from app import tdchain
+from app import trace
+from app import yahoo
+from app.commands import cmd_coveredcalls
+from app.commands import cmd_serve
+from app.datareader import Datareader
+from app.utils import LogUtils
+
+from benchmarks import synthetic
+
+#####################################################################
+# Settings
+
+DEFAULT_SIZES = '1000,100000,1000000'
+DEFAULT_REPEAT = 3
+DEFAULT_OUTPUT = 'bench_results.json'
+
+# chain responses take about 1.2 KB of JSON per contract, so larger sizes skip the decoding benchmarks
+MAX_PAYLOAD_CONTRACTS = 100000
+
+# watchlists screened end to end: the time and peak memory per ticker should stay flat as they grow
+SCREEN_TICKERS = (10, 40)
+
+# fetches through the pipeline, each waiting as long as a request; serially they would take 5 seconds
+PIPELINE_FETCHES = 100
+PIPELINE_WORKERS = 20
+PIPELINE_FETCH_SECONDS = 0.05
+
+SERVER_REQUESTS = 20
+TRACE_STAGES = 10000
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def benchmarks(size, tmp_dir):
+    """Return (name, setup, func) for every benchmark at the given size
+
+    setup() builds the inputs outside the timed region, and func(inputs)
+    is the code under test.
+    """
+    csv = os.path.join(tmp_dir, 'out.csv')
+    stock = synthetic.td_quote()
+    td = synthetic.td_chain(size)
+    yahoo_df = synthetic.yahoo_chain(size)
+
+    covered_calls = cmd_coveredcalls.covered_calls_process_dataframe(stock, td)
+    long_puts = longoptions.long_puts.process_dataframe(yahoo_df.copy())
+    long_calls = longoptions.long_calls.process_dataframe(yahoo_df.copy())
+
+    # price the yahoo chain at a flat volatility so the solver has a known answer
+    is_call = long_calls['Type'].to_numpy() == 'call'
+    spot, strike = long_calls['Underlying_Price'].to_numpy(), long_calls['Strike'].to_numpy()
+    years = np.maximum(long_calls['xDaysUntilExpiration'].to_numpy(), 1) / 365.0
+    price = greeks.black_scholes_price(is_call, spot, strike, years, 0.04, 0.0, 0.3)
+    chain = (price, is_call, spot, strike, years, 0.04)
+
+    decoders = []
+    if size <= MAX_PAYLOAD_CONTRACTS:
+        payload = synthetic.td_payload(size)
+        decoders = [(name, lambda: payload, decode) for name, decode in chain_decoders()]
+
+    return [
+        ('covered_calls_process_dataframe', lambda: (stock, td),
+         lambda args: cmd_coveredcalls.covered_calls_process_dataframe(*args)),
+        ('covered_calls_csv_out', lambda: covered_calls,
+         lambda df: cmd_coveredcalls.covered_calls_csv_out(csv, df)),
+        ('td_normalize', lambda: td, tdameritrade.normalize_options_dataframe),
+        ('yahoo_normalize', lambda: yahoo_df,
+         lambda df: yahoo.normalize_options_dataframe(df, columns=longoptions.long_puts.columns())),
+        ('long_puts_process_dataframe', yahoo_df.copy, longoptions.long_puts.process_dataframe),
+        ('long_puts_csv_out', lambda: long_puts, lambda df: longoptions.long_puts.csv_out(csv, df)),
+        ('long_calls_process_dataframe', yahoo_df.copy, longoptions.long_calls.process_dataframe),
+        ('long_calls_csv_out', lambda: long_calls, lambda df: longoptions.long_calls.csv_out(csv, df)),
+        ('implied_volatility', lambda: chain, lambda args: greeks.implied_volatility(*args)),
+        ('schwab_options_dataframe', lambda: synthetic.schwab_payload(size),
+         Datareader.schwab_options_dataframe_from_dict),
+    ] + decoders
+
+
+def chain_decoders():
+    """Return (name, decode(payload)) of every way to turn a chain response into a DataFrame"""
+    return [
+        ('td_chain_library', library_options_dataframe),
+        ('td_chain_decode', tdchain.decode_chain),
+    ]
+
+
+def library_options_dataframe(payload):
+    """The tdameritrade library's optionsDF, from the response body on"""
+    dat = json.loads(payload)
+    ret = []
+    for date in dat['callExpDateMap']:
+        for strike in dat['callExpDateMap'][date]:
+            ret.extend(dat['callExpDateMap'][date][strike])
+    for date in dat['putExpDateMap']:
+        for strike in dat['putExpDateMap'][date]:
+            ret.extend(dat['putExpDateMap'][date][strike])
+
+    df = pd.DataFrame(ret)
+    for col in ('tradeTimeInLong', 'quoteTimeInLong', 'expirationDate', 'lastTradingDay'):
+        df[col] = pd.to_datetime(df[col], unit='ms')
+    for col in ('interestRate', 'underlyingPrice'):
+        if col in dat:
+            df[col] = dat[col]
+    return df
+
+
+def scenarios(tmp_dir, stack):
+    """Return (name, calls, setup, func) for every end to end scenario
+
+    func(setup()) makes calls of the operation named, and anything kept
+    running between runs, such as the server, is closed with stack.
+    """
+    cli_home = os.path.join(repo_dir, 'tests', 'fixtures')
+    return [
+        ('covered_calls_screen_{}_tickers'.format(n), n, functools.partial(td_client, tickers(n)),
+         functools.partial(covered_calls_screen, tickers(n))) for n in SCREEN_TICKERS
+    ] + [
+        ('pipeline_fetches', PIPELINE_FETCHES, lambda: tickers(PIPELINE_FETCHES), pipeline_run),
+        ('snapshot_read', 1, functools.partial(snapshot_client, tmp_dir), snapshot_read),
+        ('trace_disabled_stage', TRACE_STAGES, lambda: TRACE_STAGES, disabled_stages),
+        ('server_cached_request', SERVER_REQUESTS, served(stack, tickers(3)), server_requests),
+        ('cli_help', 1, lambda: ['--help'], functools.partial(cli, tmp_dir)),
+        ('cli_config_print', 1, lambda: ['--home', cli_home, 'config', 'print'], functools.partial(cli, tmp_dir)),
+    ]
+
+
+def tickers(n):
+    return ['T{}'.format(i) for i in range(n)]
+
+
+def td_client(symbols):
+    """Return a synthetic.TDClient holding the chains of symbols"""
+    client = synthetic.TDClient()
+    for symbol in symbols:
+        client.optionsDF(symbol)
+    return client
+
+
+def covered_calls_screen(symbols, client):
+    cmd_coveredcalls.covered_calls_screen(client, symbols, workers=1)
+
+
+def pipeline_run(symbols):
+    def fetch(ticker):
+        time.sleep(PIPELINE_FETCH_SECONDS)
+        return ticker
+
+    pipeline.Pipeline(fetch, lambda ticker, data: data, workers=PIPELINE_WORKERS).run(symbols)
+
+
+def snapshot_client(tmp_dir):
+    """Return a snapshots.SnapshotClient which has stored the quote and chain of SPY"""
+    store = snapshots.SnapshotStore(os.path.join(tmp_dir, 'snapshots'))
+    client = snapshots.SnapshotClient(synthetic.TDClient(), store, 'tdameritrade')
+    snapshot_read(client)
+    return client
+
+
+def snapshot_read(client):
+    client.quoteDF('SPY')
+    client.optionsDF('SPY')
+
+
+def disabled_stages(n):
+    for _ in range(n):
+        with trace.stage('fetch') as span:
+            span.rows = 1
+
+
+def served(stack, symbols):
+    """Return setup(), which starts a server screening the covered calls of symbols once and returns its URL"""
+    url = []
+
+    def setup():
+        if not url:
+            screens = cmd_serve.serve_screens({'tdameritrade': td_client(symbols)}, {'covered_calls': symbols})
+            httpd = server.ScreenServer(('127.0.0.1', 0), screens, access_log=LogUtils.get_fast_logger('WARNING'))
+            threading.Thread(target=httpd.serve_forever, daemon=True).start()
+            stack.callback(httpd.server_close)
+            stack.callback(httpd.shutdown)
+            url.append('http://127.0.0.1:{}/screen/coveredcalls'.format(httpd.server_address[1]))
+            server_requests(url[0], 1)
+        return url[0]
+
+    return setup
+
+
+def server_requests(url, n=SERVER_REQUESTS):
+    for _ in range(n):
+        with urllib.request.urlopen(url) as r:
+            r.read()
+
+
+def cli(cache_dir, args):
+    """Run the command line in a fresh interpreter, as from the shell"""
+    env = dict(os.environ, XDG_CACHE_HOME=cache_dir)
+    subprocess.run([sys.executable, '-c', 'from app.cli import app; app()'] + args,
+                   check=True,
+                   capture_output=True,
+                   cwd=repo_dir,
+                   env=env)
+
+
+def footprints(size):
+    """Return (name, chain, normalize(df, float32)) for every fetched chain at the given size"""
+    return [
+        ('td_chain', synthetic.td_chain(size),
+         lambda df, float32: tdameritrade.normalize_options_dataframe(df, float32=float32)),
+        ('yahoo_chain', synthetic.yahoo_chain(size), lambda df, float32: yahoo.normalize_options_dataframe(
+            df, columns=longoptions.long_puts.columns(), float32=float32)),
+    ]
+
+
+def memory_footprint(size, chain, normalize_chain):
+    """Return the bytes per million contracts of chain as fetched, normalized and normalized to float32"""
+    scale = 1e6 / size
+    return {
+        'raw': int(normalize.memory_usage(chain) * scale),
+        'normalized': int(normalize.memory_usage(normalize_chain(chain, False)) * scale),
+        'float32': int(normalize.memory_usage(normalize_chain(chain, True)) * scale),
+    }
+
+
+def measure(setup, func, repeat):
+    """Return (best seconds, peak traced bytes) of func over repeat runs"""
+    times = []
+    for _ in range(repeat):
+        args = setup()
+        gc.collect()
+        start = time.perf_counter()
+        func(args)
+        times.append(time.perf_counter() - start)
+        del args
+
+    # tracemalloc slows allocation down, so peak memory gets a run of its own
+    args = setup()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func(args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return min(times), peak
+
+
+def environment():
+    return {
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+    }
+
+
+@click.command()
+@click.option('--sizes', default=DEFAULT_SIZES, show_default=True, help='Comma separated contracts per chain')
+@click.option('--repeat', default=DEFAULT_REPEAT, show_default=True, type=int, help='Timed runs per benchmark')
+@click.option('--only', default=None, help='Run only benchmarks whose name contains this string')
+@click.option('--output', default=DEFAULT_OUTPUT, show_default=True, help='JSON results file')
+@click.option('--payload',
+              'payloads',
+              multiple=True,
+              type=click.Path(exists=True, dir_okay=False),
+              help='Recorded chain response to decode, may be repeated')
+def main(sizes, repeat, only, output, payloads):
+    results = []
+    memory = []
+    timings = []
+    for filename in payloads:
+        with open(filename, 'rb') as f:
+            payload = f.read()
+        contracts = len(tdchain.decode_chain(payload))
+        for name, decode in chain_decoders():
+            if only is not None and only not in name:
+                continue
+            seconds, peak = measure(lambda: payload, decode, repeat)
+            results.append({
+                'name': name,
+                'payload': os.path.basename(filename),
+                'contracts': contracts,
+                'seconds': seconds,
+                'contracts_per_second': contracts / seconds,
+                'peak_memory_bytes': peak,
+            })
+            click.echo('{:<34} {:>9,} contracts {:>10.4f}s {:>14,.0f}/s {:>10.1f} MiB peak  {}'.format(
+                name, contracts, seconds, contracts / seconds, peak / 2.0**20, os.path.basename(filename)))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for size in [int(s) for s in sizes.split(',')]:
+            for name, setup, func in benchmarks(size, tmp_dir):
+                if only is not None and only not in name:
+                    continue
+                seconds, peak = measure(setup, func, repeat)
+                results.append({
+                    'name': name,
+                    'contracts': size,
+                    'seconds': seconds,
+                    'contracts_per_second': size / seconds,
+                    'peak_memory_bytes': peak,
+                })
+                click.echo('{:<34} {:>9,} contracts {:>10.4f}s {:>14,.0f}/s {:>10.1f} MiB peak'.format(
+                    name, size, seconds, size / seconds, peak / 2.0**20))
+
+            for name, chain, normalize_chain in footprints(size):
+                if only is not None and only not in name:
+                    continue
+                footprint = memory_footprint(size, chain, normalize_chain)
+                memory.append({'name': name, 'contracts': size, 'bytes_per_million_contracts': footprint})
+                click.echo('{:<34} {:>9,} contracts {:>10.1f} MiB raw {:>8.1f} MiB normalized {:>8.1f} MiB float32'
+                           ' per 1M contracts'.format(name, size, *[footprint[k] / 2.0**20 for k in footprint]))
+
+        with contextlib.ExitStack() as stack:
+            for name, calls, setup, func in scenarios(tmp_dir, stack):
+                if only is not None and only not in name:
+                    continue
+                seconds, peak = measure(setup, func, repeat)
+                timings.append({
+                    'name': name,
+                    'calls': calls,
+                    'seconds': seconds,
+                    'seconds_per_call': seconds / calls,
+                    'peak_memory_bytes': peak,
+                })
+                click.echo('{:<34} {:>9,} calls {:>14.4f}s {:>12.4f} ms/call {:>10.1f} MiB peak'.format(
+                    name, calls, seconds, 1000 * seconds / calls, peak / 2.0**20))
+
+    with open(output, 'w') as f:
+        json.dump({'environment': environment(), 'results': results, 'memory': memory, 'scenarios': timings},
+                  f,
+                  indent=2)
+    click.echo('Wrote {}'.format(output))
+
+
+if __name__ == '__main__':
+    main()
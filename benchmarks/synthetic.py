@@ -0,0 +1,275 @@
+"""Synthetic option chains shaped like the TD Ameritrade, Yahoo and Schwab feeds
+
+Every generator is seeded, so a given size always produces the same chain.
+"""
+import json
+
+import numpy as np
+import pandas as pd
+
+#####################################################################
+# Settings
+
+# contracts per strike and expiration: one call and one put
+CONTRACTS_PER_STRIKE = 2
+
+# weekly expirations, as listed for liquid underlyings
+NUM_EXPIRATIONS = 20
+
+quote_date = pd.Timestamp('2020-01-14 16:00:00')
+
+
+def _grid(contracts, price, seed):
+    # Lay out contracts as expirations x strikes x (call, put)
+    rng = np.random.RandomState(seed)
+    num_expirations = min(NUM_EXPIRATIONS, max(1, contracts // (CONTRACTS_PER_STRIKE * 10)))
+    strikes_per_expiration = int(np.ceil(contracts / float(num_expirations * CONTRACTS_PER_STRIKE)))
+
+    days = np.repeat(7 * np.arange(1, num_expirations + 1), strikes_per_expiration * CONTRACTS_PER_STRIKE)
+    strike_steps = np.tile(np.repeat(np.arange(strikes_per_expiration), CONTRACTS_PER_STRIKE), num_expirations)
+    strike = np.round(price * 0.5 + strike_steps * max(0.5, np.round(price / strikes_per_expiration, 1)), 1)
+    is_call = np.tile([True, False], num_expirations * strikes_per_expiration)
+
+    days, strike, is_call = days[:contracts], strike[:contracts], is_call[:contracts]
+    intrinsic = np.where(is_call, np.maximum(price - strike, 0), np.maximum(strike - price, 0))
+    extrinsic = price * 0.2 * np.sqrt(days / 365.0) * np.exp(-np.abs(strike - price) / price * 4)
+    mid = np.round(intrinsic + extrinsic + rng.uniform(0, 0.1, contracts), 2)
+    spread = np.round(np.maximum(0.01, mid * rng.uniform(0.01, 0.1, contracts)), 2)
+    return rng, days, strike, is_call, mid, spread
+
+
+def _strftime(dates, fmt):
+    # Format each distinct date once; chains only have a handful of them
+    uniques, inverse = np.unique(dates.to_numpy(), return_inverse=True)
+    return pd.DatetimeIndex(uniques).strftime(fmt).to_numpy(dtype=object)[inverse]
+
+
+def _format(values, fmt):
+    uniques, inverse = np.unique(values, return_inverse=True)
+    return np.array([fmt.format(v) for v in uniques], dtype=object)[inverse]
+
+
+def td_quote(symbol='SYN', price=100.0):
+    """Return a one row underlying quote like TDClient.quoteDF"""
+    return pd.DataFrame([{
+        '52WkHigh': price * 1.3,
+        '52WkLow': price * 0.7,
+        'askPrice': price + 0.01,
+        'askSize': 300,
+        'assetType': 'EQUITY',
+        'bidPrice': price - 0.01,
+        'bidSize': 200,
+        'closePrice': price * 0.99,
+        'cusip': '000000000',
+        'description': symbol + ' Synthetic Corp',
+        'divAmount': 1.0,
+        'divYield': 1.0,
+        'exchangeName': 'NASD',
+        'highPrice': price * 1.01,
+        'lastPrice': price,
+        'lowPrice': price * 0.98,
+        'mark': price,
+        'netChange': price * 0.01,
+        'openPrice': price * 0.995,
+        'peRatio': 20.0,
+        'quoteTimeInLong': int(quote_date.value // 10**6),
+        'symbol': symbol,
+        'totalVolume': 1000000,
+        'volatility': 0.2,
+    }])
+
+
+def td_chain(contracts, symbol='SYN', price=100.0, seed=0):
+    """Return an option chain like TDClient.optionsDF"""
+    rng, days, strike, is_call, mid, spread = _grid(contracts, price, seed)
+    expiration = quote_date.normalize() + pd.to_timedelta(days, unit='D')
+    put_call = np.where(is_call, 'CALL', 'PUT')
+    letter = np.where(is_call, 'C', 'P')
+    strike_str = _format(strike, '{:g}')
+    exp_str = _strftime(expiration, '%m%d%y')
+    in_the_money = np.where(is_call, strike < price, strike > price)
+    volume = rng.poisson(50, contracts)
+
+    return pd.DataFrame({
+        'putCall': put_call,
+        'symbol': symbol + '_' + exp_str + letter + strike_str,
+        'description': symbol + ' ' + _strftime(expiration, '%b %d %Y') + ' ' + strike_str + ' ' +
+        np.where(is_call, 'Call', 'Put').astype(object),
+        'exchangeName': 'OPR',
+        'bid': np.maximum(mid - spread / 2, 0),
+        'ask': mid + spread / 2,
+        'last': mid,
+        'mark': mid,
+        'bidSize': rng.randint(1, 100, contracts),
+        'askSize': rng.randint(1, 100, contracts),
+        'lastSize': rng.randint(0, 10, contracts),
+        'highPrice': mid * 1.05,
+        'lowPrice': mid * 0.95,
+        'openPrice': mid,
+        'closePrice': mid,
+        'totalVolume': volume,
+        'tradeDate': None,
+        'tradeTimeInLong': quote_date,
+        'quoteTimeInLong': quote_date,
+        'netChange': rng.normal(0, 0.1, contracts),
+        'volatility': rng.uniform(10, 60, contracts),
+        'delta': np.where(is_call, 0.5, -0.5) * np.exp(-np.abs(strike - price) / price),
+        'gamma': rng.uniform(0, 0.1, contracts),
+        'theta': -rng.uniform(0, 0.1, contracts),
+        'vega': rng.uniform(0, 0.3, contracts),
+        'rho': rng.uniform(-0.1, 0.1, contracts),
+        'openInterest': rng.poisson(200, contracts),
+        'timeValue': mid,
+        'theoreticalOptionValue': mid,
+        'theoreticalVolatility': 29.0,
+        'optionDeliverablesList': None,
+        'strikePrice': strike,
+        'expirationDate': expiration,
+        'daysToExpiration': days,
+        'expirationType': 'R',
+        'lastTradingDay': expiration,
+        'multiplier': 100.0,
+        'settlementType': ' ',
+        'deliverableNote': '',
+        'isIndexOption': None,
+        'percentChange': rng.normal(0, 1, contracts),
+        'markChange': rng.normal(0, 0.1, contracts),
+        'markPercentChange': rng.normal(0, 1, contracts),
+        'mini': False,
+        'inTheMoney': in_the_money,
+        'nonStandard': False,
+    })
+
+
+def td_payload(contracts, symbol='SYN', price=100.0, seed=0):
+    """Return the option chain response body, as JSON bytes, that TDClient.optionsDF builds td_chain from"""
+    df = td_chain(contracts, symbol=symbol, price=price, seed=seed)
+    for c in ['tradeTimeInLong', 'quoteTimeInLong', 'expirationDate', 'lastTradingDay']:
+        df[c] = df[c].to_numpy().astype('datetime64[ms]').astype(np.int64)
+    # the server sends greeks it cannot compute as "NaN" strings
+    df['delta'] = df['delta'].astype(object)
+    df.loc[df.index[::97], 'delta'] = 'NaN'
+
+    exp_maps = {'CALL': {}, 'PUT': {}}
+    for contract in df.to_dict('records'):
+        expiration = '{}:{}'.format(pd.Timestamp(contract['expirationDate'], unit='ms').strftime('%Y-%m-%d'),
+                                    contract['daysToExpiration'])
+        strikes = exp_maps[contract['putCall']].setdefault(expiration, {})
+        strikes.setdefault('{:.1f}'.format(contract['strikePrice']), []).append(contract)
+    return json.dumps({
+        'symbol': symbol,
+        'status': 'SUCCESS',
+        'underlying': None,
+        'strategy': 'SINGLE',
+        'interval': 0.0,
+        'isDelayed': True,
+        'isIndex': False,
+        'interestRate': 0.1,
+        'underlyingPrice': price,
+        'volatility': 29.0,
+        'daysToExpiration': 0.0,
+        'numberOfContracts': contracts,
+        'callExpDateMap': exp_maps['CALL'],
+        'putExpDateMap': exp_maps['PUT'],
+    }, default=_json_default).encode('utf-8')
+
+
+def _json_default(value):
+    # numpy scalars, as to_dict('records') leaves them
+    return value.item()
+
+
+def yahoo_chain(contracts, symbol='SYN', price=100.0, seed=0, today=None):
+    """Return an option chain like the yahoo Options get_all_data()"""
+    rng, days, strike, is_call, mid, spread = _grid(contracts, price, seed)
+    if today is None:
+        today = pd.Timestamp.today().normalize()
+    expiry = today + pd.to_timedelta(days, unit='D')
+    letter = np.where(is_call, 'C', 'P')
+    symbols = (symbol + _strftime(expiry, '%y%m%d') + letter.astype(object) +
+               _format(np.rint(strike * 1000).astype(np.int64), '{:08d}'))
+
+    df = pd.DataFrame({
+        'Strike': strike,
+        'Expiry': expiry,
+        'Type': np.where(is_call, 'call', 'put'),
+        'Symbol': symbols,
+        'Last': mid,
+        'Bid': np.maximum(mid - spread / 2, 0),
+        'Ask': mid + spread / 2,
+        'Chg': rng.normal(0, 0.1, contracts),
+        'PctChg': rng.normal(0, 1, contracts),
+        'Vol': rng.poisson(50, contracts),
+        'Open_Int': rng.poisson(200, contracts),
+        'IV': rng.uniform(10, 60, contracts),
+        'Root': symbol,
+        'IsNonstandard': False,
+        'Underlying': symbol,
+        'Underlying_Price': price,
+        'Quote_Time': quote_date,
+        'Last_Trade_Date': quote_date,
+    })
+    df['JSON'] = [{'contractSymbol': s} for s in symbols]
+    return df.set_index(['Strike', 'Expiry', 'Type', 'Symbol'])
+
+
+def schwab_payload(contracts, symbol='SYN', price=100.0, seed=0):
+    """Return an optionChainsJson payload like the Schwab site"""
+    rng, days, strike, is_call, mid, spread = _grid(contracts, price, seed)
+    expiration = quote_date.normalize() + pd.to_timedelta(days, unit='D')
+    dates = _strftime(expiration, '%Y-%m-%dT00:00:00')
+    volume = rng.poisson(50, contracts)
+    open_interest = rng.poisson(200, contracts)
+
+    expirations = {}
+    for i in range(0, len(days) - 1, CONTRACTS_PER_STRIKE):
+        quotes = {}
+        for j, option in ((i, 'Call'), (i + 1, 'Put')):
+            quotes[option] = {
+                'Lst': float(mid[j]),
+                'Chg': 0,
+                'ChgPct': 0,
+                'Bid': float(max(mid[j] - spread[j] / 2, 0)),
+                'Ask': float(mid[j] + spread[j] / 2),
+                'Vol': int(volume[j]),
+                'OI': int(open_interest[j]),
+            }
+        strikes = expirations.setdefault(dates[i], [])
+        strikes.append(dict(Price=float(strike[i]), **quotes))
+
+    return {
+        'CompanyName': symbol + ' SYNTHETIC CORP',
+        'UnderLying': symbol,
+        'TimeStamp': quote_date.strftime('%Y-%m-%dT%H:%M:%S'),
+        'Roots': [{
+            'Root': symbol,
+            'IsAdjusted': 'N',
+            'Expirations': [{
+                'Date': date,
+                'Root': symbol,
+                'Type': 'WKY',
+                'SettleOnOpen': 'N',
+                'Strikes': strikes
+            } for date, strikes in expirations.items()],
+        }],
+    }
+
+
+class TDClient(object):
+    """Stands in for TDClient, serving td_quote and td_chain for every ticker
+
+    Chains are built once per ticker and copied on every request, so timing
+    a screen through this client leaves out generating them.  The query
+    parameters are ignored and the whole chain is served.
+    """
+    def __init__(self, contracts=2000):
+        self.contracts = contracts
+        self.chains = {}
+
+    def quoteDF(self, ticker):
+        return pd.concat([td_quote(symbol=t) for t in ticker.split(',')], ignore_index=True)
+
+    def optionsDF(self, ticker, **params):
+        if ticker not in self.chains:
+            self.chains[ticker] = td_chain(self.contracts, symbol=ticker, seed=len(self.chains))
+        return self.chains[ticker].copy()
@@ -7,7 +7,7 @@ from setuptools.command.develop import develop
 
 __requires__ = ['pipenv']
 
-packages = find_packages(exclude=['tests'])
+packages = find_packages(exclude=['tests', 'benchmarks'])
 base_dir = pathlib.Path(__file__).parent
 
 pipenv_command = ['pipenv', 'install']
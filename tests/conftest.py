@@ -5,6 +5,7 @@ import pytest
 import six
 import sys
 
+from app.app import App
 from app.cli import app as app_cli
 
 
@@ -78,3 +79,11 @@ def cli(request):
         return Result.from_upstream(r, allow_exception_access=explicit)
 
     return invoke
+
+
+@pytest.fixture(autouse=True)
+def config_cache(tmpdir, monkeypatch):
+    """Keep the rendered configs of every test out of the user's cache"""
+    monkeypatch.setattr(App, 'cache_dir', tmpdir.join('config-cache').strpath)
+    monkeypatch.setattr(App, '_jinja_dicts', {})
+    return App.cache_dir
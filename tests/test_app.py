@@ -0,0 +1,64 @@
+import os
+
+import mock
+import pytest
+
+from app import app
+from app import cli
+from app import utils
+
+
+@pytest.fixture
+def ctx(tmpdir):
+    c = cli.Context()
+    c.home = tmpdir.strpath
+    tmpdir.join('config.yaml').write("options:\n  long_puts:\n  - SPY\n  - '{{ env.OPTIONS_TICKER }}'\n")
+    tmpdir.join('other.yaml').write("options:\n  long_calls:\n  - QQQ\n")
+    return c
+
+
+class TestGetConfigDict():
+    def test_files_and_env_are_part_of_the_key(self, ctx, tmpdir, monkeypatch):
+        monkeypatch.setenv('OPTIONS_TICKER', 'AAPL')
+        a = app.App()
+        config = a.get_config_dict(ctx, ['config.yaml'])
+        assert config['config']['options']['long_puts'] == ['SPY', 'AAPL']
+        assert a.get_config_dict(ctx, ['other.yaml'])['other']['options'] == {'long_calls': ['QQQ']}
+
+        monkeypatch.setenv('OPTIONS_TICKER', 'MSFT')
+        assert a.get_config_dict(ctx, ['config.yaml'])['config']['options']['long_puts'] == ['SPY', 'MSFT']
+
+    def test_a_new_process_reads_the_disk_cache(self, ctx, tmpdir, monkeypatch, config_cache):
+        monkeypatch.setenv('OPTIONS_TICKER', 'AAPL')
+        expected = app.App().get_config_dict(ctx, ['config.yaml'])
+        assert len(os.listdir(config_cache)) == 1
+
+        # as if in a new process
+        monkeypatch.setattr(app.App, '_jinja_dicts', {})
+        with mock.patch.object(utils.YamlUtils, 'yaml_dict_from_file', side_effect=AssertionError('not cached')):
+            assert app.App().get_config_dict(ctx, ['config.yaml']) == expected
+
+        # a modified file is read again
+        monkeypatch.setattr(app.App, '_jinja_dicts', {})
+        config = tmpdir.join('config.yaml')
+        config.write(config.read().replace('SPY', 'IWM'))
+        os.utime(config.strpath, ns=(config.stat().mtime_ns + 10**9, ) * 2)
+        assert app.App().get_config_dict(ctx, ['config.yaml'])['config']['options']['long_puts'] == ['IWM', 'AAPL']
+
+    def test_the_disk_cache_returns_the_rendered_dict(self, ctx, tmpdir, monkeypatch, config_cache):
+        tmpdir.join('numbers.yaml').write("5: five\nsix: 6\nseven: '{{ numbers.six }}'\n")
+        expected = app.App().get_config_dict(ctx, ['numbers.yaml'])
+        assert expected['numbers'] == {'5': 'five', 'six': '6', 'seven': '6'}
+        monkeypatch.setattr(app.App, '_jinja_dicts', {})
+        assert app.App().get_config_dict(ctx, ['numbers.yaml']) == expected
+
+        # dicts cached by another version of the code are not read
+        monkeypatch.setattr(app.App, '_jinja_dicts', {})
+        monkeypatch.setattr(app.App, 'cache_version', app.App.cache_version + 1)
+        app.App().get_config_dict(ctx, ['numbers.yaml'])
+        assert len(os.listdir(config_cache)) == 2
+
+    def test_volatile_configs_are_not_cached_on_disk(self, ctx, tmpdir, config_cache):
+        tmpdir.join('secrets.yaml').write("password: '{{ mkpass(12) }}'\n")
+        assert len(app.App().get_config_dict(ctx, ['secrets.yaml'])['secrets']['password']) == 12
+        assert not os.path.exists(config_cache)
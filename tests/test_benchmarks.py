@@ -0,0 +1,82 @@
+import json
+import os
+
+import pytest
+from click.testing import CliRunner
+
+from app import tdchain
+from app.datareader import Datareader
+
+from benchmarks import run
+from benchmarks import synthetic
+
+
+class TestSynthetic():
+    def test_chain_sizes(self):
+        for n in [1, 100, 1001]:
+            assert len(synthetic.td_chain(n)) == n
+            assert len(synthetic.yahoo_chain(n)) == n
+
+    def test_schwab_payload_parses(self):
+        df = Datareader.schwab_options_dataframe_from_dict(synthetic.schwab_payload(100))
+        assert len(df) == 100
+        assert df['symbol'].str.match(r'^SYN\d{6}[CP]\d{8}$').all()
+
+    def test_td_payload_decodes_to_chain(self):
+        df = tdchain.decode_chain(synthetic.td_payload(100))
+        expected = synthetic.td_chain(100)
+        assert df.columns.tolist() == expected.columns.tolist() + ['interestRate', 'underlyingPrice']
+        # the calls come first, then the puts
+        assert sorted(df['symbol']) == sorted(expected['symbol'])
+
+    def test_seeded(self):
+        assert synthetic.td_chain(100, seed=1).equals(synthetic.td_chain(100, seed=1))
+
+
+class TestRun():
+    def test_results_file(self, tmpdir):
+        output = tmpdir.join('results.json').strpath
+        result = CliRunner().invoke(run.main, ['--sizes', '100', '--repeat', '1', '--output', output])
+        assert result.exit_code == 0, result.output
+
+        with open(output) as f:
+            results = json.load(f)
+        assert set(results['environment']) >= {'python', 'pandas', 'numpy'}
+        assert [r['name'] for r in results['results']] == [
+            'covered_calls_process_dataframe', 'covered_calls_csv_out', 'td_normalize', 'yahoo_normalize',
+            'long_puts_process_dataframe', 'long_puts_csv_out', 'long_calls_process_dataframe', 'long_calls_csv_out',
+            'implied_volatility', 'schwab_options_dataframe', 'td_chain_library', 'td_chain_decode'
+        ]
+        for r in results['results']:
+            assert r['contracts'] == 100
+            assert r['seconds'] > 0
+            assert r['peak_memory_bytes'] > 0
+
+        assert [m['name'] for m in results['memory']] == ['td_chain', 'yahoo_chain']
+        for m in results['memory']:
+            footprint = m['bytes_per_million_contracts']
+            assert footprint['raw'] > footprint['normalized'] > footprint['float32']
+
+        assert [s['name'] for s in results['scenarios']] == [
+            'covered_calls_screen_10_tickers', 'covered_calls_screen_40_tickers', 'pipeline_fetches', 'snapshot_read',
+            'trace_disabled_stage', 'server_cached_request', 'cli_help', 'cli_config_print'
+        ]
+        for s in results['scenarios']:
+            assert s['seconds'] > 0
+            assert s['seconds_per_call'] * s['calls'] == pytest.approx(s['seconds'])
+
+    def test_recorded_payloads(self, tmpdir):
+        output = tmpdir.join('results.json').strpath
+        payload = os.path.join(os.path.dirname(__file__), 'fixtures', 'td_chain_sample.json')
+        args = ['--sizes', '100', '--repeat', '1', '--only', 'td_chain', '--payload', payload, '--output', output]
+        result = CliRunner().invoke(run.main, args)
+        assert result.exit_code == 0, result.output
+
+        with open(output) as f:
+            results = json.load(f)['results']
+        assert [(r['name'], r.get('payload'), r['contracts']) for r in results] == [
+            ('td_chain_library', 'td_chain_sample.json', 16),
+            ('td_chain_decode', 'td_chain_sample.json', 16),
+            ('td_chain_library', None, 100),
+            ('td_chain_decode', None, 100),
+        ]
@@ -1,4 +1,12 @@
+import os
 import re
+import subprocess
+import sys
+import time
+
+import pytest
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 
 def test_app_help(cli):
@@ -6,3 +14,41 @@ def test_app_help(cli):
     regex = (r'Usage: app \[OPTIONS\] COMMAND \[ARGS\]...' '.*Options:' '.*Commands:')
     assert re.search(regex, r.output, re.DOTALL) is not None, r.output
     assert r.exit_code == 0
+
+
+# wall clock allowed for a fresh interpreter to print help or the config, several times the
+# couple of hundred milliseconds it takes, so a slow machine passes but a heavy import does not
+STARTUP_BUDGET = 2.0  # seconds
+
+# modules that only the commands that fetch or compute may import
+heavy_modules = ['pandas', 'numpy', 'pandas_datareader', 'selenium', 'pyarrow', 'requests_cache', 'tdameritrade']
+
+
+def run_startup(cache_dir, *args):
+    code = ("import sys\n"
+            "from app.cli import app\n"
+            "try:\n"
+            "    app(sys.argv[1:])\n"
+            "except SystemExit:\n"
+            "    pass\n"
+            "sys.stderr.write('\\nimported=' + ','.join(m for m in {!r} if m in sys.modules))\n").format(heavy_modules)
+    env = dict(os.environ, XDG_CACHE_HOME=cache_dir)
+    start = time.perf_counter()
+    r = subprocess.run([sys.executable, '-c', code] + list(args), capture_output=True, text=True, cwd=repo_dir, env=env)
+    elapsed = time.perf_counter() - start
+    imported = r.stderr.rsplit('imported=', 1)[-1].strip()
+    return r, elapsed, [m for m in imported.split(',') if m]
+
+
+@pytest.mark.parametrize('args', [('--help', ), ('--home', 'tests/fixtures', 'config', 'print')])
+def test_startup_is_light(args, tmpdir):
+    r, elapsed, imported = run_startup(tmpdir.strpath, *args)
+    assert r.returncode == 0, r.stderr
+    assert imported == []
+    assert elapsed < STARTUP_BUDGET
+
+
+def test_help_lists_every_command(cli):
+    r = cli('--help')
+    for name in ['config', 'coveredcalls', 'longcalls', 'longputs', 'screen', 'serve']:
+        assert re.search(r'^  {} +Subcommand'.format(name), r.output, re.MULTILINE), r.output
@@ -0,0 +1,346 @@
+import datetime
+import os
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app import csvstream
+from app import filters
+from app import kernels
+from app import pipeline
+from app import tdameritrade
+from app.commands import cmd_coveredcalls
+
+stock_price = cmd_coveredcalls.stock_price
+
+
+def make_stock_df(symbol='SPY', ask_price=300.0):
+    return pd.DataFrame([{
+        'symbol': symbol,
+        'askPrice': ask_price,
+        'bidPrice': ask_price - 0.05,
+        'lastPrice': ask_price - 0.02,
+        'description': symbol + ' description',
+    }])
+
+
+def make_options_df(n, ask_price=300.0, seed=0):
+    rng = np.random.RandomState(seed)
+    strike = np.round(ask_price * rng.uniform(0.5, 1.5, n) * 2) / 2
+    # Make sure the equality edge case is covered
+    strike[:5] = ask_price
+    put_call = np.where(rng.rand(n) < 0.5, 'CALL', 'PUT')
+    days = rng.randint(-2, 400, n)
+    days[:3] = [0, -1, 1]
+    bid = np.round(rng.uniform(0, 20, n), 2)
+    bid[rng.rand(n) < 0.1] = 0
+    in_the_money = np.where(put_call == 'CALL', strike < ask_price, strike > ask_price)
+    return pd.DataFrame({
+        'putCall': put_call,
+        'symbol': ['SYM{}'.format(i) for i in range(n)],
+        'bid': bid,
+        'ask': bid + 0.1,
+        'last': np.round(rng.uniform(0, 20, n), 2),
+        'strikePrice': strike,
+        'daysToExpiration': days,
+        'expirationDate': pd.Timestamp('2020-01-01') + pd.to_timedelta(days, unit='D'),
+        'totalVolume': rng.randint(0, 100, n),
+        'openInterest': rng.randint(0, 100, n),
+        'volatility': rng.uniform(5, 50, n),
+        'inTheMoney': in_the_money.astype(str),
+    })
+
+
+def narrow_options_df(df, contractType=None, range=None, strikeCount=None, fromDate=None, toDate=None):
+    """Apply the chain query parameters like the server, counting days to expiration from today"""
+    keep = np.ones(len(df), dtype=bool)
+    if contractType is not None:
+        keep &= df['putCall'].to_numpy() == contractType
+    if range in ('ITM', 'OTM'):
+        keep &= df['inTheMoney'].to_numpy() == str(range == 'ITM')
+    today = datetime.date.today()
+    if fromDate is not None:
+        keep &= df['daysToExpiration'].to_numpy() >= (datetime.date.fromisoformat(fromDate) - today).days
+    if toDate is not None:
+        keep &= df['daysToExpiration'].to_numpy() <= (datetime.date.fromisoformat(toDate) - today).days
+    return df[keep].reset_index(drop=True)
+
+
+def default_chain_params():
+    """The chain query parameters of the default filter"""
+    return tdameritrade.chain_params(cmd_coveredcalls.covered_calls_envelope())
+
+
+def reference_process_dataframe(stock_df, options_df):
+    """The original row-wise implementation, kept for parity testing"""
+    stock_df = stock_df.add_prefix("s_")
+    options_df = options_df.add_prefix("o_")
+    df = options_df.copy(deep=True)
+    for c in stock_df.columns.to_list():
+        df[c] = stock_df.iloc[0][c]
+
+    df['xo_premium'] = df.apply(lambda row: row['o_bid'] if row['o_bid'] > 0 else row['o_last'], axis=1)
+    df['xo_inTheMoney%'] = df.apply(lambda row: 0 if row['o_inTheMoney'] == 'True' else
+                                    (100.0 * (row[stock_price] - row['o_strikePrice']) / row[stock_price]),
+                                    axis=1)
+
+    def static_return_dollars(row):
+        if row[stock_price] <= row['o_strikePrice']:
+            return row['xo_premium']
+        else:
+            return row['xo_premium'] + row['o_strikePrice'] - row[stock_price]
+
+    df['xo_staticRet$'] = df.apply(static_return_dollars, axis=1)
+    df['xo_staticRet%'] = df.apply(lambda row: 100.0 * row['xo_staticRet$'] / row[stock_price], axis=1)
+    df['xo_staticRetAnn%'] = df.apply(lambda row: 0 if row['o_daysToExpiration'] <= 0 else
+                                      (row['xo_staticRet%'] * 365.0 / row['o_daysToExpiration']),
+                                      axis=1)
+    df['xo_assignedRet%'] = df.apply(lambda row: 100.0 *
+                                     (row['xo_premium'] + row['o_strikePrice'] - row[stock_price]) / row[stock_price],
+                                     axis=1)
+    df['xo_assignedRetAnn%'] = df.apply(
+        lambda row: 0 if row['o_daysToExpiration'] <= 0 else row['xo_assignedRet%'] * 365.0 / row['o_daysToExpiration'],
+        axis=1)
+    return df
+
+
+def wide_dataframe(chains):
+    return cmd_coveredcalls.covered_calls_join_dataframe(chains.options, chains.underlyings)
+
+
+xo_cols = [
+    'xo_premium',
+    'xo_inTheMoney%',
+    'xo_staticRet$',
+    'xo_staticRet%',
+    'xo_staticRetAnn%',
+    'xo_assignedRet%',
+    'xo_assignedRetAnn%',
+]
+
+
+class TestCoveredCallsProcessDataframe():
+    def test_parity_with_rowwise(self):
+        stock = make_stock_df()
+        options = make_options_df(2000)
+        expected = reference_process_dataframe(stock, options)
+        actual = wide_dataframe(cmd_coveredcalls.covered_calls_process_dataframe(stock, options))
+        greek_cols = ['xo_' + name for name in kernels.greek_names.values()]
+        assert actual.columns.to_list() == expected.columns.to_list() + greek_cols
+        for c in xo_cols:
+            np.testing.assert_allclose(actual[c].to_numpy(dtype=float), expected[c].to_numpy(dtype=float))
+
+    def test_boolean_in_the_money(self):
+        stock = make_stock_df()
+        options = make_options_df(500)
+        expected = cmd_coveredcalls.covered_calls_process_dataframe(stock, options).options
+
+        options['inTheMoney'] = options['inTheMoney'] == 'True'
+        actual = cmd_coveredcalls.covered_calls_process_dataframe(stock, options).options
+        np.testing.assert_allclose(actual['xo_inTheMoney%'], expected['xo_inTheMoney%'])
+        assert (actual.loc[options['inTheMoney'], 'xo_inTheMoney%'] == 0).all()
+
+    def test_expired_contracts_are_not_annualized(self):
+        stock = make_stock_df()
+        options = make_options_df(100)
+        options['daysToExpiration'] = 0
+        df = cmd_coveredcalls.covered_calls_process_dataframe(stock, options).options
+        assert (df['xo_staticRetAnn%'] == 0).all()
+        assert (df['xo_assignedRetAnn%'] == 0).all()
+
+    def test_quote_is_not_copied_into_every_row(self):
+        stock = make_stock_df()
+        options = make_options_df(1000)
+        chains = cmd_coveredcalls.covered_calls_process_dataframe(stock, options)
+        assert [c for c in chains.options.columns if c.startswith('s_')] == ['s_symbol']
+        assert chains.options['s_symbol'].cat.codes.dtype.itemsize == 1
+        assert len(chains.underlyings) == 1
+
+        # the join materializes the quote only for the rows asked for
+        rows = chains.options.index[::7]
+        actual = cmd_coveredcalls.covered_calls_join_dataframe(chains.options.loc[rows], chains.underlyings)
+        expected = reference_process_dataframe(stock, options).loc[rows]
+        cols = [c for c in expected.columns if not c.startswith('xo_')]
+        pd.testing.assert_frame_equal(actual[cols].astype(object), expected[cols].astype(object))
+
+
+class FakeClient(object):
+    """Stands in for the tdameritrade client with synthetic chains"""
+    def __init__(self, contracts=2000):
+        self.contracts = contracts
+
+    def quoteDF(self, ticker):
+        # like the quotes endpoint, a comma separated list of symbols gets a row per symbol
+        return pd.concat([make_stock_df(symbol=t) for t in ticker.split(',')], ignore_index=True)
+
+    def optionsDF(self, ticker, **params):
+        return narrow_options_df(make_options_df(self.contracts, seed=int(ticker[1:])), **params)
+
+
+class PricedClient(FakeClient):
+    """A FakeClient quoting T<n> at 100 * n, which records its requests"""
+    def __init__(self, contracts=200, fail_quotes=False):
+        super().__init__(contracts)
+        self.fail_quotes = fail_quotes
+        self.quotes = []
+        self.chains = []
+
+    def quoteDF(self, ticker):
+        self.quotes.append(ticker)
+        if self.fail_quotes and ',' in ticker:
+            raise ConnectionError('quotes endpoint down')
+        return pd.concat([make_stock_df(symbol=t, ask_price=100.0 * int(t[1:])) for t in ticker.split(',')],
+                         ignore_index=True)
+
+    def optionsDF(self, ticker, **params):
+        self.chains.append(ticker)
+        return narrow_options_df(
+            make_options_df(self.contracts, ask_price=100.0 * int(ticker[1:]), seed=int(ticker[1:])), **params)
+
+
+class TestCoveredCallsScreen():
+    def test_matches_per_ticker_processing(self):
+        tdc = FakeClient(contracts=200)
+        tickers = ['T{}'.format(i) for i in range(5)]
+        counts = pipeline.RowCounts()
+        chains, p = cmd_coveredcalls.covered_calls_screen(tdc, tickers, workers=3, counts=counts)
+        expected = cmd_coveredcalls.covered_calls_concat([
+            cmd_coveredcalls.covered_calls_process_dataframe(
+                tdc.quoteDF(t), tdameritrade.normalize_options_dataframe(tdc.optionsDF(t, **default_chain_params())))
+            for t in tickers
+        ])
+
+        # only the rows passing the raw predicates reach the metrics
+        mask = cmd_coveredcalls.default_filter.raw_mask(wide_dataframe(expected))
+        pd.testing.assert_frame_equal(chains.options, expected.options.loc[mask].reset_index(drop=True))
+        pd.testing.assert_frame_equal(chains.underlyings, expected.underlyings)
+        assert counts.counts == {'fetched': len(expected.options), 'raw predicates': mask.sum()}
+
+    def test_pushdown_output_is_unchanged(self, tmpdir):
+        tdc = FakeClient(contracts=3000)
+        tickers = ['T{}'.format(i) for i in range(4)]
+        frames = [cmd_coveredcalls.covered_calls_process_dataframe(tdc.quoteDF(t), tdc.optionsDF(t)) for t in tickers]
+        unfiltered_csv = tmpdir.join('unfiltered.csv').strpath
+        cmd_coveredcalls.covered_calls_csv_out(unfiltered_csv, cmd_coveredcalls.covered_calls_concat(frames))
+
+        pushdown_csv = tmpdir.join('pushdown.csv').strpath
+        all_df, p = cmd_coveredcalls.covered_calls_screen(tdc, tickers)
+        cmd_coveredcalls.covered_calls_csv_out(pushdown_csv, all_df)
+
+        with open(unfiltered_csv) as unfiltered, open(pushdown_csv) as pushdown:
+            assert pushdown.read() == unfiltered.read()
+
+    def test_time_and_memory_scale_linearly(self):
+        def measure(num_tickers):
+            tdc = FakeClient()
+            tickers = ['T{}'.format(i) for i in range(num_tickers)]
+            tracemalloc.start()
+            start = time.perf_counter()
+            counts = pipeline.RowCounts()
+            all_df, p = cmd_coveredcalls.covered_calls_screen(tdc, tickers, workers=1, counts=counts)
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            assert counts.counts['fetched'] == sum(len(tdc.optionsDF(t, **default_chain_params())) for t in tickers)
+            return elapsed, peak
+
+        measure(2)  # warm up
+        small_time, small_peak = measure(10)
+        large_time, large_peak = measure(40)
+
+        # 4x the tickers should cost about 4x, far from the 16x of quadratic appends.  The traced peak
+        # does not depend on the machine, so it is held close; the time only loosely.
+        assert large_peak / small_peak < 6
+        assert large_time / small_time < 10
+
+    def test_missing_first_column_is_skipped(self, tmpdir, caplog):
+        options = make_options_df(200).drop(columns=['volatility'])
+        chains = cmd_coveredcalls.covered_calls_process_dataframe(make_stock_df(), options)
+        filename = tmpdir.join('cc.csv').strpath
+        cmd_coveredcalls.covered_calls_csv_out(filename, chains)
+        header = pd.read_csv(filename).columns.to_list()
+        assert header[:2] == ['xo_staticRetAnn%', 'xo_staticRet%'] and 'o_volatility' not in header
+        assert 'o_volatility is not in the covered calls columns' in caplog.text
+
+
+class TestCoveredCallsStream():
+    def test_stream_matches_batch_output(self, tmpdir):
+        tdc = FakeClient(contracts=3000)
+        tickers = ['T{}'.format(i) for i in range(6)]
+
+        batch_csv = tmpdir.join('batch.csv').strpath
+        all_df, p = cmd_coveredcalls.covered_calls_screen(tdc, tickers, workers=3)
+        cmd_coveredcalls.covered_calls_csv_out(batch_csv, all_df)
+
+        stream_csv = tmpdir.join('stream.csv').strpath
+        p = cmd_coveredcalls.covered_calls_stream(tdc, tickers, stream_csv, workers=3)
+        assert p.failures == {}
+
+        with open(batch_csv) as batch, open(stream_csv) as stream:
+            assert stream.read() == batch.read()
+        # only the output is left behind
+        assert sorted(os.listdir(tmpdir.strpath)) == ['batch.csv', 'stream.csv']
+
+        # the columns come from the fetched chains, so with none the output is empty rather than a blank line
+        cmd_coveredcalls.covered_calls_stream(tdc, [], stream_csv)
+        assert tmpdir.join('stream.csv').read() == ''
+
+    def test_failed_merge_leaves_no_runs(self, tmpdir, monkeypatch):
+        def fail(self, reader):
+            raise OSError('disk full')
+
+        monkeypatch.setattr(csvstream.SortedCsvStream, '_keyed_rows', fail)
+        stream_csv = tmpdir.join('stream.csv').strpath
+        with pytest.raises(OSError, match='disk full'):
+            cmd_coveredcalls.covered_calls_stream(FakeClient(contracts=300), ['T1', 'T2'], stream_csv)
+        # the partial output stays, the runs and the merged file do not
+        assert os.listdir(tmpdir.strpath) == ['stream.csv']
+
+
+class TestCoveredCallsQuotes():
+    def test_quotes_are_fetched_in_chunks(self):
+        tdc = PricedClient()
+        tickers = ['T{}'.format(i) for i in range(1, 451)] + ['t1']
+        quotes = cmd_coveredcalls.covered_calls_quotes(tdc, tickers)
+        assert [len(q.split(',')) for q in tdc.quotes] == [200, 200, 50]
+        assert quotes.index.tolist() == ['T{}'.format(i) for i in range(1, 451)]
+        assert quotes.loc['T3', 'askPrice'] == 300.0
+
+    def test_screen_quotes_in_bulk(self):
+        tdc = PricedClient()
+        tickers = ['T1', 'T2', 'T3']
+        chains, p = cmd_coveredcalls.covered_calls_screen(tdc, tickers, workers=2)
+        assert tdc.quotes == ['T1,T2,T3']
+        assert chains.underlyings.index.tolist() == tickers
+        assert chains.underlyings['s_askPrice'].tolist() == [100.0, 200.0, 300.0]
+
+        # the same rows as quoting every ticker alone
+        expected = cmd_coveredcalls.covered_calls_concat([
+            cmd_coveredcalls.covered_calls_prepare_dataframe(
+                tdc.quoteDF(t), tdameritrade.normalize_options_dataframe(tdc.optionsDF(t, **default_chain_params())))
+            for t in tickers
+        ])
+        pd.testing.assert_frame_equal(chains.underlyings, expected.underlyings)
+        pd.testing.assert_frame_equal(chains.options[expected.options.columns], expected.options)
+
+    def test_failed_chunk_quotes_each_ticker(self):
+        tdc = PricedClient(fail_quotes=True)
+        chains, p = cmd_coveredcalls.covered_calls_screen(tdc, ['T1', 'T2'], workers=1)
+        assert tdc.quotes[0] == 'T1,T2'
+        assert sorted(tdc.quotes[1:]) == ['T1', 'T2']
+        assert chains.underlyings.index.tolist() == ['T1', 'T2']
+
+    def test_prefilter_skips_chains(self, tmpdir):
+        tdc = PricedClient()
+        screen_filter = filters.ScreenFilter(raw=["o_putCall == 'CALL'", 's_askPrice < 250'], ticker_column='s_symbol')
+        chains, p = cmd_coveredcalls.covered_calls_screen(tdc, ['T1', 'T2', 'T3'], screen_filter=screen_filter)
+        assert sorted(tdc.chains) == ['T1', 'T2']
+        assert chains.underlyings.index.tolist() == ['T1', 'T2']
+
+        p = cmd_coveredcalls.covered_calls_stream(PricedClient(), ['T3', 'T1'],
+                                                  tmpdir.join('cc.csv').strpath,
+                                                  screen_filter=screen_filter)
+        assert list(p.results) == ['T1']
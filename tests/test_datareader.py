@@ -1,9 +1,90 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
 from app import datareader
 
 dr = datareader.Datareader()
 
+fixtures_dir = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def load_fixture(name):
+    with open(os.path.join(fixtures_dir, name)) as f:
+        return json.load(f)
+
+
+def make_schwab_payload(num_strikes, underlying='SYN', num_expirations=20):
+    """Build a synthetic optionChainsJson payload with num_strikes strikes"""
+    rng = np.random.RandomState(0)
+    per_expiration = num_strikes // num_expirations
+    expirations = []
+    for e in range(num_expirations):
+        date = (pd.Timestamp('2020-01-17') + pd.Timedelta(days=7 * e)).strftime('%Y-%m-%dT00:00:00')
+        strikes = []
+        for s in range(per_expiration):
+            quote = {k: round(float(v), 2) for k, v in zip(['Lst', 'Chg', 'ChgPct', 'Bid', 'Ask'], rng.rand(5) * 10)}
+            quote.update({'Vol': int(rng.randint(100)), 'OI': int(rng.randint(1000))})
+            strikes.append({'Price': 10 + 0.5 * s, 'Call': dict(quote), 'Put': dict(quote)})
+        expirations.append({'Date': date, 'Root': underlying, 'Type': 'WKY', 'SettleOnOpen': 'N', 'Strikes': strikes})
+    return {
+        'CompanyName': 'SYNTHETIC',
+        'UnderLying': underlying,
+        'TimeStamp': '2020-01-14T02:05:09',
+        'Roots': [{
+            'Root': underlying,
+            'IsAdjusted': 'N',
+            'Expirations': expirations
+        }],
+    }
+
+
+def reference_schwab_options_dataframe(options_dict):
+    """The original row-at-a-time parser, kept for parity testing"""
+    df = pd.DataFrame(columns=datareader.common_columns)
+    i = 0
+    for root in options_dict['Roots']:
+        _underlying = options_dict['UnderLying']
+        _underlying_price = 0
+        _quotetime = pd.to_datetime(options_dict['TimeStamp'])
+        _adjusted = True if root['IsAdjusted'] == 'Y' else False
+        _root = root['Root']
+        for expiration in root['Expirations']:
+            _expiry = pd.to_datetime(expiration['Date'])
+            for strike in expiration['Strikes']:
+                _strike = strike['Price']
+                for option in ['Call', 'Put']:
+                    _type = option.lower()
+                    _symbol = ('{0}{1:02d}{2:02d}{3:02d}{4}{5:08d}'.format(_underlying, _expiry.year - 2000,
+                                                                           _expiry.month, _expiry.day,
+                                                                           "C" if _type == "call" else "P",
+                                                                           int(_strike * 1000)))
+                    df.loc[i] = [
+                        _strike, _expiry, _type, _symbol, strike[option]['Lst'], strike[option]['Bid'],
+                        strike[option]['Ask'], strike[option]['Chg'], strike[option]['Vol'], strike[option]['OI'],
+                        _root, _adjusted, _underlying, _underlying_price, _quotetime
+                    ]
+                    i += 1
+    return df
+
 
 class TestDatareader():
     def dtest_yahoo_dataframe(self):
         df = dr.yahoo_options_dataframe('AAPL')
         print(df)
+
+    def test_schwab_dataframe_matches_reference(self):
+        options_dict = load_fixture('schwab_options_aapl.json')
+        expected = reference_schwab_options_dataframe(options_dict)
+        actual = datareader.Datareader.schwab_options_dataframe_from_dict(options_dict)
+        assert actual.columns.to_list() == datareader.common_columns
+        assert len(actual) == len(expected)
+        for c in datareader.common_columns:
+            assert actual[c].to_list() == expected[c].to_list(), c
+
+    def test_schwab_dataframe_large_payload(self):
+        df = datareader.Datareader.schwab_options_dataframe_from_dict(make_schwab_payload(10000))
+        assert len(df) == 20000
+        assert df['symbol'].is_unique
@@ -0,0 +1,136 @@
+import datetime
+
+import pytest
+
+from app import envelopes
+from app import filters
+from app import longoptions
+from app import tdameritrade
+from app import yahoo
+from app.commands import cmd_coveredcalls
+from app.commands import cmd_screen
+from tests.test_coveredcalls import FakeClient
+from tests.test_screen import watchlists
+
+today = datetime.date(2021, 3, 1)
+
+
+class TestEnvelope():
+    def test_default_filters(self):
+        # the default covered calls filter compares strikes with the ask, not the price the server uses
+        assert cmd_coveredcalls.covered_calls_envelope() == envelopes.Envelope('CALL', min_days=7)
+        assert longoptions.long_puts.envelope() == envelopes.Envelope('PUT', 'OTM', min_days=31)
+        assert longoptions.long_calls.envelope() == envelopes.Envelope('CALL', 'OTM', min_days=14)
+
+    def test_from_filter(self):
+        columns = cmd_coveredcalls.envelope_columns
+        screen_filter = filters.ScreenFilter(
+            raw=['o_strikePrice <= s_askPrice', '60 > o_daysToExpiration', 'o_daysToExpiration > 20.5', 'o_bid > 1'],
+            ticker_column='s_symbol')
+        assert envelopes.Envelope.from_filter(screen_filter, columns) == envelopes.Envelope(min_days=21, max_days=59)
+
+        screen_filter = filters.ScreenFilter(raw=["o_putCall == 'CALL'", 'o_strikePrice > o_underlyingPrice'],
+                                             ticker_column='s_symbol')
+        assert envelopes.Envelope.from_filter(screen_filter, columns) == envelopes.Envelope('CALL', 'OTM')
+        screen_filter = filters.ScreenFilter(raw=['o_strikePrice < o_underlyingPrice'], ticker_column='s_symbol')
+        assert envelopes.Envelope.from_filter(screen_filter, columns) == envelopes.Envelope(strike_range='SBK')
+        # the at the money strike is in no range
+        screen_filter = filters.ScreenFilter(raw=["o_putCall == 'CALL'", 'o_strikePrice >= o_underlyingPrice'],
+                                             ticker_column='s_symbol')
+        assert envelopes.Envelope.from_filter(screen_filter, columns) == envelopes.Envelope('CALL')
+
+        screen_filter = filters.ScreenFilter(raw=["o_putCall == 'PUT'", 'o_strikePrice < s_askPrice'],
+                                             ticker_column='s_symbol',
+                                             fetch={'strike_range': 'ntm', 'strike_count': 10, 'max_days': 90})
+        assert envelopes.Envelope.from_filter(screen_filter, columns) == envelopes.Envelope(
+            'PUT', 'NTM', strike_count=10, max_days=90)
+
+    def test_per_ticker_predicates_do_not_narrow(self):
+        screen_filter = filters.ScreenFilter(raw=["o_putCall == 'CALL'"],
+                                             tickers={'SPY': {'raw': ['o_daysToExpiration > 30']}},
+                                             ticker_column='s_symbol')
+        assert envelopes.Envelope.from_filter(screen_filter, cmd_coveredcalls.envelope_columns) == envelopes.Envelope(
+            'CALL')
+
+    def test_from_config(self):
+        assert envelopes.Envelope.from_config(None) == envelopes.Envelope()
+        assert envelopes.Envelope.from_config({'contract_type': 'call', 'min_days': '3'}) == envelopes.Envelope(
+            'CALL', min_days=3)
+        with pytest.raises(ValueError, match='Unknown fetch settings: days'):
+            envelopes.Envelope.from_config({'days': 3})
+        with pytest.raises(ValueError, match='strike_range must be one of'):
+            envelopes.Envelope.from_config({'strike_range': 'FAR'})
+        with pytest.raises(ValueError, match='strike_count must be a whole number'):
+            envelopes.Envelope.from_config({'strike_count': 'ten'})
+        with pytest.raises(filters.FilterError, match='^filters: covered_calls: fetch must be a mapping'):
+            filters.ScreenFilter.from_config({'filters': {'covered_calls': {'fetch': ['CALL']}}}, 'covered_calls',
+                                             cmd_coveredcalls.default_filter)
+
+    def test_union_and_narrow(self):
+        calls = envelopes.Envelope('CALL', 'OTM', min_days=7)
+        puts = envelopes.Envelope('PUT', 'OTM', strike_count=20, min_days=31, max_days=90)
+        assert calls.union(puts) == envelopes.Envelope(strike_range='OTM', min_days=7)
+        assert puts.union(puts) == puts
+        assert calls.narrow(puts) == envelopes.Envelope('PUT', 'OTM', 20, 31, 90)
+        assert not envelopes.Envelope().bounded and puts.bounded
+        assert puts.covers(31) and puts.covers(90) and not puts.covers(30) and not puts.covers(91)
+
+    def test_chain_params(self):
+        envelope = envelopes.Envelope('PUT', 'OTM', strike_count=20, min_days=31, max_days=90)
+        assert tdameritrade.chain_params(envelope, today) == {
+            'contractType': 'PUT',
+            'range': 'OTM',
+            'strikeCount': 20,
+            'fromDate': '2021-03-31',
+            'toDate': '2021-05-31',
+        }
+        assert yahoo.chain_params(envelope, today) == {
+            'call': False,
+            'put': True,
+            'from_date': datetime.date(2021, 3, 31),
+            'to_date': datetime.date(2021, 5, 31),
+        }
+        assert tdameritrade.chain_params(envelopes.Envelope(), today) == {}
+        assert yahoo.chain_params(envelopes.Envelope(), today) == {}
+
+
+class RecordingClient(FakeClient):
+    """A FakeClient which records the query parameters of every chain"""
+    def __init__(self):
+        super().__init__(contracts=2000)
+        self.params = []
+        self.rows = 0
+
+    def optionsDF(self, ticker, **params):
+        self.params.append(params)
+        df = super().optionsDF(ticker, **params)
+        self.rows += len(df)
+        return df
+
+
+class TestNarrowedChains():
+    def test_output_is_unchanged(self, tmpdir):
+        tickers = ['T1', 'T2', 'T3']
+        full = FakeClient(contracts=2000)
+        full_csv = tmpdir.join('full.csv').strpath
+        frames = [cmd_coveredcalls.covered_calls_process_dataframe(full.quoteDF(t), full.optionsDF(t)) for t in tickers]
+        cmd_coveredcalls.covered_calls_csv_out(full_csv, cmd_coveredcalls.covered_calls_concat(frames))
+
+        narrowed = RecordingClient()
+        narrowed_csv = tmpdir.join('narrowed.csv').strpath
+        cmd_coveredcalls.covered_calls_stream(narrowed, tickers, narrowed_csv)
+
+        with open(full_csv) as f, open(narrowed_csv) as g:
+            assert g.read() == f.read()
+        assert all(p['contractType'] == 'CALL' and 'range' not in p for p in narrowed.params)
+        # a fraction of the payload, calls a week out or more
+        assert narrowed.rows < 0.6 * len(tickers) * full.contracts
+
+    def test_screen_fetches_the_union(self):
+        watchers = cmd_screen.screen_watchers(watchlists)
+        screen_filters = {name: s.default_filter for name, s in cmd_screen.strategies.items()}
+        found = cmd_screen.screen_envelopes(watchers, screen_filters)
+        assert found[cmd_screen.Key('tdameritrade', 'T1')] == envelopes.Envelope('CALL', min_days=7)
+        # puts and calls both watch T1 on yahoo, so both types are fetched from 14 days out
+        assert found[cmd_screen.Key('yahoo', 'T1')] == envelopes.Envelope(strike_range='OTM', min_days=14)
+        assert found[cmd_screen.Key('yahoo', 'T4')] == envelopes.Envelope(strike_range='OTM', min_days=14)
@@ -0,0 +1,128 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from app import filters
+from app import longoptions
+from app.commands import cmd_coveredcalls
+
+from tests.test_coveredcalls import FakeClient
+from tests.test_longoptions import make_yahoo_df
+
+
+def make_df():
+    return pd.DataFrame({
+        'Type': ['put', 'call', 'put', 'put'],
+        'Strike': [90.0, 110.0, np.nan, 95.0],
+        'Vol': [5, 0, 5, 5],
+        'Underlying': ['SPY', 'SPY', 'QQQ', 'QQQ'],
+        'xExpired': [False, False, True, False],
+    })
+
+
+class TestPredicate():
+    @pytest.mark.parametrize('text,expected', [
+        ("Type == 'put'", [True, False, True, True]),
+        ('Type != "put"', [False, True, False, False]),
+        ('Strike < 100', [True, False, False, True]),
+        ('100 > Strike', [True, False, False, True]),
+        ('Strike >= 9.5e1', [False, True, False, True]),
+        ('Vol <= -1', [False, False, False, False]),
+        ('xExpired', [False, False, True, False]),
+        ('not xExpired', [True, True, False, True]),
+        ('xExpired == False', [True, True, False, True]),
+    ])
+    def test_evaluate(self, text, expected):
+        assert filters.Predicate(text).evaluate(make_df()).tolist() == expected
+
+    @pytest.mark.parametrize('text', ['', 'Strike >', 'Strike = 1', 'Strike > 1 and Vol > 1', 'not 5', 'not'])
+    def test_parse_errors(self, text):
+        with pytest.raises(filters.FilterError, match='Unable to parse'):
+            filters.Predicate(text)
+
+    def test_unknown_column(self):
+        with pytest.raises(filters.FilterError, match="Unknown column 'Bid'"):
+            filters.Predicate('Bid > 1').evaluate(make_df())
+
+    def test_index_levels_and_scope(self):
+        df = make_df().set_index(['Type', 'Strike'])
+        scope = pd.Series({'s_askPrice': 100.0})
+        assert filters.Predicate("Type == 'put'").evaluate(df).tolist() == [True, False, True, True]
+        assert filters.Predicate('Strike > s_askPrice').evaluate(df, scope).tolist() == [False, True, False, False]
+
+
+class TestScreenFilter():
+    def test_mask_stages(self):
+        f = filters.ScreenFilter(raw=["Type == 'put'", 'Vol > 1'], derived=['not xExpired'])
+        df = make_df()
+        assert f.raw_mask(df).tolist() == [True, False, True, True]
+        assert f.derived_mask(df).tolist() == [True, True, False, True]
+        assert f.mask(df).tolist() == [True, False, False, True]
+
+    def test_per_ticker_predicates(self):
+        f = filters.ScreenFilter(raw=['Vol > 1'],
+                                 tickers={'qqq': {
+                                     'raw': ['Strike > 92']
+                                 }},
+                                 ticker_column='Underlying')
+        assert f.raw_mask(make_df()).tolist() == [True, False, False, True]
+        assert f.derived_mask(make_df()).tolist() == [True, True, True, True]
+
+    def test_readable_raw_mask(self):
+        f = filters.ScreenFilter(raw=['Vol > 1', 'Strike > Spot'],
+                                 derived=['not xExpired'],
+                                 tickers={'qqq': {
+                                     'raw': ['Strike > 92', 'Spot > 0']
+                                 }},
+                                 ticker_column='Underlying')
+        # only the predicates reading columns of the frame apply
+        assert f.readable_raw_mask(make_df()).tolist() == [True, False, False, True]
+        assert f.readable_raw_mask(make_df().drop(columns=['Underlying'])).tolist() == [True, False, True, True]
+
+    def test_validation(self):
+        with pytest.raises(filters.FilterError, match="reads derived column 'xExpired'"):
+            filters.ScreenFilter(raw=['not xExpired'])
+        with pytest.raises(filters.FilterError, match='must be a list of strings'):
+            filters.ScreenFilter(raw='Vol > 1')
+        with pytest.raises(filters.FilterError, match='need a ticker column'):
+            filters.ScreenFilter(tickers={'SPY': {'raw': ['Vol > 1']}})
+        with pytest.raises(filters.FilterError, match='Unknown filter sections: post'):
+            filters.ScreenFilter(tickers={'SPY': {'post': ['Vol > 1']}}, ticker_column='Underlying')
+
+    def test_from_config(self):
+        default = longoptions.long_puts.default_filter
+        assert filters.ScreenFilter.from_config({}, 'long_puts', default) is default
+        assert filters.ScreenFilter.from_config({'filters': {'long_calls': {}}}, 'long_puts', default) is default
+
+        # sections left out of the config keep their defaults
+        f = filters.ScreenFilter.from_config({'filters': {'long_puts': {'raw': ['Vol > 100']}}}, 'long_puts', default)
+        assert [p.text for p in f.stages['raw']] == ['Vol > 100']
+        assert [p.text for p in f.stages['derived']] == [p.text for p in default.stages['derived']]
+        assert f.ticker_column == 'Underlying'
+
+        with pytest.raises(filters.FilterError, match='^filters: long_puts: Unknown filter sections: derive$'):
+            filters.ScreenFilter.from_config({'filters': {'long_puts': {'derive': []}}}, 'long_puts', default)
+        with pytest.raises(filters.FilterError, match="^filters: long_puts: Unable to parse filter 'Vol >'$"):
+            filters.ScreenFilter.from_config({'filters': {'long_puts': {'raw': ['Vol >']}}}, 'long_puts', default)
+
+
+class TestDefaultFilters():
+    def test_long_puts_matches_chained_series(self):
+        df = longoptions.long_puts.process_dataframe(make_yahoo_df(5000))
+        expected = ((df['Type'] == 'put') & (~df['xExpired']) & (df['Strike'] < df['Underlying_Price']) &
+                    (df['xDaysUntilExpiration'] >= 14) & (df['Vol'] > 1) & (df['Open_Int'] > 10) &
+                    (df['xDaysUntilExpiration'] > 30))
+        assert expected.sum() > 0
+        np.testing.assert_array_equal(longoptions.long_puts.default_filter.mask(df), expected.to_numpy())
+
+    def test_covered_calls_per_ticker_config(self):
+        tdc = FakeClient(contracts=2000)
+        config = {'filters': {'covered_calls': {'tickers': {'T2': {'raw': ['o_openInterest > 80']}}}}}
+        screen_filter = filters.ScreenFilter.from_config(config, 'covered_calls', cmd_coveredcalls.default_filter)
+        default_df = cmd_coveredcalls.covered_calls_screen(tdc, ['T1', 'T2'])[0].options
+        df = cmd_coveredcalls.covered_calls_screen(tdc, ['T1', 'T2'], screen_filter=screen_filter)[0].options
+
+        t1 = df['s_symbol'] == 'T1'
+        assert t1.sum() == (default_df['s_symbol'] == 'T1').sum()
+        assert 0 < (~t1).sum() < (default_df['s_symbol'] == 'T2').sum()
+        assert (df.loc[~t1, 'o_openInterest'] > 80).all()
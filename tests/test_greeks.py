@@ -0,0 +1,116 @@
+import datetime
+import math
+
+import numpy as np
+import pytest
+
+from app import greeks
+from app import kernels
+from app import longoptions
+
+from benchmarks import synthetic
+
+
+def make_chain(n, seed=0):
+    rng = np.random.RandomState(seed)
+    spot = rng.uniform(20, 500, n)
+    strike = spot * rng.uniform(0.6, 1.6, n)
+    years = rng.randint(1, 730, n) / 365.0
+    sigma = rng.uniform(0.05, 1.5, n)
+    is_call = rng.rand(n) < 0.5
+    return is_call, spot, strike, years, sigma
+
+
+class TestPricing():
+    def test_norm_cdf(self):
+        x = np.linspace(-30, 30, 20001)
+        expected = np.array([0.5 * math.erfc(-v / math.sqrt(2)) for v in x])
+        np.testing.assert_allclose(greeks.norm_cdf(x), expected, rtol=1e-7, atol=0)
+
+    def test_known_prices(self):
+        # Hull, Options Futures and Other Derivatives
+        prices = greeks.black_scholes_price([True, False], 42.0, 40.0, 0.5, 0.1, 0.0, 0.2)
+        np.testing.assert_allclose(prices, [4.76, 0.81], atol=0.005)
+
+    def test_put_call_parity(self):
+        is_call, spot, strike, years, sigma = make_chain(1000)
+        call = greeks.black_scholes_price(True, spot, strike, years, 0.05, 0.02, sigma)
+        put = greeks.black_scholes_price(False, spot, strike, years, 0.05, 0.02, sigma)
+        np.testing.assert_allclose(call - put, spot * np.exp(-0.02 * years) - strike * np.exp(-0.05 * years),
+                                   atol=1e-9)
+
+
+class TestImpliedVolatility():
+    def test_round_trip(self):
+        is_call, spot, strike, years, sigma = make_chain(100000)
+        price = greeks.black_scholes_price(is_call, spot, strike, years, 0.04, 0.015, sigma)
+        iv = greeks.implied_volatility(price, is_call, spot, strike, years, 0.04, 0.015)
+
+        # a cent of time value is the finest any quote is given in
+        intrinsic = np.where(is_call, spot * np.exp(-0.015 * years) - strike * np.exp(-0.04 * years),
+                             strike * np.exp(-0.04 * years) - spot * np.exp(-0.015 * years))
+        quoted = price - np.maximum(intrinsic, 0) >= 0.01
+        assert quoted.mean() > 0.8
+        assert not np.isnan(iv[quoted]).any()
+        vega = greeks.greeks(is_call, spot, strike, years, sigma, 0.04, 0.015)['vega']
+        resolvable = quoted & (vega > 1e-4)
+        np.testing.assert_allclose(iv[resolvable], sigma[resolvable], rtol=1e-6)
+
+    @pytest.mark.parametrize('price,is_call,years', [
+        (1.0, True, 0.0),  # expired
+        (0.5, True, 1.0),  # below the intrinsic value of 10
+        (0.0, False, 1.0),  # no price
+        (200.0, False, 1.0),  # above the discounted strike
+    ])
+    def test_no_solution(self, price, is_call, years):
+        assert np.isnan(greeks.implied_volatility(price, is_call, 110.0, 100.0, years))
+
+
+class TestGreeks():
+    @pytest.mark.parametrize('is_call', [True, False])
+    def test_match_finite_differences(self, is_call):
+        spot, strike, years, sigma, rate, dividend = 100.0, 105.0, 0.5, 0.3, 0.04, 0.02
+        g = greeks.greeks(is_call, spot, strike, years, sigma, rate, dividend)
+
+        def price(spot=spot, years=years, sigma=sigma, rate=rate):
+            return float(greeks.black_scholes_price(is_call, spot, strike, years, rate, dividend, sigma))
+
+        h = 1e-4
+        assert g['delta'] == pytest.approx((price(spot=spot + h) - price(spot=spot - h)) / (2 * h), rel=1e-6)
+        assert g['gamma'] == pytest.approx(
+            (price(spot=spot + 0.01) - 2 * price() + price(spot=spot - 0.01)) / 0.01**2, rel=1e-4)
+        assert g['vega'] == pytest.approx((price(sigma=sigma + h) - price(sigma=sigma - h)) / (2 * h) / 100, rel=1e-6)
+        assert g['rho'] == pytest.approx((price(rate=rate + h) - price(rate=rate - h)) / (2 * h) / 100, rel=1e-6)
+        assert g['theta'] == pytest.approx((price(years=years - h) - price(years=years + h)) / (2 * h) / 365,
+                                           rel=1e-6)
+        assert 0 < g['probITM'] < 1
+
+    def test_nan_volatility(self):
+        g = greeks.greeks([True, False], 100.0, 100.0, 1.0, [np.nan, 0.2])
+        assert all(np.isnan(values[0]) and not np.isnan(values[1]) for values in g.values())
+
+
+class TestMarket():
+    def test_from_config(self):
+        market = greeks.Market.from_config({'greeks': {'rate': 0.05, 'dividend_yields': {'spy': 0.013}}})
+        assert market.rate == 0.05
+        np.testing.assert_array_equal(market.dividend_yield(['SPY', 'QQQ'], default=[0.01, 0.02]), [0.013, 0.02])
+        assert greeks.Market.from_config({}).rate == 0.0
+        with pytest.raises(ValueError, match='greeks:'):
+            greeks.Market.from_config({'greeks': [0.05]})
+
+    def test_long_calls_recover_the_volatility(self):
+        df = synthetic.yahoo_chain(2000, symbol='SPY').reset_index()
+        market = greeks.Market(rate=0.03, dividend_yields={'SPY': 0.015})
+        today = datetime.datetime.today()
+        days = (df['Expiry'] - today).dt.days.to_numpy()
+        price = greeks.black_scholes_price(df['Type'].to_numpy() == 'call', df['Underlying_Price'], df['Strike'],
+                                           days / 365.0, 0.03, 0.015, 0.35)
+        df['Bid'] = df['Ask'] = price
+
+        df = longoptions.long_calls.metrics_dataframe(df, market=market, today=today)
+        assert (df['xDividend'] == 0.015).all()
+        quoted = (days > 0) & (greeks.greeks(df['Type'] == 'call', df['Underlying_Price'], df['Strike'],
+                                             days / 365.0, 0.35, 0.03, 0.015)['vega'] > 1e-3)
+        np.testing.assert_allclose(df.loc[quoted, 'xIV'], 35.0, rtol=1e-6)
+        assert set(['x' + name for name in kernels.greek_names.values()]) <= set(df.columns)
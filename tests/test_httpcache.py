@@ -0,0 +1,97 @@
+import http.server
+import threading
+import time
+
+import pytest
+
+from app import httpcache
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    """Serves a fixed body with an ETag, and records every request"""
+
+    etag = '"v1"'
+
+    def do_GET(self):
+        self.server.requests.append((self.path, self.headers.get('If-None-Match')))
+        if self.headers.get('If-None-Match') == self.etag:
+            self.send_response(304)
+            self.send_header('ETag', self.etag)
+            self.end_headers()
+            return
+        body = b'{"symbol": "SPY"}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', self.etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    s = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    s.requests = []
+    t = threading.Thread(target=s.serve_forever)
+    t.daemon = True
+    t.start()
+    yield s
+    s.shutdown()
+    s.server_close()
+
+
+def make_cache(server, ttls, stale_while_revalidate=False):
+    host = '127.0.0.1:{}'.format(server.server_address[1])
+    endpoints = [(host + '/quotes*', 'quotes'), (host + '/chains*', 'chains'), (host + '/hours*', 'reference')]
+    return httpcache.HttpCache(backend='memory',
+                               ttls=ttls,
+                               endpoints=endpoints,
+                               stale_while_revalidate=stale_while_revalidate)
+
+
+def url(server, path):
+    return 'http://127.0.0.1:{}{}'.format(server.server_address[1], path)
+
+
+def wait_for(predicate, timeout=5):
+    deadline = time.time() + timeout
+    while not predicate() and time.time() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+
+class TestHttpCache():
+    def test_per_endpoint_ttls(self, server):
+        session = make_cache(server, {'quotes': 1, 'chains': 60, 'reference': 3600}).session()
+        for path in ['/quotes?symbol=SPY', '/chains?symbol=SPY', '/hours']:
+            assert not session.get(url(server, path)).from_cache
+            assert session.get(url(server, path)).from_cache
+        assert len(server.requests) == 3
+
+        time.sleep(1.1)
+
+        # Only the quote expired, and it is refreshed with a conditional request
+        r = session.get(url(server, '/quotes?symbol=SPY'))
+        assert r.status_code == 200
+        assert r.json() == {'symbol': 'SPY'}
+        assert session.get(url(server, '/chains?symbol=SPY')).from_cache
+        assert session.get(url(server, '/hours')).from_cache
+        assert server.requests[3:] == [('/quotes?symbol=SPY', '"v1"')]
+
+    def test_stale_while_revalidate(self, server):
+        session = make_cache(server, {'quotes': 1}, stale_while_revalidate=60).session()
+        session.get(url(server, '/quotes?symbol=SPY'))
+        time.sleep(1.1)
+
+        # The stale response comes back right away, and is refreshed in the background
+        r = session.get(url(server, '/quotes?symbol=SPY'))
+        assert r.from_cache
+        assert r.json() == {'symbol': 'SPY'}
+        assert wait_for(lambda: len(server.requests) == 2)
+        assert server.requests[1] == ('/quotes?symbol=SPY', '"v1"')
+
+    def test_singleton(self):
+        assert httpcache.HttpCache.singleton() is httpcache.HttpCache.singleton()
@@ -0,0 +1,173 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app import kernels
+from app import longoptions
+from app import normalize
+from app import pipeline
+from app import yahoo
+
+
+def make_yahoo_df(n, underlying_price=100.0, seed=0, root='SPY'):
+    rng = np.random.RandomState(seed)
+    today = pd.Timestamp(datetime.date.today())
+    strike = np.round(underlying_price * rng.uniform(0.5, 1.5, n) * 2) / 2
+    expiry = (today + pd.to_timedelta(rng.randint(-5, 400, n), unit='D')).astype('datetime64[ns]')
+    ask = np.round(rng.uniform(0, 10, n), 2)
+    ask[rng.rand(n) < 0.1] = 0
+    df = pd.DataFrame({
+        'Strike': strike,
+        'Expiry': expiry,
+        'Type': np.where(rng.rand(n) < 0.5, 'call', 'put'),
+        'Symbol': ['{}{:06d}'.format(root, i) for i in range(n)],
+        'Last': np.round(rng.uniform(0, 10, n), 2),
+        'Bid': np.maximum(ask - 0.1, 0),
+        'Ask': ask,
+        'Vol': rng.randint(0, 100, n),
+        'Open_Int': rng.randint(0, 100, n),
+        'IV': rng.uniform(5, 50, n),
+        'Root': root,
+        'Underlying_Price': underlying_price,
+    })
+    return df.set_index(['Strike', 'Expiry', 'Type', 'Symbol'])
+
+
+def reference_process_dataframe(df, direction, today):
+    """The original row-wise implementation, kept for parity testing"""
+    df.reset_index(inplace=True)
+    move = 'Drop' if direction == 'put' else 'Rise'
+    df['xDaysUntilExpiration'] = df.apply(lambda row: (row['Expiry'].to_pydatetime() - today).days, axis=1)
+    df['xExpired'] = df.apply(lambda row: row['xDaysUntilExpiration'] <= 0, axis=1)
+    df['xDividend'] = df.apply(lambda row: 0, axis=1)
+    df['xPremium'] = df.apply(lambda row: row['Ask'] if row['Ask'] > 0 else row['Last'], axis=1)
+    if direction == 'put':
+        df['xBreakEvenPrice'] = df.apply(lambda row: row['Strike'] - row['Ask'], axis=1)
+        df['xBreakEvenDrop'] = df.apply(lambda row: 0 + row['Underlying_Price'] - row['xBreakEvenPrice'], axis=1)
+    else:
+        df['xBreakEvenPrice'] = df.apply(lambda row: row['Strike'] + row['Ask'], axis=1)
+        df['xBreakEvenRise'] = df.apply(lambda row: 0 - row['Underlying_Price'] + row['xBreakEvenPrice'], axis=1)
+    df['xBreakEven' + move + '%'] = df.apply(
+        lambda row: 100.0 * row['xBreakEven' + move] / row['Underlying_Price'], axis=1)
+    df['xBreakEven' + move + '%PerDayUntilExpiration'] = df.apply(
+        lambda row: 0 if row['xDaysUntilExpiration'] == 0 else row['xBreakEven' + move + '%'] / row[
+            'xDaysUntilExpiration'],
+        axis=1)
+    if direction == 'put':
+        df['xBankrupcyReturn%'] = df.apply(lambda row: 0 if row['xPremium'] == 0 else 100.0 *
+                                           (row['Strike'] - row['xPremium']) / row['xPremium'],
+                                           axis=1)
+    return df
+
+
+scenarios = [
+    ('put', longoptions.long_puts),
+    ('call', longoptions.long_calls),
+]
+
+
+def narrow_yahoo_df(df, call=True, put=True, from_date=None, to_date=None):
+    """Keep the contract types and expiries requested, like YahooClient.optionsDF"""
+    types = df.index.get_level_values('Type')
+    expiry = df.index.get_level_values('Expiry').date
+    keep = ((types == 'call') & call) | ((types == 'put') & put)
+    if from_date is not None:
+        keep &= expiry >= from_date
+    if to_date is not None:
+        keep &= expiry <= to_date
+    return df[keep]
+
+
+class FakeYahooClient(object):
+    """Stands in for the yahoo client with synthetic chains"""
+    def optionsDF(self, ticker, **params):
+        return narrow_yahoo_df(make_yahoo_df(300, seed=len(ticker), root=ticker), **params)
+
+
+@pytest.mark.parametrize('direction,strategy', scenarios)
+class TestLongOptionsProcessDataframe():
+    def test_parity_with_rowwise(self, direction, strategy):
+        today = datetime.datetime.today()
+        expected = reference_process_dataframe(make_yahoo_df(1000), direction, today)
+        actual = strategy.process_dataframe(make_yahoo_df(1000), today=today)
+        greek_cols = ['x' + name for name in kernels.greek_names.values()]
+        assert actual.columns.to_list() == expected.columns.to_list() + greek_cols
+        for c in [c for c in expected.columns if c.startswith('x')]:
+            np.testing.assert_allclose(actual[c].to_numpy(dtype=float), expected[c].to_numpy(dtype=float))
+
+    def test_days_count_from_the_day_of_each_call(self, direction, strategy):
+        today = datetime.datetime.today()
+        df = strategy.process_dataframe(make_yahoo_df(1000), today=today)
+        later = strategy.metrics_dataframe(df.copy(), today=today + datetime.timedelta(days=30))
+        np.testing.assert_array_equal(later['xDaysUntilExpiration'], df['xDaysUntilExpiration'] - 30)
+        assert later['xExpired'].sum() > df['xExpired'].sum()
+
+    def test_csv_out_drops_expired(self, direction, strategy, tmpdir):
+        df = strategy.process_dataframe(make_yahoo_df(1000))
+        # Make every row pass the other filters, so only xExpired matters
+        df['Type'] = direction
+        df['Vol'] = 100
+        df['Open_Int'] = 100
+        df['Strike'] = np.where(direction == 'put', 1.0, 1000.0)
+        df['xDaysUntilExpiration'] = 100
+        df['xExpired'] = False
+        df.loc[df.index[:10], 'xExpired'] = True
+
+        filename = tmpdir.join('out.csv').strpath
+        strategy.csv_out(filename, df)
+        out = pd.read_csv(filename)
+        assert len(out) == len(df) - 10
+        assert not out['Symbol'].isin(df.loc[df['xExpired'], 'Symbol']).any()
+
+    def test_screen_matches_per_ticker_processing(self, direction, strategy):
+        tickers = ['A', 'BB', 'CCC']
+        client = FakeYahooClient()
+        all_df, p = strategy.screen(client, tickers, workers=2)
+        fetch = strategy.fetcher(client)
+        expected = normalize.concat_dataframes([strategy.process_dataframe(fetch(t)) for t in tickers])
+
+        # only the rows passing the raw predicates reach the metrics
+        expected = expected.loc[strategy.default_filter.raw_mask(expected)]
+        pd.testing.assert_frame_equal(all_df, expected.reset_index(drop=True))
+
+    def test_pushdown_output_is_unchanged(self, direction, strategy, tmpdir):
+        tickers = ['A', 'BB', 'CCC']
+        client = FakeYahooClient()
+        unfiltered_csv = tmpdir.join('unfiltered.csv').strpath
+        frames = [strategy.process_dataframe(client.optionsDF(t)) for t in tickers]
+        strategy.csv_out(unfiltered_csv, pd.concat(frames, ignore_index=True))
+
+        counts = pipeline.RowCounts()
+        all_df, p = strategy.screen(client, tickers, counts=counts)
+        pushdown_csv = tmpdir.join('pushdown.csv').strpath
+        strategy.csv_out(pushdown_csv, all_df, counts=counts)
+
+        with open(unfiltered_csv) as unfiltered, open(pushdown_csv) as pushdown:
+            assert pushdown.read() == unfiltered.read()
+        assert list(counts.counts) == ['fetched', 'raw predicates', 'derived predicates']
+        envelope = strategy.envelope()
+        params = yahoo.chain_params(envelope)
+        assert counts.counts['fetched'] == sum(len(client.optionsDF(t, **params)) for t in tickers)
+        assert counts.counts['derived predicates'] == len(pd.read_csv(pushdown_csv))
+
+    def test_stream_matches_batch_output(self, direction, strategy, tmpdir):
+        tickers = ['A', 'BB', 'CCC', 'DDDD']
+        client = FakeYahooClient()
+        all_df, p = strategy.screen(client, tickers)
+        batch_csv = tmpdir.join('batch.csv').strpath
+        strategy.csv_out(batch_csv, all_df)
+
+        stream_csv = tmpdir.join('stream.csv').strpath
+        strategy.stream(client, tickers, stream_csv)
+
+        with open(batch_csv) as batch, open(stream_csv) as stream:
+            assert stream.read() == batch.read()
+
+        # no rows at all still give the header
+        strategy.csv_out(batch_csv, all_df.iloc[:0])
+        strategy.stream(client, [], stream_csv)
+        with open(batch_csv) as batch, open(stream_csv) as stream:
+            assert stream.read() == batch.read()
+        assert len(pd.read_csv(stream_csv).columns) == len(strategy.csv_cols)
@@ -0,0 +1,119 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from app import filters
+from app import longoptions
+from app import normalize
+from app import tdameritrade
+from app import yahoo
+from app.commands import cmd_coveredcalls
+
+from benchmarks import synthetic
+
+
+class TestNormalizeDataframe():
+    def test_dtypes(self):
+        df = pd.DataFrame({
+            'name': ['a', 'b', 'a'],
+            'flag': ['True', 'False', 'True'],
+            'missing': ['True', None, 'False'],
+            'price': [1.5, 2.5, 3.5],
+            'size': [1, 2, 3],
+            'unused': [[1], [2], [3]],
+        })
+        out = normalize.normalize_dataframe(df,
+                                            drop=['unused', 'absent'],
+                                            categorical=['name'],
+                                            flags=['flag', 'missing'],
+                                            float32=True)
+        assert out.columns.to_list() == ['name', 'flag', 'missing', 'price', 'size']
+        assert isinstance(out['name'].dtype, pd.CategoricalDtype)
+        assert out['flag'].tolist() == [True, False, True]
+        assert out['missing'].dtype == df['missing'].dtype
+        assert out['price'].dtype == np.float32
+        assert out['size'].dtype == np.int64
+
+        # the input is left alone
+        assert df['flag'].tolist() == ['True', 'False', 'True']
+        assert 'unused' in df.columns
+
+    # pandas 3 stores strings in its own dtype, earlier versions as objects
+    @pytest.mark.parametrize('dtype', [object, pd.StringDtype()])
+    def test_string_storage(self, dtype):
+        df = pd.DataFrame({'name': ['a', 'b', 'a'], 'flag': ['True', 'False', 'True']}, dtype=dtype)
+        out = normalize.normalize_dataframe(df, categorical=['name'], flags=['flag'])
+        assert isinstance(out['name'].dtype, pd.CategoricalDtype)
+        assert out['name'].tolist() == ['a', 'b', 'a']
+        assert out['flag'].dtype == bool and out['flag'].tolist() == [True, False, True]
+        assert df['flag'].dtype == dtype
+
+    def test_keep_projects_columns_in_order(self):
+        df = pd.DataFrame({'a': [1], 'b': [2], 'c': [3]})
+        assert normalize.normalize_dataframe(df, keep={'c', 'a', 'z'}).columns.to_list() == ['a', 'c']
+
+    def test_concat_keeps_categoricals(self):
+        frames = [
+            normalize.normalize_dataframe(pd.DataFrame({'s': [s, s], 'v': [1, 2]}), categorical=['s'])
+            for s in ['SPY', 'QQQ']
+        ]
+        df = normalize.concat_dataframes(frames)
+        assert isinstance(df['s'].dtype, pd.CategoricalDtype)
+        assert df['s'].tolist() == ['SPY', 'SPY', 'QQQ', 'QQQ']
+        assert df.index.to_list() == [0, 1, 2, 3]
+
+
+class TestSourceNormalizers():
+    def test_td_chain_shrinks(self):
+        raw = synthetic.td_chain(10000)
+        df = tdameritrade.normalize_options_dataframe(raw)
+        assert 'optionDeliverablesList' not in df.columns
+        assert 'description' not in df.columns
+        assert isinstance(df['putCall'].dtype, pd.CategoricalDtype)
+        assert df['inTheMoney'].dtype == bool
+        assert normalize.memory_usage(df) < 0.8 * normalize.memory_usage(raw)
+        assert normalize.memory_usage(tdameritrade.normalize_options_dataframe(raw, float32=True)) < 0.6 * \
+            normalize.memory_usage(raw)
+
+    def test_td_keeps_filtered_columns(self):
+        screen_filter = filters.ScreenFilter(raw=["o_description != ''"])
+        df = tdameritrade.normalize_options_dataframe(synthetic.td_chain(100),
+                                                      required=cmd_coveredcalls.covered_calls_columns(screen_filter))
+        assert 'description' in df.columns
+
+    def test_yahoo_chain_shrinks(self):
+        raw = synthetic.yahoo_chain(10000)
+        df = yahoo.normalize_options_dataframe(raw, columns=longoptions.long_puts.columns())
+        assert 'JSON' not in df.columns
+        assert df.index.names == raw.index.names
+        assert normalize.memory_usage(df) < 0.5 * normalize.memory_usage(raw)
+
+
+class TestOutputParity():
+    def test_long_puts_csv_is_unchanged(self, tmpdir):
+        raw = synthetic.yahoo_chain(20000)
+        expected_csv = tmpdir.join('raw.csv').strpath
+        longoptions.long_puts.csv_out(expected_csv, longoptions.long_puts.process_dataframe(raw.copy()))
+
+        df = yahoo.normalize_options_dataframe(raw, columns=longoptions.long_puts.columns())
+        actual_csv = tmpdir.join('normalized.csv').strpath
+        longoptions.long_puts.csv_out(actual_csv, longoptions.long_puts.process_dataframe(df))
+
+        with open(expected_csv) as expected, open(actual_csv) as actual:
+            assert actual.read() == expected.read()
+
+    def test_covered_calls_csv_only_loses_unused_columns(self, tmpdir):
+        stock = synthetic.td_quote()
+        raw = synthetic.td_chain(20000)
+        expected_csv = tmpdir.join('raw.csv').strpath
+        expected = cmd_coveredcalls.covered_calls_process_dataframe(stock, raw)
+        unused = ['o_optionDeliverablesList', 'o_description']
+        expected = expected._replace(options=expected.options.drop(columns=unused))
+        cmd_coveredcalls.covered_calls_csv_out(expected_csv, expected)
+
+        df = tdameritrade.normalize_options_dataframe(raw)
+        actual_csv = tmpdir.join('normalized.csv').strpath
+        cmd_coveredcalls.covered_calls_csv_out(actual_csv, cmd_coveredcalls.covered_calls_process_dataframe(stock, df))
+
+        with open(expected_csv) as expected, open(actual_csv) as actual:
+            assert actual.read() == expected.read()
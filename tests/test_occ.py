@@ -0,0 +1,33 @@
+import numpy as np
+import pandas as pd
+
+from app import occ
+
+
+class TestOcc():
+    def test_encode(self):
+        symbols = occ.occ_encode('GOOG', ['2017-01-13', '2017-01-13', '2018-12-01'], ['call', 'put', 'C'],
+                                 [620, 672.5, 4.35])
+        assert list(symbols) == ['GOOG170113C00620000', 'GOOG170113P00672500', 'GOOG181201C00004350']
+
+    def test_decode(self):
+        df = occ.occ_decode(['GOOG170113C00620000', 'SPY   200117P00300500', 'not a symbol'])
+        assert df['underlying'].to_list()[:2] == ['GOOG', 'SPY']
+        assert df['expiry'].to_list()[:2] == [pd.Timestamp('2017-01-13'), pd.Timestamp('2020-01-17')]
+        assert df['type'].to_list()[:2] == ['call', 'put']
+        assert df['strike'].to_list()[:2] == [620.0, 300.5]
+        assert df.iloc[2].isna().all()
+
+    def test_round_trip(self):
+        rng = np.random.RandomState(0)
+        n = 10000
+        underlying = np.where(rng.rand(n) < 0.5, 'SPY', 'BRKB')
+        expiry = pd.Timestamp('2020-01-17') + pd.to_timedelta(rng.randint(0, 1000, n), unit='D')
+        put_call = np.where(rng.rand(n) < 0.5, 'call', 'put')
+        strike = np.round(rng.uniform(1, 3000, n) * 2) / 2
+
+        df = occ.occ_decode(occ.occ_encode(underlying, expiry, put_call, strike))
+        assert (df['underlying'].to_numpy() == underlying).all()
+        assert (df['expiry'].to_numpy() == expiry.to_numpy()).all()
+        assert (df['type'].to_numpy() == put_call).all()
+        np.testing.assert_array_equal(df['strike'].to_numpy(), strike)
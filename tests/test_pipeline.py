@@ -0,0 +1,86 @@
+import threading
+import time
+
+from app import pipeline
+
+
+class TestPipeline():
+    def test_results_in_ticker_order(self):
+        def fetch(ticker):
+            # Finish in reverse order
+            time.sleep(0.01 * (5 - int(ticker)))
+            return int(ticker)
+
+        p = pipeline.Pipeline(fetch, lambda ticker, data: data * 10, workers=5)
+        assert p.run(['1', '2', '3', '4', '2']) == [10, 20, 30, 40]
+        assert p.failures == {}
+        assert p.report() == ''
+
+    def test_failures_do_not_abort(self):
+        def fetch(ticker):
+            if ticker == 'BAD':
+                raise ValueError('no such ticker')
+            return ticker
+
+        def compute(ticker, data):
+            if ticker == 'UGLY':
+                raise ZeroDivisionError('bad chain')
+            return data.lower()
+
+        p = pipeline.Pipeline(fetch, compute, workers=2)
+        assert p.run(['SPY', 'BAD', 'QQQ', 'UGLY']) == ['spy', 'qqq']
+        assert sorted(p.failures) == ['BAD', 'UGLY']
+        assert p.failures['BAD'][0] == 'fetch'
+        assert p.failures['UGLY'][0] == 'compute'
+        report = p.report()
+        assert report.startswith('2 of 4 tickers failed:')
+        assert 'BAD (fetch): ValueError: no such ticker' in report
+
+    def test_compute_overlaps_fetch(self):
+        computing = threading.Event()
+        overlapped = []
+
+        def fetch(ticker):
+            if ticker == 'SLOW':
+                # Only finish once the fast ticker is being computed
+                overlapped.append(computing.wait(timeout=5))
+            return ticker
+
+        def compute(ticker, data):
+            if ticker == 'FAST':
+                computing.set()
+                time.sleep(0.01)
+            return data
+
+        p = pipeline.Pipeline(fetch, compute, workers=2)
+        assert p.run(['SLOW', 'FAST']) == ['SLOW', 'FAST']
+        assert overlapped == [True]
+
+    def test_every_worker_fetches_at_once(self):
+        # Each fetch waits for all the workers to be fetching, which fails unless they run together
+        together = threading.Barrier(20, timeout=5)
+
+        def fetch(ticker):
+            together.wait()
+            return ticker
+
+        p = pipeline.Pipeline(fetch, lambda ticker, data: data, workers=20)
+        tickers = ['T{}'.format(i) for i in range(100)]
+        assert p.run(tickers) == tickers
+        assert p.failures == {}
+
+
+class TestRowCounts():
+    def test_report(self):
+        counts = pipeline.RowCounts()
+        assert counts.report() == ''
+        for fetched, kept in [(600, 30), (400, 20)]:
+            counts.add('fetched', fetched)
+            counts.add('raw predicates', kept)
+        counts.add('derived predicates', 5)
+        assert counts.report().splitlines() == [
+            'Rows per stage:',
+            '  fetched                     1,000  100.00%',
+            '  raw predicates                 50    5.00%',
+            '  derived predicates              5    0.50%',
+        ]
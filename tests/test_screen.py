@@ -0,0 +1,115 @@
+import collections
+
+import pandas as pd
+
+from app import filters
+from app import longoptions
+from app.commands import cmd_coveredcalls
+from app.commands import cmd_screen
+
+from tests.test_coveredcalls import FakeClient, PricedClient
+from tests.test_longoptions import FakeYahooClient
+
+
+class Counting(object):
+    """Counts the chains fetched through the wrapped client"""
+    def __init__(self, client):
+        self.client = client
+        self.calls = collections.Counter()
+
+    def quoteDF(self, ticker):
+        return self.client.quoteDF(ticker)
+
+    def optionsDF(self, ticker, **params):
+        self.calls[ticker] += 1
+        if ticker == 'T9':
+            raise ValueError("no chain for T9")
+        return self.client.optionsDF(ticker, **params)
+
+
+watchlists = collections.OrderedDict([
+    ('covered_calls', ['T1', 'T2', 'T3']),
+    ('long_puts', ['T1', 'T2', 'T4', 'T9']),
+    ('long_calls', ['T4', 'T2', 'T1', 'T2']),
+])
+
+
+def single_strategy_outputs(tmpdir):
+    # what the three single strategy commands write for the same watchlists
+    tdc = FakeClient(contracts=300)
+    yc = FakeYahooClient()
+    expected = {}
+    for name, screen, csv_out, client in [
+        ('covered_calls', cmd_coveredcalls.covered_calls_screen, cmd_coveredcalls.covered_calls_csv_out, tdc),
+        ('long_puts', longoptions.long_puts.screen, longoptions.long_puts.csv_out, yc),
+        ('long_calls', longoptions.long_calls.screen, longoptions.long_calls.csv_out, yc),
+    ]:
+        filename = tmpdir.join('single_' + name + '.csv').strpath
+        tickers = [t for t in watchlists[name] if t != 'T9']
+        csv_out(filename, screen(client, tickers, workers=2)[0])
+        with open(filename) as f:
+            expected[name] = f.read()
+    return expected
+
+
+def read_outputs(outputs):
+    actual = {}
+    for name, filename in outputs.items():
+        with open(filename) as f:
+            actual[name] = f.read()
+    return actual
+
+
+class TestScreen():
+    def clients(self):
+        return {'tdameritrade': Counting(FakeClient(contracts=300)), 'yahoo': Counting(FakeYahooClient())}
+
+    def outputs(self, tmpdir):
+        return {name: tmpdir.join(cmd_screen.strategies[name].output).strpath for name in watchlists}
+
+    def test_fetches_each_ticker_once(self, tmpdir):
+        clients = self.clients()
+        frames, p = cmd_screen.screen(clients, watchlists, workers=3)
+        assert clients['tdameritrade'].calls == {'T1': 1, 'T2': 1, 'T3': 1}
+        assert clients['yahoo'].calls == {'T1': 1, 'T2': 1, 'T4': 1, 'T9': 1}
+        assert list(frames) == ['covered_calls', 'long_puts', 'long_calls']
+        assert list(p.failures) == [cmd_screen.Key('yahoo', 'T9')]
+        assert 'yahoo:T9 (fetch): ValueError: no chain for T9' in p.report()
+
+    def test_quotes_in_bulk_and_prefilter(self):
+        clients = {'tdameritrade': Counting(PricedClient(contracts=300)), 'yahoo': Counting(FakeYahooClient())}
+        screen_filters = {
+            'covered_calls': filters.ScreenFilter(raw=["o_putCall == 'CALL'", 's_askPrice < 250'],
+                                                  ticker_column='s_symbol')
+        }
+        frames, p = cmd_screen.screen(clients, watchlists, workers=3, screen_filters=screen_filters)
+        assert clients['tdameritrade'].client.quotes == ['T1,T2,T3']
+        # T3 is quoted at 300, so its chain is never fetched
+        assert clients['tdameritrade'].calls == {'T1': 1, 'T2': 1}
+        assert frames['covered_calls'].underlyings.index.tolist() == ['T1', 'T2']
+
+    def test_outputs_match_single_strategy_commands(self, tmpdir):
+        outputs = self.outputs(tmpdir)
+        frames, p = cmd_screen.screen(self.clients(), watchlists, workers=3)
+        for name, df in frames.items():
+            cmd_screen.strategies[name].csv_out(outputs[name], df)
+        assert read_outputs(outputs) == single_strategy_outputs(tmpdir)
+
+    def test_stream_matches_single_strategy_commands(self, tmpdir):
+        outputs = self.outputs(tmpdir)
+        clients = self.clients()
+        p = cmd_screen.screen_stream(clients, watchlists, outputs, workers=3)
+        assert clients['yahoo'].calls == {'T1': 1, 'T2': 1, 'T4': 1, 'T9': 1}
+        assert list(p.failures) == [cmd_screen.Key('yahoo', 'T9')]
+        assert read_outputs(outputs) == single_strategy_outputs(tmpdir)
+
+    def test_stream_of_failed_tickers_writes_the_header(self, tmpdir):
+        outputs = self.outputs(tmpdir)
+        cmd_screen.screen_stream(self.clients(), {'long_puts': ['T9']}, outputs)
+        with open(outputs['long_puts']) as f:
+            assert f.read() == pd.DataFrame(columns=longoptions.long_puts.csv_cols).to_csv(index=False)
+
+    def test_watchlists(self):
+        options = {'long_calls': ['SPY'], 'covered_calls': [], 'iron_condors': ['SPY'], 'long_puts': ['QQQ']}
+        assert cmd_screen.screen_watchlists(options) == collections.OrderedDict([('long_puts', ['QQQ']),
+                                                                                 ('long_calls', ['SPY'])])
@@ -0,0 +1,200 @@
+import collections
+import io
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import pandas as pd
+import pytest
+
+from app import server
+from app import utils
+from app.commands import cmd_screen
+from app.commands import cmd_serve
+
+from tests.test_coveredcalls import FakeClient
+from tests.test_longoptions import FakeYahooClient
+from tests.test_watch import ChangingClient
+
+watchlists = collections.OrderedDict([
+    ('covered_calls', ['T1', 'T2', 'T3']),
+    ('long_puts', ['T1', 'T2', 'T9']),
+    ('long_calls', ['T4', 'T2']),
+])
+
+
+@pytest.fixture
+def clients():
+    return {'tdameritrade': ChangingClient(FakeClient(contracts=300)), 'yahoo': ChangingClient(FakeYahooClient())}
+
+
+@pytest.fixture
+def serve(clients):
+    servers = []
+
+    def start(max_age=60):
+        screens = cmd_serve.serve_screens(clients, watchlists, workers=2, max_age=max_age)
+        httpd = server.ScreenServer(('127.0.0.1', 0), screens)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        servers.append(httpd)
+        return 'http://127.0.0.1:{}'.format(httpd.server_address[1]), screens
+
+    yield start
+    for httpd in servers:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def get(url, headers=None):
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, headers=headers or {})) as r:
+            return r.status, r.headers, r.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.headers, e.read()
+
+
+def expected_csv(clients, name, tickers, tmpdir):
+    # what the single strategy command writes for the same tickers
+    s = cmd_screen.strategies[name]
+    frames, p = cmd_screen.screen(clients, {name: [t for t in tickers if t != 'T9']})
+    filename = tmpdir.join(name + '.csv').strpath
+    s.csv_out(filename, frames[name])
+    with open(filename) as f:
+        return f.read()
+
+
+class TestScreenServer():
+    @pytest.mark.parametrize('name', list(watchlists))
+    def test_csv_matches_the_cli(self, serve, clients, name, tmpdir):
+        url, screens = serve()
+        status, headers, body = get('{}/screen/{}?format=csv'.format(url, cmd_serve.serve_route(name)))
+        assert status == 200
+        assert headers['Content-Type'] == 'text/csv'
+        expected = expected_csv(clients, name, watchlists[name], tmpdir)
+        assert body.decode() == expected
+
+    def test_json(self, serve, clients, tmpdir):
+        url, screens = serve()
+        status, headers, body = get(url + '/screen/longputs?tickers=t1,T9')
+        assert status == 200
+        assert headers['Content-Type'] == 'application/json'
+        doc = json.loads(body)
+        assert doc['tickers'] == ['T1'] and doc['missing'] == ['T9']
+        expected = expected_csv(clients, 'long_puts', ['T1'], tmpdir)
+        assert len(doc['rows']) == len(pd.read_csv(io.StringIO(expected)))
+
+        status, headers, body = get(url + '/screen/longputs?tickers=T1', headers={'Accept': 'text/csv'})
+        assert headers['Content-Type'] == 'text/csv'
+
+    def test_etag_revalidation(self, serve, clients):
+        url, screens = serve(max_age=0)
+        status, headers, body = get(url + '/screen/coveredcalls')
+        etag = headers['ETag']
+        calls = sum(clients['tdameritrade'].calls.values())
+
+        # the chains are fetched again, but did not change
+        screens['coveredcalls'].refresh()
+        status, headers, body = get(url + '/screen/coveredcalls', headers={'If-None-Match': etag})
+        assert status == 304 and body == b''
+        assert headers['ETag'] == etag
+        assert sum(clients['tdameritrade'].calls.values()) == calls + 3
+
+        clients['tdameritrade'].moved['T2'] += 1
+        screens['coveredcalls'].refresh()
+        status, headers, body = get(url + '/screen/coveredcalls', headers={'If-None-Match': etag})
+        assert status == 200 and headers['ETag'] != etag
+
+        status, headers, body = get(url + '/screen/coveredcalls?format=csv', headers={'If-None-Match': etag})
+        assert status == 200
+
+    def test_requests_read_the_last_refresh(self, serve, clients):
+        url, screens = serve(max_age=0)
+        get(url + '/screen/longcalls')
+        calls = sum(clients['yahoo'].calls.values())
+
+        for _ in range(20):
+            status, headers, body = get(url + '/screen/longcalls')
+            assert status == 200
+        assert sum(clients['yahoo'].calls.values()) == calls
+
+    def test_watchlist_is_upper_cased(self, clients):
+        screens = cmd_serve.serve_screens(clients, {'long_calls': ['t4', 'T2', ' t2']}, max_age=60)
+        screen = screens['longcalls']
+        assert screen.watchlist == ['T4', 'T2']
+        screen.refresh()
+        assert sorted(screen.snapshot.rows) == ['T2', 'T4']
+
+    def test_other_tickers_are_capped(self, serve, clients):
+        url, screens = serve()
+        screen = screens['longputs']
+        screen.max_tickers = 2
+        for ticker in ['T4', 'T5', 'T6']:
+            status, headers, body = get(url + '/screen/longputs?tickers=' + ticker)
+            assert json.loads(body)['tickers'] == [ticker]
+        screen.refresh()
+        assert sorted(screen.watcher.rows) == ['T1', 'T2', 'T5', 'T6']
+        assert sorted(screen.snapshot.tried) == ['T1', 'T2', 'T5', 'T6', 'T9']
+
+        status, headers, body = get(url + '/screen/longputs?tickers=T4,T5,T6')
+        assert status == 400
+
+    def test_failing_tickers_back_off(self, serve, clients):
+        url, screens = serve(max_age=0)
+        get(url + '/screen/longputs')
+        assert clients['yahoo'].calls['T9'] == 1
+        screens['longputs'].refresh()
+        status, headers, body = get(url + '/screen/longputs')
+        assert json.loads(body)['missing'] == ['T9']
+        assert clients['yahoo'].calls['T9'] == 1 and clients['yahoo'].calls['T1'] == 2
+
+    def test_background_refresh(self, clients):
+        screens = cmd_serve.serve_screens(clients, watchlists, workers=2, max_age=60)
+        screen = screens['longcalls']
+        screen.start()
+        try:
+            for _ in range(500):
+                if screen.snapshot.tried:
+                    break
+                time.sleep(0.01)
+        finally:
+            screen.stop()
+        assert sorted(screen.snapshot.rows) == ['T2', 'T4']
+        assert screen.thread is None
+
+    @pytest.mark.parametrize('path,status', [
+        ('/screen/nosuch', 404),
+        ('/elsewhere', 404),
+        ('/screen/longputs?format=xml', 400),
+        ('/health', 200),
+    ])
+    def test_routes(self, serve, path, status):
+        url, screens = serve()
+        code, headers, body = get(url + path)
+        assert code == status
+        assert headers['Content-Type'] == 'application/json'
+        json.loads(body)
+
+
+def test_requests_are_logged_through_the_fast_logger():
+    utils.LogUtils.stop_fast_logger()
+    stream = io.StringIO()
+    httpd = server.ScreenServer(('127.0.0.1', 0), {}, access_log=utils.LogUtils.get_fast_logger("INFO", stream=stream))
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    try:
+        get('http://127.0.0.1:{}/health'.format(httpd.server_address[1]))
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+        utils.LogUtils.stop_fast_logger()
+    line = json.loads(stream.getvalue())
+    assert '"GET /health HTTP/1.1" 200' in line['message'] and line['client'] == '127.0.0.1'
+
+
+class TestEtagMatches():
+    def test_etag_matches(self):
+        assert server.etag_matches('"a"', '"a"')
+        assert server.etag_matches('"b", W/"a"', '"a"')
+        assert server.etag_matches('*', '"a"')
+        assert not server.etag_matches('"b"', '"a"')
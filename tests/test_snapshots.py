@@ -0,0 +1,98 @@
+import os
+import time
+
+import pandas as pd
+
+from app import snapshots
+
+from tests.test_coveredcalls import make_options_df, make_stock_df
+from tests.test_longoptions import make_yahoo_df
+
+
+class CountingClient(object):
+    def __init__(self):
+        self.calls = []
+
+    def quoteDF(self, ticker):
+        self.calls.append(('quote', ticker))
+        return pd.concat([make_stock_df(symbol=t) for t in ticker.split(',')], ignore_index=True)
+
+    def optionsDF(self, ticker, **params):
+        self.calls.append(('chain', ticker))
+        return make_options_df(1000)
+
+    def hours(self):
+        return 'open'
+
+
+class TestSnapshotStore():
+    def test_round_trip(self, tmpdir):
+        store = snapshots.SnapshotStore(tmpdir.strpath)
+        df = make_options_df(100)
+        df['optionDeliverablesList'] = None
+        df.at[0, 'optionDeliverablesList'] = [{'symbol': 'SPY', 'deliverableUnits': 100.0}]
+        path = store.write('tdameritrade', 'chain', 'spy', df)
+        assert os.sep.join(['tdameritrade', 'chain', 'ticker=SPY', 'date=']) in path
+
+        actual = store.read('tdameritrade', 'chain', 'SPY')
+        pd.testing.assert_frame_equal(actual, df)
+
+    def test_round_trip_yahoo_multiindex(self, tmpdir):
+        store = snapshots.SnapshotStore(tmpdir.strpath)
+        df = make_yahoo_df(100)
+        df['JSON'] = [{'contractSymbol': s, 'inTheMoney': False} for s in df.index.get_level_values('Symbol')]
+        store.write('yahoo', 'chain', 'SPY', df)
+        pd.testing.assert_frame_equal(store.read('yahoo', 'chain', 'SPY'), df)
+
+    def test_freshness_window(self, tmpdir):
+        store = snapshots.SnapshotStore(tmpdir.strpath, max_age=60)
+        old = make_stock_df(ask_price=1.0)
+        new = make_stock_df(ask_price=2.0)
+        store.write('tdameritrade', 'quote', 'SPY', old, timestamp=time.time() - 2 * 24 * 60 * 60)
+        assert store.read('tdameritrade', 'quote', 'SPY') is None
+        assert store.read('tdameritrade', 'quote', 'SPY', max_age=3 * 24 * 60 * 60)['askPrice'][0] == 1.0
+
+        store.write('tdameritrade', 'quote', 'SPY', new)
+        assert store.read('tdameritrade', 'quote', 'SPY')['askPrice'][0] == 2.0
+        assert store.read('tdameritrade', 'quote', 'QQQ') is None
+
+    def test_snapshot_client_reads_through(self, tmpdir):
+        store = snapshots.SnapshotStore(tmpdir.strpath)
+        client = CountingClient()
+        tdc = snapshots.SnapshotClient(client, store, 'tdameritrade')
+
+        first = (tdc.quoteDF('SPY'), tdc.optionsDF('SPY'))
+        second = (tdc.quoteDF('SPY'), tdc.optionsDF('SPY'))
+
+        assert client.calls == [('quote', 'SPY'), ('chain', 'SPY')]
+        pd.testing.assert_frame_equal(first[0], second[0])
+        pd.testing.assert_frame_equal(first[1], second[1])
+        assert tdc.hours() == 'open'
+
+    def test_snapshot_client_keeps_narrowed_chains_apart(self, tmpdir):
+        store = snapshots.SnapshotStore(tmpdir.strpath)
+        client = CountingClient()
+        tdc = snapshots.SnapshotClient(client, store, 'tdameritrade')
+
+        tdc.optionsDF('SPY')
+        tdc.optionsDF('SPY', contractType='CALL', range='OTM')
+        tdc.optionsDF('SPY', range='OTM', contractType='CALL')
+        tdc.optionsDF('SPY', contractType='PUT')
+        assert client.calls == [('chain', 'SPY')] * 3
+        assert snapshots.chain_kind({}) == 'chain'
+        assert snapshots.chain_kind({'contractType': 'CALL'}).startswith('chain-')
+
+    def test_snapshot_client_quotes_lists_per_ticker(self, tmpdir):
+        store = snapshots.SnapshotStore(tmpdir.strpath)
+        client = CountingClient()
+        tdc = snapshots.SnapshotClient(client, store, 'tdameritrade')
+
+        tdc.quoteDF('QQQ')
+        quotes = tdc.quoteDF('SPY,QQQ,IWM')
+        assert client.calls == [('quote', 'QQQ'), ('quote', 'SPY,IWM')]
+        assert quotes['symbol'].tolist() == ['SPY', 'QQQ', 'IWM']
+
+        # every ticker of the list is now fresh on its own
+        pd.testing.assert_frame_equal(tdc.quoteDF('IWM'), make_stock_df(symbol='IWM'))
+        assert tdc.quoteDF('IWM,SPY')['symbol'].tolist() == ['IWM', 'SPY']
+        assert len(client.calls) == 2
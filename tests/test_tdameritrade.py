@@ -0,0 +1,58 @@
+import json
+import time
+
+import pytest
+import requests
+import tdameritrade as td
+
+from app import tdameritrade
+from app import tokens
+from tests.test_tokens import Refresher
+from tests.test_tokens import authenticate
+from tests.test_tokens import make_config
+
+
+@pytest.fixture
+def sent(monkeypatch):
+    """Answer every request with a quote of SPY, recording the requests sent"""
+    requests_sent = []
+
+    def send(session, request, **kwargs):
+        requests_sent.append(request)
+        response = requests.Response()
+        response.status_code = 200
+        response._content = json.dumps({'SPY': {'symbol': 'SPY', 'askPrice': 400.0}}).encode('utf-8')
+        response.request = request
+        return response
+
+    monkeypatch.setattr(requests.Session, 'send', send)
+    return requests_sent
+
+
+def make_td(tmpdir):
+    # the config and tokens of TDAmeritrade, without prompting for them or installing the HTTP cache
+    config = dict(make_config(time.time()), tda_user='user', tda_pass='pass', redirect_uri='https://localhost')
+    ameritrade = tdameritrade.TDAmeritrade.__new__(tdameritrade.TDAmeritrade)
+    ameritrade.snapshots = None
+    ameritrade.session = requests.Session()
+    ameritrade.config = config
+    ameritrade.tokens = tokens.TokenManager(config, tmpdir.join('tdameritrade').strpath, authenticate, Refresher())
+    return ameritrade
+
+
+class TestGetClient():
+    def test_installed_client_sends_the_tokens(self, tmpdir, sent):
+        ameritrade = make_td(tmpdir)
+        client = ameritrade.get_client()
+        try:
+            assert isinstance(client.client, td.TDClient)
+            assert client.quoteDF('SPY')['askPrice'].tolist() == [400.0]
+            assert sent[-1].headers['Authorization'] == 'Bearer token0'
+
+            # a token refreshed in the background is sent from then on
+            ameritrade.tokens.oauth['access_token_timestamp'] = 0
+            ameritrade.tokens.ensure()
+            client.quoteDF('SPY')
+            assert sent[-1].headers['Authorization'] == 'Bearer token1'
+        finally:
+            ameritrade.tokens.stop()
@@ -0,0 +1,123 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app import tdameritrade
+from app import tdchain
+from app import trace
+from app.commands import cmd_coveredcalls
+from benchmarks import run
+from benchmarks import synthetic
+from tests.test_coveredcalls import make_stock_df
+
+fixture = os.path.join(os.path.dirname(__file__), 'fixtures', 'td_chain_sample.json')
+
+
+def read_fixture():
+    with open(fixture, 'rb') as f:
+        return f.read()
+
+
+def library_normalized(payload):
+    # the library leaves the "NaN" strings of greeks it could not compute in object columns
+    df = tdameritrade.normalize_options_dataframe(run.library_options_dataframe(payload))
+    for c in tdchain.float_fields:
+        if df[c].dtype == object:
+            df[c] = pd.to_numeric(df[c], errors='coerce')
+    return df
+
+
+class QuoteClient(object):
+    def quoteDF(self, ticker):
+        return make_stock_df(symbol=ticker, ask_price=387.51)
+
+
+class FakeResponse(object):
+    def __init__(self, content):
+        self.content = content
+
+    def raise_for_status(self):
+        pass
+
+
+class FakeSession(object):
+    def __init__(self, content):
+        self.content = content
+        self.requests = []
+
+    def get(self, url, params=None, headers=None):
+        self.requests.append((url, params, headers))
+        return FakeResponse(self.content)
+
+
+class TestDecodeChain():
+    def test_matches_library(self):
+        payload = read_fixture()
+        df = tdchain.decode_chain(payload)
+        pd.testing.assert_frame_equal(tdameritrade.normalize_options_dataframe(df), library_normalized(payload))
+
+        assert len(df) == 16
+        assert isinstance(df['putCall'].dtype, pd.CategoricalDtype)
+        assert df['delta'].dtype == np.float64 and df['delta'].isna().sum() == 2
+        assert df['inTheMoney'].dtype == bool
+        assert df['expirationDate'].iloc[0] == pd.Timestamp('2021-03-19 20:00:00')
+        assert (df['underlyingPrice'] == 387.51).all()
+
+    def test_synthetic_payload_matches_library(self):
+        payload = synthetic.td_payload(2000)
+        pd.testing.assert_frame_equal(tdameritrade.normalize_options_dataframe(tdchain.decode_chain(payload)),
+                                      library_normalized(payload))
+
+    def test_irregular_contracts(self):
+        chain = json.loads(read_fixture())
+        strikes = chain['callExpDateMap']['2021-03-19:18']
+        del strikes['380.0'][0]['pennyPilot']
+        strikes['385.0'][0]['totalVolume'] = None
+        strikes['390.0'][0]['tradeTimeInLong'] = None
+        df = tdchain.decode_chain(json.dumps(chain))
+
+        assert len(df) == 16
+        assert df['pennyPilot'].dtype == object and df['pennyPilot'].isna().sum() == 1
+        assert df['totalVolume'].dtype == np.float64 and df['totalVolume'].isna().sum() == 1
+        assert df['tradeTimeInLong'].isna().sum() == 1
+
+    def test_empty_and_failed_chains(self):
+        chain = json.loads(read_fixture())
+        chain['callExpDateMap'] = chain['putExpDateMap'] = {}
+        assert len(tdchain.decode_chain(json.dumps(chain))) == 0
+
+        with pytest.raises(ValueError, match='No chain for SPY: status FAILED'):
+            tdchain.decode_chain(json.dumps({'symbol': 'SPY', 'status': 'FAILED'}))
+
+
+class TestChainClient():
+    def test_requests_and_decodes(self):
+        session = FakeSession(read_fixture())
+        client = tdchain.ChainClient(QuoteClient(), session, lambda: 'token1')
+        df = client.optionsDF('SPY', contractType='CALL', range='OTM')
+        assert len(df) == 16
+        assert client.quoteDF('SPY')['symbol'].tolist() == ['SPY']
+        assert session.requests == [(tdchain.CHAIN_URL, {
+            'symbol': 'SPY',
+            'contractType': 'CALL',
+            'range': 'OTM'
+        }, {
+            'Authorization': 'Bearer token1'
+        })]
+
+    def test_fetch_traces_decode(self):
+        client = tdchain.ChainClient(QuoteClient(), FakeSession(read_fixture()), lambda: 'token1')
+        tracer = trace.start()
+        try:
+            with trace.stage('fetch', 'SPY'):
+                stock_df, options_df = cmd_coveredcalls.covered_calls_fetch(
+                    client, 'SPY', envelope=cmd_coveredcalls.covered_calls_envelope())
+        finally:
+            trace.stop()
+        assert stock_df['symbol'].tolist() == ['SPY']
+        assert len(options_df) == 16
+        decode = [e for e in tracer.events if e.name == 'decode']
+        assert [e.ticker for e in decode] == ['SPY']
@@ -0,0 +1,135 @@
+import os
+import stat
+import threading
+import time
+
+from app import tokens
+from app.utils import YamlUtils
+
+
+def make_config(now, expires_in=1800, access_token='token0'):
+    return {
+        'client_id': 'client',
+        '_oauth2': {
+            'access_token': access_token,
+            'refresh_token': 'refresh0',
+            'expires_in': expires_in,
+            'refresh_token_expires_in': 90 * 24 * 60 * 60,
+            'access_token_timestamp': int(now),
+            'refresh_token_timestamp': int(now),
+        }
+    }
+
+
+class Refresher(object):
+    """Stands in for the token endpoint, issuing numbered tokens"""
+    def __init__(self, expires_in=1800, delay=0.0):
+        self.expires_in = expires_in
+        self.delay = delay
+        self.calls = 0
+        self.lock = threading.Lock()
+        self.refreshed = threading.Event()
+
+    def __call__(self, config):
+        with self.lock:
+            self.calls += 1
+            calls = self.calls
+        time.sleep(self.delay)
+        self.refreshed.set()
+        return {'access_token': 'token{}'.format(calls), 'expires_in': self.expires_in}
+
+
+def authenticate(config):
+    return {'access_token': 'login', 'refresh_token': 'refresh1', 'expires_in': 1800,
+            'refresh_token_expires_in': 90 * 24 * 60 * 60}
+
+
+class TestTokenManager():
+    def manager(self, filename, config, refresher, **kwargs):
+        YamlUtils.yaml_dict_to_file(config, filename)
+        return tokens.TokenManager(YamlUtils.yaml_dict_from_file(filename), filename, authenticate, refresher,
+                                   **kwargs)
+
+    def test_valid_tokens_are_kept(self, tmpdir):
+        filename = tmpdir.join('tda.yaml').strpath
+        refresher = Refresher()
+        m = self.manager(filename, make_config(time.time()), refresher)
+        m.ensure()
+        m.save()
+        assert m.access_token == 'token0'
+        assert refresher.calls == 0
+
+    def test_expiring_token_is_refreshed_and_saved(self, tmpdir):
+        filename = tmpdir.join('tda.yaml').strpath
+        refresher = Refresher()
+        m = self.manager(filename, make_config(time.time() - 1700), refresher)
+        seen = []
+        m.subscribe(seen.append)
+        m.ensure()
+        assert refresher.calls == 1
+        assert m.access_token == 'token1' and seen == ['token1']
+
+        saved = YamlUtils.yaml_dict_from_file(filename)
+        assert saved['_oauth2']['access_token'] == 'token1'
+        assert stat.S_IMODE(os.stat(filename).st_mode) == 0o600
+        assert sorted(os.listdir(tmpdir.strpath)) == ['tda.yaml', 'tda.yaml.lock']
+
+    def test_empty_tokens_authenticate(self, tmpdir):
+        filename = tmpdir.join('tda.yaml').strpath
+        config = make_config(0)
+        config['_oauth2']['access_token_timestamp'] = ''
+        m = self.manager(filename, config, Refresher())
+        assert m.needs() == 'authenticate'
+        assert m.access_token == 'login'
+        assert m.oauth['refresh_token'] == 'refresh1'
+        assert m.needs() is None
+
+    def test_background_refresh_before_expiry(self, tmpdir):
+        filename = tmpdir.join('tda.yaml').strpath
+        refresher = Refresher(expires_in=60)
+        # the token has 3s left, so it is refreshed 2s from now
+        m = self.manager(filename, make_config(time.time() - 57, expires_in=60), refresher, refresh_margin=1)
+        m.start()
+        try:
+            assert m.access_token == 'token0'
+            assert refresher.refreshed.wait(10)
+        finally:
+            m.stop()
+        assert refresher.calls == 1
+        assert m.access_token == 'token1'
+
+    def test_processes_share_one_refresh(self, tmpdir):
+        # flock locks belong to open files, so two managers on one file contend like two processes
+        filename = tmpdir.join('tda.yaml').strpath
+        refresher = Refresher(delay=0.2)
+        config = make_config(time.time() - 1700)
+        managers = [self.manager(filename, config, refresher) for _ in range(2)]
+        threads = [threading.Thread(target=m.ensure) for m in managers]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert refresher.calls == 1
+        assert [m.access_token for m in managers] == ['token1', 'token1']
+
+    def test_answers_given_before_the_manager_are_saved(self, tmpdir):
+        filename = tmpdir.join('tda.yaml').strpath
+        config = dict(make_config(time.time()), tda_pass='')
+        YamlUtils.yaml_dict_to_file(config, filename)
+        # as TDAmeritrade.init_config() prompts for the empty fields before the manager exists
+        config = YamlUtils.yaml_dict_from_file(filename)
+        config['tda_pass'] = 'secret'
+        m = tokens.TokenManager(config, filename, authenticate, Refresher())
+        m.save()
+        assert YamlUtils.yaml_dict_from_file(filename)['tda_pass'] == 'secret'
+
+    def test_save_keeps_newer_tokens_on_disk(self, tmpdir):
+        filename = tmpdir.join('tda.yaml').strpath
+        now = time.time()
+        stale = self.manager(filename, make_config(now - 100), Refresher())
+        YamlUtils.yaml_dict_to_file(make_config(now, access_token='newer'), filename)
+        stale.config['tda_user'] = 'me'
+        stale.save()
+        saved = YamlUtils.yaml_dict_from_file(filename)
+        assert saved['tda_user'] == 'me'
+        assert saved['_oauth2']['access_token'] == 'newer'
@@ -0,0 +1,92 @@
+import json
+import threading
+
+import pytest
+
+from app import longoptions
+from app import pipeline
+from app import trace
+from app.commands import cmd_coveredcalls
+from tests.test_coveredcalls import FakeClient
+from tests.test_longoptions import FakeYahooClient
+
+
+@pytest.fixture
+def tracer():
+    t = trace.start()
+    yield t
+    trace.stop()
+
+
+class TestTrace():
+    def test_disabled_stage_does_nothing(self):
+        assert trace._tracer is None
+        with trace.stage('fetch', 'SPY') as span:
+            span.rows = 10
+        assert span is trace.null_span
+
+    def test_nested_spans_inherit_ticker(self, tracer):
+        with trace.stage('fetch', 'SPY'):
+            with trace.stage('options') as span:
+                span.rows = 42
+        options, fetch = tracer.events
+        assert (fetch.name, fetch.ticker, fetch.rows) == ('fetch', 'SPY', None)
+        assert (options.name, options.ticker, options.rows) == ('options', 'SPY', 42)
+        assert fetch.start <= options.start and options.wall <= fetch.wall
+
+    def test_memory_peak(self, tracer):
+        with trace.stage('outer') as outer:
+            with trace.stage('allocate') as inner:
+                block = bytearray(4 * 2**20)
+                del block
+        # above the memory traced when the span opened, less anything freed since
+        assert inner.peak > 3.9 * 2**20
+        assert outer.peak >= inner.peak
+
+    def test_pipeline_traces_every_ticker(self, tracer):
+        p = pipeline.Pipeline(lambda ticker: ticker, lambda ticker, data: data.lower(), workers=2)
+        p.run(['SPY', 'QQQ'])
+        stages = sorted((e.name, e.ticker) for e in tracer.events)
+        assert stages == [('compute', 'QQQ'), ('compute', 'SPY'), ('fetch', 'QQQ'), ('fetch', 'SPY')]
+        fetch_threads = {e.thread for e in tracer.events if e.name == 'fetch'}
+        assert threading.current_thread().name not in fetch_threads
+
+    def test_screen_stages(self, tracer, tmpdir):
+        cmd_coveredcalls.covered_calls_stream(FakeClient(), ['T1', 'T2'], tmpdir.join('cc.csv').strpath)
+        names = {e.name for e in tracer.events}
+        assert {'quotes', 'fetch', 'options', 'normalize', 'compute', 'raw predicates', 'metrics', 'derived predicates',
+                'csv', 'merge'} <= names
+        for e in tracer.events:
+            if e.name not in ['quotes', 'merge']:
+                assert e.ticker in ['T1', 'T2'], e
+
+        summary = tracer.summary()
+        assert summary.splitlines()[0] == 'Stages, summed over their calls:'
+        assert any(line.split()[:2] == ['fetch', '2'] for line in summary.splitlines())
+
+    def test_chrome_trace(self, tracer, tmpdir):
+        longoptions.long_puts.screen(FakeYahooClient(), ['A', 'BB'])
+        filename = tmpdir.join('trace.json').strpath
+        tracer.write(filename)
+        with open(filename) as f:
+            events = json.load(f)['traceEvents']
+        complete = [e for e in events if e['ph'] == 'X']
+        assert len(complete) == len(tracer.events)
+        for e in complete:
+            assert set(e) == {'name', 'cat', 'ph', 'ts', 'dur', 'pid', 'tid', 'args'}
+            assert e['dur'] >= 0 and 'cpu_ms' in e['args'] and 'peak_kb' in e['args']
+        options = [e for e in complete if e['cat'] == 'options']
+        assert sorted(e['args']['ticker'] for e in options) == ['A', 'BB']
+        # only the puts far enough out are fetched
+        assert all(0 < e['args']['rows'] < 300 for e in options)
+        names = {e['args']['name'] for e in events if e['ph'] == 'M'}
+        assert names == {e.thread for e in tracer.events}
+
+
+def test_trace_option(cli, tmpdir):
+    filename = tmpdir.join('trace.json').strpath
+    r = cli('--trace', filename, 'config', 'print')
+    assert 'Trace written to {}'.format(filename) in r.output
+    with open(filename) as f:
+        assert json.load(f)['traceEvents'] == []
+    assert trace._tracer is None
@@ -1,11 +1,14 @@
 import base64
 import datetime
+import io
+import json
 import mock
 import os
 import pytest
 import sh
 import struct
 import tempfile
+import threading
 import time
 import uuid
 
@@ -107,6 +110,70 @@ class TestJinjaUtils(TestHelper):
         d3 = utils.YamlUtils.yaml_dict_from_string(test_conf_self_rendered)
         assert utils.YamlUtils.yaml_dict_to_string(d2) == \
             utils.YamlUtils.yaml_dict_to_string(d3)
+        assert d1['n4'] == '{{ n2 }}'
+
+    def test_self_render_graph(self):
+        d = utils.YamlUtils.yaml_dict_from_string(test_conf_self_referencing)
+        graph = utils.TemplateGraph(d)
+        assert list(graph.dependencies) == [('n1', 'nn2'), ('n2', ), ('n4', )]
+        assert graph.dependencies[('n4', )] == [('n2', )]
+        assert graph.dependencies[('n1', 'nn2')] == []
+        assert graph.order().index(('n2', )) < graph.order().index(('n4', ))
+        assert not graph.volatile
+
+    def test_self_render_subtrees_and_lists(self):
+        d = {
+            'options': {
+                'long_puts': ['SPY', '{{ env.OPTIONS_EXTRA }}'],
+                'covered_calls': "{{ options.long_puts | join(',') }}",
+            },
+            'count': '{{ options.long_puts | length }}',
+            'first': '{% for t in options.long_puts %}{% if loop.first %}{{ t | lower }}{% endif %}{% endfor %}',
+            'env': {'OPTIONS_EXTRA': 'QQQ'},
+        }
+        graph = utils.TemplateGraph(d)
+        assert graph.dependencies[('options', 'covered_calls')] == [('options', 'long_puts', 1)]
+        assert graph.dependencies[('count', )] == [('options', 'long_puts', 1)]
+        r = graph.render()
+        assert r['options'] == {'long_puts': ['SPY', 'QQQ'], 'covered_calls': 'SPY,QQQ'}
+        assert r['count'] == '2' and r['first'] == 'spy'
+
+    def test_self_render_renders_each_template_once(self):
+        d = {'tickers': ['T{}'.format(i) for i in range(5000)]}
+        d.update({'v{}'.format(i): '{{{{ v{} }}}}x'.format(i - 1) for i in range(1, 50)})
+        d['v0'] = '{{ tickers[0] }}'
+        with mock.patch.object(utils.JinjaUtils.environment(), 'from_string',
+                               wraps=utils.JinjaUtils.environment().from_string) as from_string:
+            r = utils.JinjaUtils.dict_self_render(d)
+        assert from_string.call_count == 50
+        assert r['v49'] == 'T0' + 'x' * 49
+        assert r['tickers'] == d['tickers']
+
+    def test_self_render_cycle(self):
+        d = {'a': '{{ b.c }}', 'b': {'c': '{{ d }}', 'e': 'f'}, 'd': '{{ a }}', 'g': '{{ b.e }}'}
+        with pytest.raises(Exception, match=r'Cyclic jinja variables: a -> b\.c -> d -> a'):
+            utils.JinjaUtils.dict_self_render(d)
+        with pytest.raises(Exception, match=r'Cyclic jinja variables: a -> a'):
+            utils.JinjaUtils.dict_self_render({'a': '{{ a }}'})
+
+    def test_self_render_returns_strings(self):
+        d = {'a': 5, 'b': True, 'c': None, 'd': {3: 1.5, 'l': [1, '{{ a }}']}, 'e': '{{ a + 1 }}'}
+        assert utils.JinjaUtils.dict_self_render(d) == {
+            'a': '5',
+            'b': 'true',
+            'c': 'null',
+            'd': {'3': '1.5', 'l': ['1', '5']},
+            'e': '6',
+        }
+
+    def test_self_render_volatile(self):
+        assert utils.TemplateGraph({'password': '{{ mkpass(8) }}'}).volatile
+        assert utils.TemplateGraph({'pick': "{{ ['a', 'b'] | random }}"}).volatile
+        assert utils.TemplateGraph({'text': '{{ lipsum(1) }}'}).volatile
+        assert utils.TemplateGraph({'f': '{% filter random %}abc{% endfilter %}'}).volatile
+        assert not utils.TemplateGraph({'n': "{{ range(3) | list | join(',') | upper }}"}).volatile
+        # a key of the dict shadows the global of the same name
+        assert not utils.TemplateGraph({'uuid': 'x', 'id': '{{ uuid }}'}).volatile
 
     def test_jinja_keyword_raise(self):
         try:
@@ -264,3 +331,93 @@ class TestYamlUtils(TestHelper):
         str1 = utils.YamlUtils.yaml_dict_to_string(dict1)
         str2 = utils.YamlUtils.yaml_dict_to_string(dict2)
         assert str1 == str2
+
+
+class ThreadRecordingStream(io.StringIO):
+    """A stream that remembers the threads writing to it"""
+    def __init__(self):
+        super().__init__()
+        self.threads = set()
+
+    def write(self, s):
+        self.threads.add(threading.current_thread())
+        return super().write(s)
+
+
+class TestLogUtils(TestHelper):
+    @pytest.fixture(autouse=True)
+    def reset_structlog(self):
+        import structlog
+        utils.LogUtils.stop_fast_logger()
+        yield
+        utils.LogUtils.stop_fast_logger()
+        structlog.reset_defaults()
+
+    def log_lines(self, stream):
+        utils.LogUtils.stop_fast_logger()
+        return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+    def test_fast_logger_fields(self):
+        stream = io.StringIO()
+        log = utils.LogUtils.get_fast_logger("INFO", stream=stream)
+        log.info("hello %s", "world", b=2, a=1)
+        lines = self.log_lines(stream)
+        assert len(lines) == 1
+        log_line = lines[0]
+        assert list(log_line) == ['timestamp', 'level', 'loc', 'message', 'b', 'a']
+        assert log_line['level'] == 'INFO'
+        assert log_line['message'] == 'hello world'
+        assert log_line['loc'].startswith('test_utils.py:')
+
+    def test_fast_logger_filters_before_processing(self):
+        stream = io.StringIO()
+        processor = utils.LogUtils._add_cached_code_location
+        with mock.patch.object(utils.LogUtils, '_add_cached_code_location', side_effect=processor) as m:
+            log = utils.LogUtils.get_fast_logger("WARNING", stream=stream)
+            log.info("skipped")
+            log.debug("skipped")
+            assert m.call_count == 0
+            log.warning("kept")
+            assert m.call_count == 1
+        assert [line['message'] for line in self.log_lines(stream)] == ['kept']
+
+    def test_fast_logger_caches_locations(self):
+        stream = io.StringIO()
+        log = utils.LogUtils.get_fast_logger("INFO", stream=stream)
+
+        def hot_loop():
+            for i in range(3):
+                log.info("tick", i=i)
+
+        hot_loop()
+        assert utils.LogUtils._locations[hot_loop.__code__] == 'test_utils.py'
+        lines = self.log_lines(stream)
+        assert [line['i'] for line in lines] == [0, 1, 2]
+        line_number = hot_loop.__code__.co_firstlineno + 2
+        assert {line['loc'] for line in lines} == {'test_utils.py:{}'.format(line_number)}
+
+    def test_fast_logger_is_set_up_once(self):
+        import structlog
+        stream = io.StringIO()
+        info = utils.LogUtils.get_fast_logger("INFO", stream=stream)
+        listener = utils.LogUtils._listener
+        warning = utils.LogUtils.get_fast_logger("WARNING")
+        assert utils.LogUtils._listener is listener
+        assert not structlog.is_configured()
+        info.info("one")
+        warning.info("skipped")
+        warning.warning("two")
+        assert [line['message'] for line in self.log_lines(stream)] == ['one', 'two']
+
+    def test_fast_logger_writes_in_background(self):
+        stream = ThreadRecordingStream()
+        log = utils.LogUtils.get_fast_logger("INFO", stream=stream)
+        log.info("one")
+        try:
+            raise ValueError("bad")
+        except ValueError:
+            log.exception("two")
+        lines = self.log_lines(stream)
+        assert [line['message'] for line in lines] == ['one', 'two']
+        assert 'ValueError: bad' in lines[1]['exc_info']
+        assert stream.threads and threading.current_thread() not in stream.threads
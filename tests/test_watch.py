@@ -0,0 +1,169 @@
+import collections
+
+import pandas as pd
+import pytest
+
+from app import longoptions
+from app import watch
+from app.commands import cmd_coveredcalls
+
+from tests.test_coveredcalls import FakeClient
+from tests.test_longoptions import FakeYahooClient
+
+
+class ChangingClient(object):
+    """Serves the chains of the wrapped client, with a price moved on the tickers in moved"""
+    def __init__(self, client):
+        self.client = client
+        self.moved = collections.Counter()
+        self.calls = collections.Counter()
+
+    def quoteDF(self, ticker):
+        return self.client.quoteDF(ticker)
+
+    def optionsDF(self, ticker, **params):
+        self.calls[ticker] += 1
+        if ticker == 'T9':
+            raise ValueError("no chain for T9")
+        df = self.client.optionsDF(ticker, **params)
+        bid = 'Bid' if 'Bid' in df.columns else 'bid'
+        df[bid] = df[bid] + 0.01 * self.moved[ticker]
+        return df
+
+
+class Recorder(object):
+    """A fake strategy that records what it processes and writes"""
+    def __init__(self):
+        self.chains = {}
+        self.processed = []
+        self.written = []
+
+    def fetch(self, ticker):
+        if ticker not in self.chains:
+            raise ValueError("no chain for " + ticker)
+        return self.chains[ticker]
+
+    def process(self, ticker, df):
+        self.processed.append(ticker)
+        return df.assign(ticker=ticker)
+
+    def write(self, rows):
+        self.written.append(pd.concat(rows, ignore_index=True))
+
+
+class TestContentHash():
+    def test_equal_chains_hash_equal(self):
+        df = pd.DataFrame({'a': [1.0, 2.0], 'b': ['x', 'y']})
+        assert watch.content_hash(df) == watch.content_hash(df.copy())
+        assert watch.content_hash((df, df)) == watch.content_hash((df.copy(), df.copy()))
+
+    def test_any_change_changes_the_hash(self):
+        df = pd.DataFrame({'a': [1.0, 2.0], 'b': ['x', 'y']})
+        digest = watch.content_hash(df)
+        assert watch.content_hash(df.assign(a=[1.0, 2.01])) != digest
+        assert watch.content_hash(df.rename(columns={'a': 'c'})) != digest
+        assert watch.content_hash(df.set_axis([1, 2])) != digest
+        assert watch.content_hash(df.astype({'b': 'category'})) == digest
+
+
+class TestWatcher():
+    def test_only_changed_tickers_are_processed(self):
+        r = Recorder()
+        r.chains = {t: pd.DataFrame({'v': [float(i)]}) for i, t in enumerate(['A', 'B', 'C'])}
+        w = watch.Watcher(r.fetch, r.process, r.write, workers=2)
+
+        cycle = w.cycle(['A', 'B', 'C'])
+        assert sorted(cycle.changed) == ['A', 'B', 'C'] and cycle.written
+        assert r.written[-1]['ticker'].to_list() == ['A', 'B', 'C']
+
+        cycle = w.cycle(['A', 'B', 'C'])
+        assert cycle.changed == [] and not cycle.written
+        assert len(r.processed) == 3 and len(r.written) == 1
+        assert cycle.report().startswith('Cycle 2: 0 of 3 tickers changed in ')
+
+        r.chains['B'] = pd.DataFrame({'v': [9.0]})
+        cycle = w.cycle(['A', 'B', 'C'])
+        assert cycle.changed == ['B'] and r.processed[3:] == ['B']
+        assert r.written[-1]['v'].to_list() == [0.0, 9.0, 2.0]
+
+    def test_failed_tickers_keep_their_last_rows(self):
+        r = Recorder()
+        r.chains = {'A': pd.DataFrame({'v': [1.0]}), 'B': pd.DataFrame({'v': [2.0]})}
+        w = watch.Watcher(r.fetch, r.process, r.write)
+        w.cycle(['A', 'B'])
+
+        del r.chains['B']
+        r.chains['A'] = pd.DataFrame({'v': [3.0]})
+        cycle = w.cycle(['A', 'B'])
+        assert list(cycle.pipeline.failures) == ['B']
+        assert r.written[-1]['v'].to_list() == [3.0, 2.0]
+
+    def test_failing_tickers_back_off(self):
+        r = Recorder()
+        r.chains = {'A': pd.DataFrame({'v': [1.0]})}
+        now = [0.0]
+        w = watch.Watcher(r.fetch, r.process, r.write, backoff=10, clock=lambda: now[0])
+        retried = []
+        for t in [0, 9, 10, 29, 30]:
+            now[0] = t
+            if t == 30:
+                r.chains['B'] = pd.DataFrame({'v': [2.0]})
+            cycle = w.cycle(['A', 'B'])
+            if 'B' in cycle.pipeline.failures or 'B' in cycle.changed:
+                retried.append(t)
+        # the wait doubles after every failure, and a success clears it
+        assert retried == [0, 10, 30]
+        assert 'B' not in w.failed and r.written[-1]['v'].to_list() == [1.0, 2.0]
+
+        w.forget('B')
+        assert 'B' not in w.rows and 'B' not in w.hashes
+
+    def test_cycles_are_spaced_by_interval(self):
+        r = Recorder()
+        r.chains = {'A': pd.DataFrame({'v': [1.0]})}
+        sleeps = []
+        w = watch.Watcher(r.fetch, r.process, r.write, sleep=sleeps.append)
+        cycles = list(w.watch(['A'], interval=60, cycles=3))
+        assert [c.number for c in cycles] == [1, 2, 3]
+        assert len(sleeps) == 2
+        assert all(0 < s <= 60 for s in sleeps)
+
+
+scenarios = [
+    ('covered_calls', FakeClient(contracts=300), cmd_coveredcalls.covered_calls_stream,
+     cmd_coveredcalls.covered_calls_watcher),
+    ('long_puts', FakeYahooClient(), longoptions.long_puts.stream, longoptions.long_puts.watcher),
+    ('long_calls', FakeYahooClient(), longoptions.long_calls.stream, longoptions.long_calls.watcher),
+]
+
+
+@pytest.mark.parametrize('name,client,stream,watcher', scenarios)
+class TestStrategyWatchers():
+    def batch_output(self, client, stream, tickers, filename):
+        stream(client, tickers, filename)
+        with open(filename) as f:
+            return f.read()
+
+    def test_output_is_patched_as_chains_change(self, name, client, stream, watcher, tmpdir):
+        client = ChangingClient(client)
+        tickers = ['T1', 'T2', 'T3', 'T9']
+        output = tmpdir.join('watch.csv').strpath
+        w = watcher(client, output, workers=2)
+
+        cycle = w.cycle(tickers)
+        assert sorted(cycle.changed) == ['T1', 'T2', 'T3']
+        with open(output) as f:
+            assert f.read() == self.batch_output(client, stream, tickers, tmpdir.join('batch.csv').strpath)
+
+        # nothing moved, so nothing is processed or written
+        mtime = tmpdir.join('watch.csv').mtime()
+        cycle = w.cycle(tickers)
+        assert cycle.changed == [] and not cycle.written
+        assert tmpdir.join('watch.csv').mtime() == mtime
+
+        client.moved['T2'] += 1
+        cycle = w.cycle(tickers)
+        assert cycle.changed == ['T2']
+        with open(output) as f:
+            assert f.read() == self.batch_output(client, stream, tickers, tmpdir.join('batch.csv').strpath)
+        assert client.calls['T1'] == 5